@@ -5,6 +5,8 @@ from datetime import datetime, timedelta
 from flask import request, g, current_app, session
 import os
 from dotenv import load_dotenv
+from metrics import record_timing
+from timestamps import utc_now
 
 # Load environment variables
 load_dotenv()
@@ -21,6 +23,7 @@ class UserAnalytics:
     
     def _initialize_redis(self):
         """Initialize Redis connection for analytics using Redis Cloud configuration."""
+        self.redis = None
         redis_host = os.getenv('REDIS_HOST', 'localhost')
         redis_port = int(os.getenv('REDIS_PORT', 6379))
         redis_user = os.getenv('REDIS_USER', 'default')
@@ -56,7 +59,7 @@ class UserAnalytics:
             return
             
         try:
-            login_time = datetime.utcnow().isoformat()
+            login_time = utc_now().isoformat()
             self.redis.hset(f'user:{user_id}:sessions', login_time, '')
             self.redis.hset(f'user:{user_id}:current_session', 'login_time', login_time)
             self.redis.incr(f'user:{user_id}:login_count')
@@ -73,7 +76,7 @@ class UserAnalytics:
             current_session = self.redis.hgetall(f'user:{user_id}:current_session')
             if current_session and 'login_time' in current_session:
                 login_time = datetime.fromisoformat(current_session['login_time'])
-                session_duration = (datetime.utcnow() - login_time).total_seconds()
+                session_duration = (utc_now() - login_time).total_seconds()
                 
                 # Store session duration
                 self.redis.hset(f'user:{user_id}:sessions', current_session['login_time'], session_duration)
@@ -91,7 +94,7 @@ class UserAnalytics:
         if not user_id or not path:
             return
             
-        timestamp = datetime.utcnow().isoformat()
+        timestamp = utc_now().isoformat()
         page_key = f'user:{user_id}:page_views'
         
         # Store the page view with timestamp
@@ -109,7 +112,7 @@ class UserAnalytics:
             return
             
         action_data = {
-            'timestamp': datetime.utcnow().isoformat(),
+            'timestamp': utc_now().isoformat(),
             'action': action_type,
             'metadata': metadata or {}
         }
@@ -177,7 +180,9 @@ def init_analytics(app):
             g.request_start_time = time.time()
             try:
                 # Track the page view
+                started = time.perf_counter()
                 analytics.track_page_view(session['user_id'], request.path)
+                record_timing('redis', time.perf_counter() - started)
             except Exception as e:
                 current_app.logger.error(f"Error tracking page view: {e}")
     
@@ -195,11 +200,13 @@ def init_analytics(app):
                 
                 # Store time spent on the page (minimum 0.1 seconds to avoid tracking accidental clicks)
                 if time_spent > 0.1:
+                    started = time.perf_counter()
                     analytics.redis.hincrbyfloat(
                         f'user:{session["user_id"]}:page_times', 
                         request.path, 
                         time_spent
                     )
+                    record_timing('redis', time.perf_counter() - started)
             except Exception as e:
                 current_app.logger.error(f"Error tracking page time: {e}")
                 
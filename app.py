@@ -12,15 +12,48 @@ New features added:
 """
 
 import os
+import hmac
 import json
+import time
 import sqlite3
 from datetime import datetime
+from importlib.machinery import ModuleSpec
 from flask import (Flask, render_template, request, redirect,
-                   url_for, session, send_from_directory, flash, jsonify, abort, g)
-from werkzeug.utils import secure_filename
+                   url_for, session, send_from_directory, flash, jsonify, abort, g, Response)
 import os
+from markupsafe import Markup
+from jinja2 import FileSystemBytecodeCache
 from db_utils import get_db_connection
+from timestamps import parse_timestamp, format_timestamp, normalize_timestamps, init_timestamps, utc_now
 from gemini_chat import get_chat_response
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
+from file_serving import send_upload, precompress
+from document_processor import build_preview
+from thumbnails import RENDITIONS, can_render, find_rendition, schedule_render, render_renditions
+from view_counter import view_counter, init_view_counter
+from db_instrumentation import query_stats, init_db_instrumentation
+from metrics import registry as metrics_registry, init_metrics
+from cache import Cache, caches, invalidate, init_cache
+from notifications import (notification_broker, notification_event, unread_count, format_sse, can_hold_streams,
+                           init_notifications)
+from notification_outbox import notification_outbox, init_notification_outbox
+from session_store import revoke_sessions, init_sessions
+from passwords import (hash_password, password_hasher, PasswordHasherBusy, throttle_login,
+                       login_account_bucket, init_passwords)
+from profiler import init_profiler, list_profiles, load_profile, collapsed_stacks
+from toggles import toggle, get_count, get_counts
+from moderation import (DOCUMENT_STATUSES, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, documents_page,
+                        questions_page, status_counts, set_document_status)
+from user_stats import init_user_stats, rebuild_user_stats, get_user_stats, top_contributors, STAT_COLUMNS
+from document_pages import (MAX_PAGES_PER_REQUEST, can_paginate, build_page_index, has_page_index,
+                            read_pages, schedule_page_index)
+from derived_files import queues as background_queues
+from upload_storage import (StreamingRequest, UploadError, receive_upload, add_blob, release_blob,
+                            collect_garbage, sweep_orphans, import_legacy_file, is_blob_path,
+                            is_servable_path, remove_with_derivatives,
+                            create_chunked_upload, get_chunked_upload, append_chunk,
+                            claim_chunked_upload, MAX_OPEN_UPLOADS)
 # Import analytics with error handling
 try:
     from analytics import analytics, init_analytics
@@ -34,22 +67,30 @@ except ImportError as e:
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'dev-key-change-in-production')
+# Stream multipart file parts straight into the uploads folder
+app.request_class = StreamingRequest
+# Reverse proxies (nginx, Apache) in front of the app whose X-Forwarded-For/-Proto/-Host are trusted.
+# Behind a proxy, leaving this at 0 makes request.remote_addr the proxy's address for every client,
+# so all logins share one LOGIN_IP_* bucket; set it to the number of proxy hops.
+app.config['TRUSTED_PROXY_HOPS'] = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+if app.config['TRUSTED_PROXY_HOPS']:
+    _hops = app.config['TRUSTED_PROXY_HOPS']
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=_hops, x_proto=_hops, x_host=_hops)
 
 # Initialize analytics
 init_analytics(app)
 
+# Timestamp columns arrive as datetimes (see timestamps.py); API responses keep the stored format
+init_timestamps(app)
+
 # Add datetimeformat filter
 def datetimeformat(value, format='%Y-%m-%d %H:%M:%S'):
     if value is None:
         return ''
     if isinstance(value, str):
-        # Try to parse the string into a datetime object
-        try:
-            if 'T' in value:  # ISO format
-                value = datetime.fromisoformat(value.replace('Z', '+00:00'))
-            else:  # Try other formats if needed
-                value = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
-        except (ValueError, TypeError):
+        # Computed columns (e.g. MAX(created_at)) are not converted by sqlite3
+        value = parse_timestamp(value)
+        if isinstance(value, str):
             return value
     return value.strftime(format)
 
@@ -60,28 +101,225 @@ DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.db
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 16)) * 1024 * 1024  # Max request size
+# Larger files go through the chunked upload API, one chunk per request
+app.config['UPLOAD_CHUNK_SIZE'] = 4 * 1024 * 1024
+app.config['MAX_CHUNKED_UPLOAD_SIZE'] = int(os.environ.get('MAX_CHUNKED_UPLOAD_MB', 1024)) * 1024 * 1024
+# Chunked uploads one user may have in progress at a time
+app.config['MAX_OPEN_CHUNKED_UPLOADS'] = int(os.environ.get('MAX_OPEN_CHUNKED_UPLOADS', MAX_OPEN_UPLOADS))
+# Per-type Cache-Control overrides for served uploads, e.g. {'pdf': 'private, max-age=600'}
+app.config['UPLOAD_CACHE_POLICIES'] = {}
+# Let the front proxy send file bodies: '', 'x-sendfile' or 'x-accel-redirect' (see file_serving.py)
+app.config['FILE_OFFLOAD'] = os.environ.get('FILE_OFFLOAD', '').lower()
+app.config['FILE_OFFLOAD_PREFIX'] = os.environ.get('FILE_OFFLOAD_PREFIX', '/protected-uploads/')
+# Page views are batched in memory and written every VIEW_FLUSH_INTERVAL seconds (see view_counter.py)
+app.config['VIEW_FLUSH_INTERVAL'] = float(os.environ.get('VIEW_FLUSH_INTERVAL', 5))
+app.config['VIEW_MAX_PENDING'] = int(os.environ.get('VIEW_MAX_PENDING', 1000))
+# Repeat views by the same user within this many seconds count once (0 = count every view)
+app.config['VIEW_DEDUP_WINDOW'] = int(os.environ.get('VIEW_DEDUP_WINDOW', 0))
+init_view_counter(app)
+app.config['BOOKMARKS_PER_PAGE'] = 20
+# SQL statements slower than this are logged with their route (see db_instrumentation.py)
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100))
+# Per-request query count and time in X-DB-* response headers (always on in debug mode)
+app.config['DB_STATS_HEADERS'] = os.environ.get('DB_STATS_HEADERS', '').lower() in ('1', 'true', 'yes')
+init_db_instrumentation(app)
+# Shared by all workers so /metrics reports the whole server (see metrics.py)
+app.config['METRICS_MULTIPROC_DIR'] = os.environ.get('METRICS_MULTIPROC_DIR', '')
+app.config['METRICS_WRITE_INTERVAL'] = float(os.environ.get('METRICS_WRITE_INTERVAL', 1))
+# Bearer token for scrapers; /metrics is otherwise limited to logged-in admins. The client address
+# is deliberately not trusted: behind a reverse proxy every request comes from localhost
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')
+init_metrics(app)
+
+
+def _redis_pool_connections():
+    pool = getattr(getattr(analytics, 'redis', None), 'connection_pool', None)
+    if pool is None:
+        return {}
+    return {('in_use',): len(pool._in_use_connections),
+            ('idle',): len(pool._available_connections)}
+
+
+# Sampling profiler (see profiler.py): fraction of requests to profile, 0 = only admins sending X-Profile
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_INTERVAL'] = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+app.config['PROFILE_DIR'] = os.environ.get(
+    'PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+# Slowest profiles kept per endpoint
+app.config['PROFILE_KEEP'] = int(os.environ.get('PROFILE_KEEP', 10))
+init_profiler(app)
+
+# Read models cached across requests (see cache.py); write paths invalidate them by tag
+feed_cache = Cache('feed', maxsize=8)
+search_cache = Cache('search', maxsize=512)
+document_cache = Cache('document', maxsize=1024)
+# Rendered feed and search cards; keyed by content, so they never need invalidating
+fragment_cache = Cache('fragments', maxsize=4096, shared=False)
+app.config['CACHE_ENABLED'] = os.environ.get('CACHE_ENABLED', '1').lower() not in ('0', 'false', 'no')
+app.config['CACHE_TTL'] = int(os.environ.get('CACHE_TTL', 60))
+# Share cached values and invalidations between workers, e.g. redis://localhost:6379/1
+app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL', '')
+app.config['FRAGMENT_CACHE_TTL'] = int(os.environ.get('FRAGMENT_CACHE_TTL', 3600))
+init_cache(app)
+fragment_cache.ttl = app.config['FRAGMENT_CACHE_TTL']
+
+# Compiled templates kept on disk so new workers skip compiling them; empty = off
+app.config['JINJA_BYTECODE_CACHE_DIR'] = os.environ.get(
+    'JINJA_BYTECODE_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jinja-cache'))
+if app.config['JINJA_BYTECODE_CACHE_DIR']:
+    try:
+        os.makedirs(app.config['JINJA_BYTECODE_CACHE_DIR'], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_BYTECODE_CACHE_DIR'])
+    except OSError as e:
+        print(f"Warning: Jinja bytecode cache disabled: {str(e)}")
+
+
+def render_fragment(template_name, item, **viewer):
+    """Render one item's card with ``template_name``, reusing an earlier identical render.
+
+    The key is the template plus the item's column values and the viewer's
+    flags (``starred``, ``bookmarked``), so an edited item or a different
+    viewer state gets a fresh render on its own.
+    """
+    template = app.jinja_env.get_template(template_name)
+    key = (template, tuple(item.items()), tuple(sorted(viewer.items())))
+    return fragment_cache.get_or_set(key, (), lambda: Markup(template.render(item=item, **viewer)))
+
+app.jinja_env.globals['render_fragment'] = render_fragment
+
+# Notification streams (see notifications.py); Redis lets any worker reach any open stream
+app.config['NOTIFICATIONS_REDIS_URL'] = os.environ.get('NOTIFICATIONS_REDIS_URL', '')
+# Keep-alive comment interval, and how long a stream lives before the browser reconnects
+app.config['NOTIFICATIONS_HEARTBEAT'] = float(os.environ.get('NOTIFICATIONS_HEARTBEAT', 15))
+app.config['NOTIFICATIONS_STREAM_SECONDS'] = float(os.environ.get('NOTIFICATIONS_STREAM_SECONDS', 300))
+# Open streams allowed per user and worker; further tabs (and every tab on a sync gunicorn worker,
+# which can't hold streams - use gunicorn.conf.py's gthread workers) reconnect every NOTIFICATIONS_POLL_SECONDS
+app.config['NOTIFICATIONS_MAX_STREAMS'] = int(os.environ.get('NOTIFICATIONS_MAX_STREAMS', 4))
+app.config['NOTIFICATIONS_POLL_SECONDS'] = float(os.environ.get('NOTIFICATIONS_POLL_SECONDS', 60))
+init_notifications(app)
+# Notifications are queued and written in batches every NOTIFICATION_FLUSH_INTERVAL seconds
+app.config['NOTIFICATION_FLUSH_INTERVAL'] = float(os.environ.get('NOTIFICATION_FLUSH_INTERVAL', 1))
+app.config['NOTIFICATION_MAX_PENDING'] = int(os.environ.get('NOTIFICATION_MAX_PENDING', 500))
+# Unread notifications older than this many seconds are folded into one digest (0 = never)
+app.config['NOTIFICATION_DIGEST_AFTER'] = int(os.environ.get('NOTIFICATION_DIGEST_AFTER', 7 * 24 * 3600))
+app.config['NOTIFICATION_DIGEST_INTERVAL'] = int(os.environ.get('NOTIFICATION_DIGEST_INTERVAL', 3600))
+init_notification_outbox(app)
+# Sessions live server-side behind an opaque cookie (see session_store.py): 'sqlite', 'redis' or 'cookie'
+app.config['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND', 'sqlite').lower()
+app.config['SESSION_REDIS_URL'] = os.environ.get('SESSION_REDIS_URL', 'redis://localhost:6379/0')
+# Idle sessions end after SESSION_LIFETIME seconds; the stored expiry is bumped at most every SESSION_REFRESH_SECONDS
+app.config['SESSION_LIFETIME'] = int(os.environ.get('SESSION_LIFETIME', 7 * 24 * 3600))
+app.config['SESSION_REFRESH_SECONDS'] = int(os.environ.get('SESSION_REFRESH_SECONDS', 3600))
+# Hot sessions are reused from memory for this long; also how long a revoked session may linger in other workers
+app.config['SESSION_CACHE_SECONDS'] = float(os.environ.get('SESSION_CACHE_SECONDS', 10))
+app.config['SESSION_CACHE_SIZE'] = int(os.environ.get('SESSION_CACHE_SIZE', 10000))
+init_sessions(app)
+# Password hashes run in PASSWORD_WORKERS processes (0 = on the request thread, see passwords.py);
+# beyond PASSWORD_MAX_QUEUE waiting hashes, logins get a 503 instead of queueing
+app.config['PASSWORD_WORKERS'] = int(os.environ.get('PASSWORD_WORKERS', 2))
+app.config['PASSWORD_MAX_QUEUE'] = int(os.environ.get('PASSWORD_MAX_QUEUE', 16))
+app.config['PASSWORD_TIMEOUT'] = float(os.environ.get('PASSWORD_TIMEOUT', 5))
+# Stored hashes with other parameters are upgraded at the user's next login
+app.config['PASSWORD_ITERATIONS'] = int(os.environ.get('PASSWORD_ITERATIONS', 100000))
+# Login attempts per minute after a burst, per client IP and per account (burst 0 = unlimited).
+# The IP is request.remote_addr: behind a reverse proxy set TRUSTED_PROXY_HOPS (above) so it is
+# the client's, not the proxy's
+app.config['LOGIN_IP_RATE'] = float(os.environ.get('LOGIN_IP_RATE', 10))
+app.config['LOGIN_IP_BURST'] = int(os.environ.get('LOGIN_IP_BURST', 20))
+app.config['LOGIN_ACCOUNT_RATE'] = float(os.environ.get('LOGIN_ACCOUNT_RATE', 2))
+app.config['LOGIN_ACCOUNT_BURST'] = int(os.environ.get('LOGIN_ACCOUNT_BURST', 5))
+init_passwords(app)
+
+
+metrics_registry.gauge('view_counter_pending_views', 'Page views waiting to be written.',
+                       lambda: view_counter.stats()['pending_views'])
+metrics_registry.gauge('view_counter_pending_age_seconds', 'Age of the oldest unwritten page view.',
+                       lambda: view_counter.stats()['pending_age_seconds'])
+metrics_registry.gauge('background_queue_length', 'Files queued or being processed per background queue.',
+                       lambda: {(name,): queue.queue_length() for name, queue in background_queues.items()},
+                       ('queue',))
+metrics_registry.gauge('notification_outbox_pending', 'Notifications waiting to be written.',
+                       lambda: notification_outbox.stats()['pending'])
+metrics_registry.gauge('notification_streams', 'Open notification streams.',
+                       lambda: notification_broker.stats()['subscribers'])
+metrics_registry.gauge('password_hashes_in_flight', 'Password hashes running or queued in this worker.',
+                       lambda: password_hasher.stats()['in_flight'])
+metrics_registry.gauge('redis_pool_connections', 'Connections in the analytics Redis pool.',
+                       _redis_pool_connections, ('state',))
 
 
 # Database connection is now imported from db_utils
 
 
-def hash_password(password):
-    # In a real application, use a proper password hashing library like bcrypt or Argon2
-    # This is a simplified example and should not be used in production
-    import hashlib
-    import os
-    salt = os.urandom(16)
-    pwd_hash = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000)
-    return salt.hex() + pwd_hash.hex()
+def store_uploaded_file(conn):
+    """Store the file attached to the current request in the blob store.
 
-def verify_password(stored_password, provided_password):
-    # Verify the provided password against the stored hash
-    import hashlib
-    salt = bytes.fromhex(stored_password[:32])  # First 32 chars are salt
-    stored_hash = stored_password[32:]  # Rest is the hash
-    pwd_hash = hashlib.pbkdf2_hmac('sha256', provided_password.encode('utf-8'), salt, 100000)
-    return pwd_hash.hex() == stored_hash
+    Accepts either a regular ``file`` field or the ``upload_id`` of a completed
+    chunked upload. The blob reference is taken on ``conn`` and committed with
+    the row that points at it. Returns the blob path, or None when no file was sent.
+    """
+    upload_folder = app.config['UPLOAD_FOLDER']
+    upload_id = request.form.get('upload_id', '').strip()
+    if upload_id:
+        temp_path, sha256, size, original_name = claim_chunked_upload(
+            upload_folder, upload_id, session['user_id'])
+    else:
+        uploaded_file = request.files.get('file')
+        if not uploaded_file or not uploaded_file.filename:
+            return None
+        temp_path, sha256, size = receive_upload(uploaded_file, upload_folder)
+        original_name = uploaded_file.filename
+
+    path = add_blob(conn, upload_folder, temp_path, sha256, size, original_name)
+    # Build .gz/.br variants of text uploads now rather than on the first view
+    precompress(os.path.join(upload_folder, *path.split('/')))
+    schedule_render(upload_folder, path)
+    schedule_page_index(upload_folder, path)
+    return path
+
+def describe_uploaded_file(file_path):
+    """Return the preview columns (excerpt, page_count, file_size) for a stored file."""
+    if not file_path:
+        return {'excerpt': None, 'page_count': None, 'file_size': None}
+    return build_preview(os.path.join(app.config['UPLOAD_FOLDER'], *file_path.split('/')))
+
+def document_file_type(file_path):
+    """Classify a document's file for the preview UI."""
+    ext = os.path.splitext(file_path or '')[1].lower()
+    if ext == '.pdf':
+        return 'pdf'
+    if ext in ('.jpg', '.jpeg', '.png', '.gif'):
+        return 'image'
+    if ext in ('.doc', '.docx'):
+        return 'document'
+    if ext in ('.xls', '.xlsx'):
+        return 'spreadsheet'
+    if ext in ('.html', '.htm'):
+        return 'html'
+    return 'other'
+
+def rendition_url(file_path, kind='thumb'):
+    """URL of a document's thumbnail or first-page image, or None if it has none."""
+    if not (is_blob_path(file_path) and can_render(file_path)):
+        return None
+    return url_for('document_rendition', kind=kind, filename=file_path)
+
+app.jinja_env.globals['rendition_url'] = rendition_url
+
+def release_uploaded_file(conn, file_path):
+    """Drop a row's reference to its file.
+
+    Blobs are removed by ``collect_garbage`` once unreferenced; files stored
+    before the blob store existed are deleted directly.
+    """
+    if not file_path or release_blob(conn, file_path):
+        return
+    try:
+        legacy_path = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(file_path))
+        remove_with_derivatives(legacy_path)
+    except Exception as e:
+        app.logger.error(f'Error deleting file {file_path}: {str(e)}')
 
 def init_db():
     conn = None
@@ -208,16 +446,39 @@ def init_db():
             )
         ''')
         
+        # Per-item totals of stars, bookmarks etc., maintained by toggles.py
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ItemCounters (
+                item_type TEXT NOT NULL,
+                item_id INTEGER NOT NULL,
+                counter TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (item_type, item_id, counter)
+            )
+        ''')
+        
         # Create indexes after all tables are created
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_documents_user ON Documents(user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_questions_user ON Questions(user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_answers_question ON Answers(question_id)')
+        # Profile pages: a user's newest documents and questions
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_documents_user_created ON Documents(user_id, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_questions_user_created ON Questions(user_id, created_at)')
+        # Question pages list answers accepted first, then oldest first
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_answers_question_accepted '
+                       'ON Answers(question_id, is_accepted DESC, created_at)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_answers_user ON Answers(user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_stars_user ON Stars(user_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_stars_item ON Stars(item_type, item_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_votes_user ON Votes(user_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_votes_answer ON Votes(answer_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_bookmarks_user ON Bookmarks(user_id)')
+        # Superseded by the composite indexes above and the UNIQUE(user_id, item_type, item_id)
+        # constraints on Stars and Bookmarks, which start with the same columns
+        for index in ('idx_documents_user', 'idx_questions_user', 'idx_answers_question',
+                      'idx_stars_user', 'idx_bookmarks_user'):
+            cursor.execute(f'DROP INDEX IF EXISTS {index}')
+        # Moderation queues: filter by status and page by creation time
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_documents_status_created ON Documents(status, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_documents_created ON Documents(created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_questions_created ON Questions(created_at)')
+        # Serves the bookmarks page in order without sorting
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_bookmarks_user_created ON Bookmarks(user_id, created_at)')
 
         # Documents table
         cursor.execute(
@@ -246,6 +507,13 @@ def init_db():
             cursor.execute('ALTER TABLE Documents ADD COLUMN updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
         if 'views' not in existing_cols:
             cursor.execute('ALTER TABLE Documents ADD COLUMN views INTEGER DEFAULT 0')
+        # Preview metadata computed when the file is stored (see build_preview)
+        if 'excerpt' not in existing_cols:
+            cursor.execute('ALTER TABLE Documents ADD COLUMN excerpt TEXT')
+        if 'page_count' not in existing_cols:
+            cursor.execute('ALTER TABLE Documents ADD COLUMN page_count INTEGER')
+        if 'file_size' not in existing_cols:
+            cursor.execute('ALTER TABLE Documents ADD COLUMN file_size INTEGER')
 
         # Questions table
         cursor.execute(
@@ -325,8 +593,55 @@ def init_db():
                    link TEXT,
                    is_read BOOLEAN DEFAULT 0,
                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                   group_key TEXT,
+                   event_count INTEGER NOT NULL DEFAULT 1,
+                   version INTEGER,
                    FOREIGN KEY (user_id) REFERENCES Users(id)
                )''')
+        # Grouped notifications (see notification_outbox.py)
+        cursor.execute("PRAGMA table_info(Notifications)")
+        notification_cols = [row['name'] for row in cursor.fetchall()]
+        if 'group_key' not in notification_cols:
+            cursor.execute('ALTER TABLE Notifications ADD COLUMN group_key TEXT')
+        if 'event_count' not in notification_cols:
+            cursor.execute('ALTER TABLE Notifications ADD COLUMN event_count INTEGER NOT NULL DEFAULT 1')
+        if 'version' not in notification_cols:
+            cursor.execute('ALTER TABLE Notifications ADD COLUMN version INTEGER')
+        # Rows written without one (older rows, imports) are versioned in id order
+        cursor.execute('UPDATE Notifications SET version = id WHERE version IS NULL')
+
+        # Server-side sessions (see session_store.py); id is a SHA-256 of the cookie value
+        cursor.execute(
+            '''CREATE TABLE IF NOT EXISTS Sessions (
+                   id TEXT PRIMARY KEY,
+                   user_id INTEGER,
+                   data TEXT NOT NULL,
+                   expires_at TIMESTAMP NOT NULL
+               )''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_user ON Sessions(user_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON Sessions(expires_at)')
+
+        # Content-addressed upload storage; Documents/Questions.file_path point at Blobs.path
+        cursor.execute(
+            '''CREATE TABLE IF NOT EXISTS Blobs (
+                   path TEXT PRIMARY KEY,
+                   sha256 TEXT NOT NULL,
+                   size INTEGER NOT NULL,
+                   ref_count INTEGER NOT NULL DEFAULT 0,
+                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+               )''')
+
+        # Unread notifications per user, newest first
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_user_unread '
+                       'ON Notifications(user_id, is_read, created_at)')
+        # Stream replay: a user's rows changed since the browser's Last-Event-ID
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_user_version '
+                       'ON Notifications(user_id, version)')
+        # At most one unread row per group, which new events in the group update
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_notifications_unread_group '
+                       'ON Notifications(user_id, group_key) WHERE is_read = 0 AND group_key IS NOT NULL')
+        # Garbage collection only ever looks for unreferenced blobs
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_blobs_unreferenced ON Blobs(ref_count) WHERE ref_count <= 0')
 
         # Seed users
         existing_users = cursor.execute('SELECT COUNT(*) AS count FROM Users').fetchone()['count']
@@ -395,6 +710,12 @@ def init_db():
                        VALUES (?, ?, ?, ?, ?, ?)''',
                     (title, description, tags, status, user_id, file_path))
 
+        # Per-user contribution counts, kept current by triggers
+        init_user_stats(conn)
+
+        # Rewrite timestamps stored in older formats (e.g. isoformat last_login)
+        normalize_timestamps(conn)
+
         conn.commit()
         print("Database initialized successfully")
         
@@ -448,7 +769,12 @@ def signup():
                 return redirect(url_for('login'))
             
             # Hash the password
-            hashed_password = hash_password(password)
+            try:
+                hashed_password = password_hasher.hash(password)
+            except PasswordHasherBusy:
+                conn.close()
+                flash('Sign-up is busy right now. Please try again in a moment.', 'warning')
+                return render_template('signup.html'), 503, {'Retry-After': '1'}
             
             # Create new user
             try:
@@ -486,13 +812,34 @@ def login():
     error = None
     if request.method == 'POST':
         email = request.form.get('email')
-        password = request.form.get('password')
-        
+        password = request.form.get('password') or ''
+
+        # Throttle before any hashing is spent on the attempt
+        wait = throttle_login(request.remote_addr, email)
+        if wait:
+            error = 'Too many sign-in attempts. Please wait a moment and try again.'
+            return render_template('login.html', error=error), 429, {'Retry-After': str(int(wait) + 1)}
+
         conn = get_db_connection()
         user = conn.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
         conn.close()
-        
-        if user and verify_password(user['password'], password):
+
+        try:
+            valid = user is not None and password_hasher.verify(user['password'], password)
+        except PasswordHasherBusy:
+            error = 'Sign-in is busy right now. Please try again in a moment.'
+            return render_template('login.html', error=error), 503, {'Retry-After': '1'}
+
+        if valid:
+            login_account_bucket.reset((email or '').strip().lower())
+            # Upgrade an old-format hash while the password is at hand; the next login retries if busy
+            new_hash = None
+            if password_hasher.needs_rehash(user['password']):
+                try:
+                    new_hash = password_hasher.hash(password)
+                except PasswordHasherBusy:
+                    pass
+
             session['user_id'] = user['id']
             session['email'] = user['email']
             session['name'] = user['name']
@@ -502,7 +849,7 @@ def login():
             analytics.track_login(user['id'])
             
             # Update last login time
-            login_time = datetime.utcnow()
+            login_time = utc_now()
             conn = get_db_connection()
             try:
                 # Check if last_login column exists
@@ -517,7 +864,10 @@ def login():
                 
                 # Update the last login time
                 cursor.execute('UPDATE Users SET last_login = ? WHERE id = ?', 
-                            (login_time.isoformat(), user['id']))
+                            (login_time, user['id']))
+                if new_hash:
+                    cursor.execute('UPDATE Users SET password = ? WHERE id = ? AND password = ?',
+                                   (new_hash, user['id'], user['password']))
                 conn.commit()
             except Exception as e:
                 print(f"Error updating last login: {e}")
@@ -584,45 +934,13 @@ def profile(user_id: int):
         LIMIT 10
     ''', (user_id,)).fetchall()
     
-    # Get user's answers with star counts
-    answers = conn.execute('''
-        SELECT a.*, 
-               (SELECT COUNT(*) FROM Stars WHERE item_type = 'answer' AND item_id = a.id) as star_count
-        FROM Answers a 
-        WHERE a.user_id = ? 
-        ORDER BY a.created_at DESC 
-        LIMIT 10
-    ''', (user_id,)).fetchall()
-    
-    # Get user's answers count
-    answers_count = conn.execute(
-        'SELECT COUNT(*) as count FROM Answers WHERE user_id = ?',
-        (user_id,)).fetchone()['count']
-    
-    # Calculate total stars received by user
-    total_stars = conn.execute('''
-        SELECT COUNT(*) as count 
-        FROM Stars 
-        WHERE item_id IN (
-            SELECT id FROM Documents WHERE user_id = ?
-            UNION ALL
-            SELECT id FROM Answers WHERE user_id = ?
-        )
-    ''', (user_id, user_id)).fetchone()['count']
+    stats = get_user_stats(conn, user_id)
     
     conn.close()
     
     # Convert SQLite Row objects to dictionaries
     docs = [dict(doc) for doc in docs]
     questions = [dict(q) for q in questions]
-    answers = [dict(a) for a in answers]
-    
-    stats = {
-        'documents': len(docs),
-        'questions': len(questions),
-        'answers': answers_count,
-        'total_stars': total_stars
-    }
     
     return render_template('profile.html', user=user, stats=stats, docs=docs, questions=questions)
 
@@ -642,6 +960,7 @@ def edit_profile():
             'UPDATE Users SET name = ?, bio = ? WHERE id = ?',
             (name, bio, session['user_id']))
         conn.commit()
+        invalidate('users')
         session['name'] = name
         flash('Profile updated successfully!', 'success')
         conn.close()
@@ -652,14 +971,13 @@ def edit_profile():
     return render_template('edit_profile.html', user=user)
 
 
-@app.route('/feed')
-def feed():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    # Get sort parameter from URL, default to 'newest'
-    sort_by = request.args.get('sort', 'newest')
-    
+FEED_SORTS = ('newest', 'most_viewed', 'most_stars')
+# Everything a feed page shows comes from these tables
+FEED_CACHE_TAGS = ('documents', 'questions', 'users', 'stars')
+
+
+def load_feed(sort_by):
+    """All verified documents and all questions as one list, in ``sort_by`` order."""
     conn = get_db_connection()
     
     # Base query for documents
@@ -736,13 +1054,100 @@ def feed():
     
     # If sorting by stars, we need to sort the combined list since stars are calculated in the query
     if sort_by == 'most_stars':
-        items_sorted = sorted(items, key=lambda x: (x.get('star_count', 0), x.get('created_at', '')), reverse=True)
+        items_sorted = sorted(items, key=lambda x: (x.get('star_count', 0), x['created_at'] or datetime.min), reverse=True)
     elif sort_by == 'most_viewed':
-        items_sorted = sorted(items, key=lambda x: (x.get('views', 0), x.get('created_at', '')), reverse=True)
+        items_sorted = sorted(items, key=lambda x: (x.get('views', 0), x['created_at'] or datetime.min), reverse=True)
     else:  # newest
-        items_sorted = sorted(items, key=lambda x: x.get('created_at', ''), reverse=True)
+        items_sorted = sorted(items, key=lambda x: x['created_at'] or datetime.min, reverse=True)
+    
+    return items_sorted
+
+
+@app.route('/feed')
+def feed():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
     
-    return render_template('feed.html', items=items_sorted, sort_by=sort_by)
+    # Get sort parameter from URL, default to 'newest'
+    sort_by = request.args.get('sort', 'newest')
+    if sort_by not in FEED_SORTS:
+        sort_by = 'newest'
+    
+    items = feed_cache.get_or_set(sort_by, FEED_CACHE_TAGS, lambda: load_feed(sort_by))
+    
+    # What this viewer has starred and bookmarked, for the card buttons
+    conn = get_db_connection()
+    starred_items = {(row['item_type'], row['item_id']) for row in conn.execute(
+        'SELECT item_type, item_id FROM Stars WHERE user_id = ?', (session['user_id'],))}
+    bookmarked_items = {(row['item_type'], row['item_id']) for row in conn.execute(
+        'SELECT item_type, item_id FROM Bookmarks WHERE user_id = ?', (session['user_id'],))}
+    conn.close()
+    return render_template('feed.html', items=items, sort_by=sort_by,
+                           starred_items=starred_items, bookmarked_items=bookmarked_items)
+
+
+SEARCH_CACHE_TAGS = ('documents', 'questions', 'users')
+
+
+def normalize_search_query(query):
+    """Collapse whitespace, and case for ASCII queries (LIKE ignores ASCII case anyway)."""
+    query = ' '.join(query.split())
+    return query.lower() if query.isascii() else query
+
+
+def load_search_results(query, type_filter, status_filter):
+    """Documents and questions matching ``query``, newest first."""
+    conn = get_db_connection()
+    result_rows = []
+    
+    if type_filter in ('All', 'Documents'):
+        sql = '''SELECT Documents.id AS id, Documents.title AS title,
+                        Documents.description AS description,
+                        Documents.tags AS tags,
+                        Documents.status AS status,
+                        Documents.views AS views,
+                        Users.email AS author,
+                        Users.name AS author_name,
+                        Users.id AS author_id,
+                        Documents.file_path AS file_path,
+                        Documents.created_at AS created_at,
+                        'Document' AS type
+                 FROM Documents
+                 JOIN Users ON Documents.user_id = Users.id
+                 WHERE (Documents.title LIKE ? OR Documents.tags LIKE ? OR Documents.description LIKE ?)'''
+        params = [f'%{query}%', f'%{query}%', f'%{query}%'] if query else ['%%', '%%', '%%']
+        if status_filter not in ('All', ''):
+            sql += ' AND Documents.status = ?'
+            params.append(status_filter)
+        docs = conn.execute(sql, params).fetchall()
+        result_rows.extend(docs)
+    
+    if type_filter in ('All', 'Questions'):
+        sql = '''SELECT Questions.id AS id, Questions.title AS title,
+                        Questions.description AS description,
+                        Questions.tags AS tags,
+                        Questions.status AS status,
+                        Questions.views AS views,
+                        Users.email AS author,
+                        Users.name AS author_name,
+                        Users.id AS author_id,
+                        Questions.file_path AS file_path,
+                        Questions.created_at AS created_at,
+                        'Question' AS type,
+                        (SELECT COUNT(*) FROM Answers WHERE question_id = Questions.id) AS answer_count
+                 FROM Questions
+                 JOIN Users ON Questions.user_id = Users.id
+                 WHERE (Questions.title LIKE ? OR Questions.tags LIKE ? OR Questions.description LIKE ?)'''
+        params = [f'%{query}%', f'%{query}%', f'%{query}%'] if query else ['%%', '%%', '%%']
+        if status_filter not in ('All', ''):
+            sql += ' AND Questions.status = ?'
+            params.append(status_filter)
+        qns = conn.execute(sql, params).fetchall()
+        result_rows.extend(qns)
+    
+    results = sorted((dict(row) for row in result_rows), key=lambda r: r['created_at'] or datetime.min, reverse=True)
+    conn.close()
+    return results
 
 
 @app.route('/search', methods=['GET', 'POST'])
@@ -760,56 +1165,10 @@ def search():
         type_filter = request.form.get('type_filter', 'All')
         status_filter = request.form.get('status_filter', 'All')
         
-        conn = get_db_connection()
-        result_rows = []
-        
-        if type_filter in ('All', 'Documents'):
-            sql = '''SELECT Documents.id AS id, Documents.title AS title,
-                            Documents.description AS description,
-                            Documents.tags AS tags,
-                            Documents.status AS status,
-                            Documents.views AS views,
-                            Users.email AS author,
-                            Users.name AS author_name,
-                            Users.id AS author_id,
-                            Documents.file_path AS file_path,
-                            Documents.created_at AS created_at,
-                            'Document' AS type
-                     FROM Documents
-                     JOIN Users ON Documents.user_id = Users.id
-                     WHERE (Documents.title LIKE ? OR Documents.tags LIKE ? OR Documents.description LIKE ?)'''
-            params = [f'%{query}%', f'%{query}%', f'%{query}%'] if query else ['%%', '%%', '%%']
-            if status_filter not in ('All', ''):
-                sql += ' AND Documents.status = ?'
-                params.append(status_filter)
-            docs = conn.execute(sql, params).fetchall()
-            result_rows.extend(docs)
-        
-        if type_filter in ('All', 'Questions'):
-            sql = '''SELECT Questions.id AS id, Questions.title AS title,
-                            Questions.description AS description,
-                            Questions.tags AS tags,
-                            Questions.status AS status,
-                            Questions.views AS views,
-                            Users.email AS author,
-                            Users.name AS author_name,
-                            Users.id AS author_id,
-                            Questions.file_path AS file_path,
-                            Questions.created_at AS created_at,
-                            'Question' AS type,
-                            (SELECT COUNT(*) FROM Answers WHERE question_id = Questions.id) AS answer_count
-                     FROM Questions
-                     JOIN Users ON Questions.user_id = Users.id
-                     WHERE (Questions.title LIKE ? OR Questions.tags LIKE ? OR Questions.description LIKE ?)'''
-            params = [f'%{query}%', f'%{query}%', f'%{query}%'] if query else ['%%', '%%', '%%']
-            if status_filter not in ('All', ''):
-                sql += ' AND Questions.status = ?'
-                params.append(status_filter)
-            qns = conn.execute(sql, params).fetchall()
-            result_rows.extend(qns)
-        
-        results = sorted(result_rows, key=lambda r: r['created_at'] or '', reverse=True)
-        conn.close()
+        normalized = normalize_search_query(query)
+        key = json.dumps([normalized, type_filter, status_filter])
+        results = search_cache.get_or_set(
+            key, SEARCH_CACHE_TAGS, lambda: load_search_results(normalized, type_filter, status_filter))
     
     return render_template('search.html', results=results, query=query,
                            type_filter=type_filter, status_filter=status_filter)
@@ -830,37 +1189,38 @@ def post_document():
         request_verification = request.form.get('request_verification') == 'on'
         professor_id = request.form.get('professor_id')
         
-        uploaded_file = request.files.get('file')
-        file_path = None
-        if uploaded_file and uploaded_file.filename:
-            filename = secure_filename(uploaded_file.filename)
-            timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
-            filename = f"{timestamp}_{filename}"
-            save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            uploaded_file.save(save_path)
-            file_path = filename
-        
         if title:
+            file_path = store_uploaded_file(conn)
+            preview = describe_uploaded_file(file_path)
             if request_verification and professor_id:
                 # Insert with verification request
-                conn.execute(
+                cursor = conn.execute(
                     '''INSERT INTO Documents (title, description, tags, content,
-                                          status, user_id, file_path, verification_requested, verified_by)
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                                          status, user_id, file_path, verification_requested, verified_by,
+                                          excerpt, page_count, file_size)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
                     (title, description, tags, content, 'Pending',
-                     session['user_id'], file_path, 1, professor_id))
+                     session['user_id'], file_path, 1, professor_id,
+                     preview['excerpt'], preview['page_count'], preview['file_size']))
                 flash('Document submitted with verification request!', 'success')
             else:
                 # Insert without verification request
                 conn.execute(
                     '''INSERT INTO Documents (title, description, tags, content,
-                                          status, user_id, file_path)
-                       VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                                          status, user_id, file_path,
+                                          excerpt, page_count, file_size)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
                     (title, description, tags, content, 'Pending',
-                     session['user_id'], file_path))
+                     session['user_id'], file_path,
+                     preview['excerpt'], preview['page_count'], preview['file_size']))
                 flash('Document submitted for review!', 'success')
             
             conn.commit()
+            invalidate('documents')
+            if request_verification and professor_id and professor_id.isdigit():
+                notification_outbox.add(int(professor_id), 'verification_request',
+                                        link=url_for('view_document', doc_id=cursor.lastrowid),
+                                        actor=session['name'], title=title)
             conn.close()
             return redirect(url_for('feed'))
     
@@ -881,33 +1241,29 @@ def view_document(doc_id):
     conn = get_db_connection()
     
     # Get document with author info
-    document_row = conn.execute('''
-        SELECT d.*, u.email as author, u.name as author_name, u.id as author_id
-        FROM Documents d
-        JOIN Users u ON d.user_id = u.id
-        WHERE d.id = ?
-    ''', (doc_id,)).fetchone()
+    def load_document():
+        row = conn.execute('''
+            SELECT d.*, u.email as author, u.name as author_name, u.id as author_id
+            FROM Documents d
+            JOIN Users u ON d.user_id = u.id
+            WHERE d.id = ?
+        ''', (doc_id,)).fetchone()
+        return dict(row) if row else None
+    
+    document_row = document_cache.get_or_set(doc_id, (f'document:{doc_id}', 'users'), load_document)
     
     if not document_row:
         conn.close()
         flash('Document not found.', 'error')
         return redirect(url_for('feed'))
     
-    # Convert row to dict for template
+    # Copy the cached row for the template
     document = dict(document_row)
     
     # Ensure file_path is a string and properly formatted
     if 'file_path' in document and document['file_path']:
         document['file_path'] = document['file_path'].lstrip('/')  # Remove leading slash if present
     
-    # Convert created_at to datetime object if it's a string
-    if isinstance(document.get('created_at'), str):
-        from datetime import datetime
-        try:
-            document['created_at'] = datetime.strptime(document['created_at'], '%Y-%m-%d %H:%M:%S')
-        except (ValueError, TypeError):
-            document['created_at'] = None
-    
     # Check if current user has starred this document
     is_starred = False
     star_count = 0
@@ -921,18 +1277,14 @@ def view_document(doc_id):
         is_starred = star is not None
         
         # Get total star count for this document
-        star_count_result = conn.execute(
-            'SELECT COUNT(*) as count FROM Stars WHERE item_type = ? AND item_id = ?',
-            ('document', doc_id)
-        ).fetchone()
-        star_count = star_count_result['count'] if star_count_result else 0
-    
-    # Increment view count
-    conn.execute('UPDATE Documents SET views = COALESCE(views, 0) + 1 WHERE id = ?', (doc_id,))
-    conn.commit()
+        star_count = get_count(conn, 'star', 'document', doc_id)
     
     conn.close()
     
+    # Count the view; it is written to the database in the next batch
+    view_counter.record('document', doc_id, session.get('user_id'))
+    document['views'] = (document.get('views') or 0) + view_counter.pending('document', doc_id)
+    
     return render_template('document_detail.html', 
                          document=document,
                          is_starred=is_starred,
@@ -949,30 +1301,60 @@ def ask():
         description = request.form.get('description', '').strip()
         tags = request.form.get('tags', '').strip()
         
-        uploaded_file = request.files.get('file')
-        file_path = None
-        if uploaded_file and uploaded_file.filename:
-            filename = secure_filename(uploaded_file.filename)
-            timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
-            filename = f"{timestamp}_{filename}"
-            save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            uploaded_file.save(save_path)
-            file_path = filename
-        
         if title:
             conn = get_db_connection()
+            file_path = store_uploaded_file(conn)
             conn.execute(
                 '''INSERT INTO Questions (title, description, tags, status, user_id, file_path)
                    VALUES (?, ?, ?, ?, ?, ?)''',
                 (title, description, tags, 'Pending', session['user_id'], file_path))
             conn.commit()
             conn.close()
+            invalidate('questions')
             flash('Question posted successfully!', 'success')
             return redirect(url_for('feed'))
     
     return render_template('ask.html')
 
 
+@app.errorhandler(UploadError)
+def handle_upload_error(error):
+    if request.path.startswith('/api/'):
+        return jsonify({'error': error.message}), error.status
+    flash(error.message, 'danger')
+    return redirect(request.url)
+
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """Start a resumable chunked upload."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    status = create_chunked_upload(app.config['UPLOAD_FOLDER'], session['user_id'],
+                                   data.get('filename'), data.get('size'),
+                                   app.config['MAX_CHUNKED_UPLOAD_SIZE'],
+                                   app.config['MAX_OPEN_CHUNKED_UPLOADS'])
+    status['chunk_size'] = app.config['UPLOAD_CHUNK_SIZE']
+    return jsonify(status), 201
+
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'PUT'])
+def chunked_upload(upload_id):
+    """Report the resume offset of a chunked upload, or append the next chunk to it."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    if request.method == 'PUT':
+        status = append_chunk(app.config['UPLOAD_FOLDER'], upload_id, session['user_id'],
+                              request.stream, request.headers.get('Content-Range'))
+    else:
+        status = get_chunked_upload(app.config['UPLOAD_FOLDER'], upload_id, session['user_id'])
+    status['chunk_size'] = app.config['UPLOAD_CHUNK_SIZE']
+    return jsonify(status)
+
+
 @app.route('/questions/<int:question_id>', methods=['GET', 'POST'])
 def question_detail(question_id: int):
     if 'user_id' not in session:
@@ -980,10 +1362,6 @@ def question_detail(question_id: int):
     
     conn = get_db_connection()
     
-    # Increment view count
-    conn.execute('UPDATE Questions SET views = views + 1 WHERE id = ?', (question_id,))
-    conn.commit()
-    
     question = conn.execute(
         '''SELECT Questions.*, Users.email AS author, Users.name AS author_name, Users.id AS author_id
            FROM Questions
@@ -1003,16 +1381,14 @@ def question_detail(question_id: int):
                    VALUES (?, ?, ?)''',
                 (question_id, content, session['user_id']))
             conn.commit()
+            # Answer counts are part of the cached question listings
+            invalidate('questions')
             
-            # Create notification for question author
+            # Notify the question author; answers to one question collapse into one notification
             if question['user_id'] != session['user_id']:
-                conn.execute(
-                    '''INSERT INTO Notifications (user_id, message, link)
-                       VALUES (?, ?, ?)''',
-                    (question['user_id'],
-                     f"{session['name']} answered your question",
-                     url_for('question_detail', question_id=question_id)))
-                conn.commit()
+                notification_outbox.add(question['user_id'], 'answer',
+                                        link=url_for('question_detail', question_id=question_id),
+                                        group=question_id, actor=session['name'], title=question['title'])
             
             flash('Answer posted successfully!', 'success')
     
@@ -1043,27 +1419,23 @@ def question_detail(question_id: int):
         ).fetchall()
         user_starred = {s['item_id'] for s in user_stars}
         
-        # Get star counts for each answer
-        if answer_ids:
-            star_counts = conn.execute(
-                'SELECT item_id, COUNT(*) as count FROM Stars WHERE item_type = ? AND item_id IN ({}) GROUP BY item_id'.format(
-                    ','.join(['?'] * len(answer_ids))
-                ),
-                ['answer'] + answer_ids
-            ).fetchall()
-            star_count_map = {s['item_id']: s['count'] for s in star_counts}
-        else:
-            star_count_map = {}
+        # Star counts come from the maintained counters, like the document page's
+        star_count_map = get_counts(conn, 'star', 'answer', answer_ids)
         
         # Add star info to answers
         for answer in answers_list:
             answer['is_starred'] = answer['id'] in user_starred
-            answer['star_count'] = star_count_map.get(answer['id'], 0)
+            answer['star_count'] = star_count_map[answer['id']]
     
     answers = answers_list
     
     conn.close()
     
+    # Count the view; it is written to the database in the next batch
+    view_counter.record('question', question_id, session['user_id'])
+    question = dict(question)
+    question['views'] = (question['views'] or 0) + view_counter.pending('question', question_id)
+    
     return render_template('question_detail.html', question=question, answers=answers)
 
 
@@ -1104,6 +1476,116 @@ def accept_answer(answer_id: int):
     return jsonify({'success': True, 'is_accepted': new_status})
 
 
+@app.route('/api/notifications')
+def list_notifications():
+    """The latest notifications and the unread count."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    conn = get_db_connection()
+    rows = conn.execute(
+        'SELECT * FROM Notifications WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ?',
+        (session['user_id'], limit)).fetchall()
+    unread = unread_count(conn, session['user_id'])
+    conn.close()
+    return jsonify({'notifications': [notification_event(row) for row in rows], 'unread': unread})
+
+
+@app.route('/api/notifications/read', methods=['POST'])
+def mark_notifications_read():
+    """Mark all unread notifications read, or only ``{"ids": [...]}``, in one statement."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    ids = (request.get_json(silent=True) or {}).get('ids')
+    if ids is not None and (not isinstance(ids, list) or not all(isinstance(i, int) for i in ids)):
+        return jsonify({'error': 'ids must be a list of notification ids'}), 400
+    
+    conn = get_db_connection()
+    if ids is None:
+        conn.execute('UPDATE Notifications SET is_read = 1 WHERE user_id = ? AND is_read = 0',
+                     (session['user_id'],))
+    else:
+        conn.execute('''UPDATE Notifications SET is_read = 1
+                        WHERE user_id = ? AND is_read = 0 AND id IN (SELECT value FROM json_each(?))''',
+                     (session['user_id'], json.dumps(ids)))
+    conn.commit()
+    unread = unread_count(conn, session['user_id'])
+    conn.close()
+    # Update the badge in the user's other tabs too
+    notification_broker.publish(session['user_id'], {'type': 'count', 'data': {'unread': unread}})
+    return jsonify({'success': True, 'unread': unread})
+
+
+@app.route('/api/notifications/stream')
+def notification_stream():
+    """Server-Sent Events: the unread count, then each new notification as it is created.
+
+    Event ids are notification versions, which grow with every write of a
+    user's notifications, so a reconnecting browser sends Last-Event-ID and
+    first receives what was created or updated since. Streams end after NOTIFICATIONS_STREAM_SECONDS so worker threads
+    are recycled; EventSource reconnects on its own. Where a stream can't be
+    held (sync workers, too many open for this user) the response ends after
+    the backlog and the browser comes back after NOTIFICATIONS_POLL_SECONDS.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    user_id = session['user_id']
+    last_version = request.headers.get('Last-Event-ID', type=int) or request.args.get('last_id', type=int)
+    heartbeat = app.config['NOTIFICATIONS_HEARTBEAT']
+    deadline = time.monotonic() + app.config['NOTIFICATIONS_STREAM_SECONDS']
+    
+    # Subscribe before reading the backlog so nothing created in between is lost
+    subscription = None
+    if can_hold_streams(request.environ):
+        subscription = notification_broker.subscribe(user_id, limit=app.config['NOTIFICATIONS_MAX_STREAMS'])
+    try:
+        conn = get_db_connection()
+        unread = unread_count(conn, user_id)
+        missed = []
+        if last_version:
+            missed = [notification_event(row) for row in conn.execute(
+                'SELECT * FROM Notifications WHERE user_id = ? AND version > ? ORDER BY version LIMIT 50',
+                (user_id, last_version))]
+        conn.close()
+    except Exception:
+        if subscription is not None:
+            subscription.close()
+        raise
+    
+    def stream():
+        sent = {event['version'] for event in missed}
+        try:
+            retry = 5 if subscription is not None else app.config['NOTIFICATIONS_POLL_SECONDS']
+            yield f'retry: {int(retry * 1000)}\n\n'
+            yield format_sse({'unread': unread}, event='count')
+            for event in missed:
+                yield format_sse(event, event='notification', event_id=event['version'])
+            while subscription is not None and time.monotonic() < deadline:
+                message = subscription.get(timeout=min(heartbeat, max(deadline - time.monotonic(), 0)))
+                if message is None:
+                    yield ': keep-alive\n\n'
+                elif message['type'] == 'notification':
+                    # Already sent from the backlog
+                    if message['data']['version'] in sent:
+                        continue
+                    yield format_sse(message['data'], event='notification', event_id=message['data']['version'])
+                else:
+                    yield format_sse(message['data'], event=message['type'])
+        finally:
+            if subscription is not None:
+                subscription.close()
+    
+    response = Response(stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    if subscription is not None:
+        # Also unsubscribes a client that disconnects before the stream starts
+        response.call_on_close(subscription.close)
+    return response
+
+
 @app.route('/bookmark/<item_type>/<int:item_id>', methods=['POST'])
 def toggle_bookmark(item_type: str, item_id: int):
     if 'user_id' not in session:
@@ -1114,35 +1596,16 @@ def toggle_bookmark(item_type: str, item_id: int):
     
     conn = get_db_connection()
     try:
-        # Check if the item exists
-        if item_type == 'Document':
-            item_exists = conn.execute('SELECT 1 FROM Documents WHERE id = ?', (item_id,)).fetchone()
-        else:  # Question
-            item_exists = conn.execute('SELECT 1 FROM Questions WHERE id = ?', (item_id,)).fetchone()
-            
-        if not item_exists:
+        result = toggle(conn, 'bookmark', session['user_id'], item_type, item_id)
+        if result is None:
             return jsonify({'error': f'{item_type} not found'}), 404
-        
-        # Toggle bookmark
-        existing = conn.execute(
-            'SELECT id FROM Bookmarks WHERE user_id = ? AND item_type = ? AND item_id = ?',
-            (session['user_id'], item_type, item_id)
-        ).fetchone()
-        
-        if existing:
-            conn.execute('DELETE FROM Bookmarks WHERE id = ?', (existing['id'],))
-            bookmarked = False
-        else:
-            conn.execute(
-                'INSERT INTO Bookmarks (user_id, item_type, item_id) VALUES (?, ?, ?)',
-                (session['user_id'], item_type, item_id)
-            )
-            bookmarked = True
+        bookmarked, bookmark_count = result
         
         conn.commit()
         return jsonify({
             'status': 'success',
             'bookmarked': bookmarked,
+            'bookmark_count': bookmark_count,
             'message': f'Successfully {'added to' if bookmarked else 'removed from'} bookmarks'
         })
         
@@ -1159,172 +1622,256 @@ def toggle_star(item_type, item_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Not logged in'}), 401
         
-    if item_type not in ['answer', 'document']:
+    if item_type not in ['answer', 'document', 'question']:
         return jsonify({'error': 'Invalid item type'}), 400
         
-    conn = None
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
         user_id = session['user_id']
-        
-        # Check if the item exists
-        if item_type == 'answer':
-            item = conn.execute('SELECT id FROM Answers WHERE id = ?', (item_id,)).fetchone()
-        else:  # document
-            item = conn.execute('SELECT id FROM Documents WHERE id = ?', (item_id,)).fetchone()
-                
-        if not item:
-            if conn:
-                conn.close()
+        result = toggle(conn, 'star', user_id, item_type, item_id)
+        if result is None:
             return jsonify({'error': 'Item not found'}), 404
-            
-        # First, check if the star already exists
-        star = conn.execute(
-            'SELECT id FROM Stars WHERE user_id = ? AND item_type = ? AND item_id = ?',
-            (user_id, item_type, item_id)
-        ).fetchone()
-            
-        if star:
-            # Star exists, so we'll remove it
-            conn.execute(
-                'DELETE FROM Stars WHERE id = ?',
-                (star['id'],)
-            )
-            starred = False
-            app.logger.info(f'Star removed: user_id={user_id}, item_type={item_type}, item_id={item_id}')
-        else:
-            # Star doesn't exist, so we'll add it
-            try:
-                conn.execute(
-                    'INSERT INTO Stars (user_id, item_type, item_id) VALUES (?, ?, ?)',
-                    (user_id, item_type, item_id)
-                )
-                starred = True
-                app.logger.info(f'Star added: user_id={user_id}, item_type={item_type}, item_id={item_id}')
-            except sqlite3.IntegrityError as e:
-                app.logger.error(f'Integrity error when adding star: {str(e)}')
-                conn.rollback()
-                # If we get here, it means the star exists but our initial check didn't find it
-                # This could be due to a race condition, so we'll treat it as a successful toggle
-                starred = True
-            
-        # Get updated star count and check if the current user has starred the item
-        star_count = conn.execute(
-            'SELECT COUNT(*) as count FROM Stars WHERE item_type = ? AND item_id = ?',
-            (item_type, item_id)
-        ).fetchone()['count']
-            
-        # Check if current user has starred the item
-        user_has_starred = conn.execute(
-            'SELECT 1 FROM Stars WHERE user_id = ? AND item_type = ? AND item_id = ?',
-            (user_id, item_type, item_id)
-        ).fetchone() is not None
-            
+        starred, star_count = result
         conn.commit()
+        invalidate('stars')
+        app.logger.info(f'Star {"added" if starred else "removed"}: user_id={user_id}, item_type={item_type}, item_id={item_id}')
+        
         return jsonify({
             'status': 'success',
-            'starred': user_has_starred,
+            'starred': starred,
             'star_count': star_count,
-            'message': 'Successfully ' + ('starred' if user_has_starred else 'unstarred') + ' item'
+            'message': 'Successfully ' + ('starred' if starred else 'unstarred') + ' item'
         })
             
     except Exception as e:
-        if conn:
-            conn.rollback()
+        conn.rollback()
         app.logger.error(f'Error toggling star: {str(e)}')
         return jsonify({'error': 'Failed to update star', 'details': str(e)}), 500
     finally:
-        if conn:
-            conn.close()
         conn.close()
 
 
+def fetch_bookmarks(conn, user_id, page, per_page):
+    """Return one page of a user's bookmarked items (newest first) and the total.
+
+    The page of bookmarks is picked first and only those rows are joined to
+    their documents or questions, so the cost doesn't grow with the number of
+    bookmarks.
+    """
+    total = conn.execute('SELECT COUNT(*) AS count FROM Bookmarks WHERE user_id = ?',
+                         (user_id,)).fetchone()['count']
+    rows = conn.execute(
+        '''WITH page AS (
+               SELECT id, item_type, item_id, created_at FROM Bookmarks
+               WHERE user_id = ?
+               ORDER BY created_at DESC, id DESC
+               LIMIT ? OFFSET ?
+           )
+           SELECT page.id AS bookmark_id, page.created_at AS bookmarked_at, 'Document' AS type,
+                  d.id, d.title, d.description, d.tags, d.status, d.file_path, d.views, d.created_at,
+                  NULL AS answer_count, u.name AS author_name, u.id AS author_id
+           FROM page
+           JOIN Documents d ON page.item_type = 'Document' AND d.id = page.item_id
+           JOIN Users u ON d.user_id = u.id
+           UNION ALL
+           SELECT page.id, page.created_at, 'Question',
+                  q.id, q.title, q.description, q.tags, q.status, q.file_path, q.views, q.created_at,
+                  (SELECT COUNT(*) FROM Answers WHERE question_id = q.id), u.name, u.id
+           FROM page
+           JOIN Questions q ON page.item_type = 'Question' AND q.id = page.item_id
+           JOIN Users u ON q.user_id = u.id
+           ORDER BY bookmarked_at DESC, bookmark_id DESC''',
+        (user_id, per_page, (page - 1) * per_page)).fetchall()
+    return [dict(row) for row in rows], total
+
+def _bookmark_page_args():
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', app.config['BOOKMARKS_PER_PAGE'], type=int), 1), 100)
+    return page, per_page
+
 @app.route('/bookmarks')
 def bookmarks():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
+    page, per_page = _bookmark_page_args()
     conn = get_db_connection()
+    try:
+        items, total = fetch_bookmarks(conn, session['user_id'], page, per_page)
+    finally:
+        conn.close()
     
-    bookmarks = conn.execute(
-        'SELECT * FROM Bookmarks WHERE user_id = ? ORDER BY created_at DESC',
-        (session['user_id'],)).fetchall()
-    
-    items = []
-    for bookmark in bookmarks:
-        if bookmark['item_type'] == 'Document':
-            item = conn.execute(
-                '''SELECT Documents.*, Users.name AS author_name, Users.id AS author_id, 'Document' AS type
-                   FROM Documents JOIN Users ON Documents.user_id = Users.id
-                   WHERE Documents.id = ?''',
-                (bookmark['item_id'],)).fetchone()
-        else:
-            item = conn.execute(
-                '''SELECT Questions.*, Users.name AS author_name, Users.id AS author_id, 'Question' AS type,
-                          (SELECT COUNT(*) FROM Answers WHERE question_id = Questions.id) AS answer_count
-                   FROM Questions JOIN Users ON Questions.user_id = Users.id
-                   WHERE Questions.id = ?''',
-                (bookmark['item_id'],)).fetchone()
-        if item:
-            items.append(item)
+    pages = max((total + per_page - 1) // per_page, 1)
+    return render_template('bookmarks.html', items=items, page=page, pages=pages,
+                           per_page=per_page, total=total)
+
+
+@app.route('/api/bookmarks')
+def api_bookmarks():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
     
-    conn.close()
+    page, per_page = _bookmark_page_args()
+    conn = get_db_connection()
+    try:
+        items, total = fetch_bookmarks(conn, session['user_id'], page, per_page)
+    finally:
+        conn.close()
     
-    return render_template('bookmarks.html', items=items)
+    return jsonify({
+        'items': items,
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'has_next': page * per_page < total,
+    })
+
 
+def is_moderator():
+    return 'user_id' in session and session.get('role', '').lower() in ('admin', 'professor')
+
+def _moderation_args():
+    """Status filter, cursor and page size from the query string."""
+    status = request.args.get('status') or None
+    if status and status not in DOCUMENT_STATUSES:
+        abort(400, 'Invalid status')
+    limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    return status, request.args.get('cursor'), limit
 
 @app.route('/admin')
 def admin():
-    if 'user_id' not in session or session.get('role', '').lower() not in ('admin', 'professor'):
+    if not is_moderator():
         return redirect(url_for('feed'))
     
+    tab = 'questions' if request.args.get('tab') == 'questions' else 'documents'
+    status, cursor, limit = _moderation_args()
+    
     conn = get_db_connection()
+    try:
+        counts = status_counts(conn)
+        if tab == 'documents':
+            items, next_cursor = documents_page(conn, status, cursor, limit)
+        else:
+            items, next_cursor = questions_page(conn, cursor, limit)
+    except ValueError:
+        abort(400, 'Invalid cursor')
+    finally:
+        conn.close()
     
-    # Get all documents with author information
-    docs = conn.execute('''
-        SELECT d.id, d.title, d.description, d.status, d.created_at,
-               u.email AS author, u.name AS author_name
-        FROM Documents d
-        JOIN Users u ON d.user_id = u.id
-        ORDER BY d.created_at DESC
-    ''').fetchall()
-    
-    # Get all questions with author information
-    questions = conn.execute('''
-        SELECT q.id, q.title, q.description, q.created_at,
-               u.email AS author, u.name AS author_name
-        FROM Questions q
-        JOIN Users u ON q.user_id = u.id
-        ORDER BY q.created_at DESC
-    ''').fetchall()
+    return render_template('admin.html', tab=tab, items=items, status=status, counts=counts,
+                           statuses=DOCUMENT_STATUSES, next_cursor=next_cursor, is_first_page=not cursor)
+
+
+@app.route('/api/moderation/<kind>')
+def moderation_queue(kind):
+    """Keyset-paginated moderation queue: ``?status=&cursor=&limit=``."""
+    if not is_moderator():
+        return jsonify({'error': 'Unauthorized'}), 403
+    if kind not in ('documents', 'questions'):
+        return jsonify({'error': 'Unknown queue'}), 404
     
-    conn.close()
+    status, cursor, limit = _moderation_args()
+    conn = get_db_connection()
+    try:
+        if kind == 'documents':
+            items, next_cursor = documents_page(conn, status, cursor, limit)
+        else:
+            items, next_cursor = questions_page(conn, cursor, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    return jsonify({'items': items, 'next_cursor': next_cursor})
+
+
+def notify_document_status(conn, doc_ids, status):
+    """Queue a notification for the authors of documents just verified or unverified."""
+    if status not in ('Verified', 'Unverified') or not doc_ids:
+        return
+    for row in conn.execute('SELECT id, user_id, title FROM Documents WHERE id IN (SELECT value FROM json_each(?))',
+                            (json.dumps(doc_ids),)):
+        if row['user_id'] != session.get('user_id'):
+            notification_outbox.add(row['user_id'], status.lower(),
+                                    link=url_for('view_document', doc_id=row['id']), title=row['title'])
+
+
+@app.route('/api/moderation/documents/status', methods=['POST'])
+def bulk_document_status():
+    """Set the status of many documents at once: ``{"ids": [...], "status": "Verified"}``."""
+    if not is_moderator():
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+        return jsonify({'error': 'ids must be a list of document ids'}), 400
     
-    return render_template('admin.html', docs=docs, questions=questions)
+    conn = get_db_connection()
+    try:
+        updated = set_document_status(conn, ids, data.get('status'))
+        conn.commit()
+        notify_document_status(conn, updated, data.get('status'))
+        invalidate('documents', *(f'document:{i}' for i in updated))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    return jsonify({'success': True, 'updated': updated})
+
+
+@app.route('/admin/documents/status', methods=['POST'])
+def bulk_document_status_form():
+    """Bulk verify/unverify from the admin panel form."""
+    if not is_moderator():
+        return redirect(url_for('feed'))
+    
+    status = request.form.get('status')
+    ids = [int(i) for i in request.form.getlist('doc_ids') if i.isdigit()]
+    if status not in DOCUMENT_STATUSES or not ids:
+        flash('Select at least one document.', 'warning')
+    else:
+        conn = get_db_connection()
+        try:
+            updated = set_document_status(conn, ids, status)
+            conn.commit()
+            notify_document_status(conn, updated, status)
+            invalidate('documents', *(f'document:{i}' for i in updated))
+        finally:
+            conn.close()
+        flash(f'{len(updated)} document(s) marked as {status.lower()}.', 'success')
+    # Back to the same filtered page; only local paths are accepted
+    next_url = request.form.get('next', '')
+    if not next_url.startswith('/') or next_url.startswith('//'):
+        next_url = url_for('admin')
+    return redirect(next_url)
 
 
 @app.route('/verify/<int:doc_id>')
 def verify(doc_id: int):
-    if 'user_id' not in session or session.get('role') not in ('Admin', 'Professor'):
+    if not is_moderator():
         return redirect(url_for('feed'))
     
     conn = get_db_connection()
-    conn.execute('UPDATE Documents SET status = ? WHERE id = ?', ('Verified', doc_id))
+    updated = set_document_status(conn, [doc_id], 'Verified')
     conn.commit()
+    notify_document_status(conn, updated, 'Verified')
     conn.close()
+    invalidate('documents', f'document:{doc_id}')
     flash('Document verified successfully!', 'success')
     return redirect(url_for('admin'))
 
 
 @app.route('/unverify/<int:doc_id>')
 def unverify(doc_id: int):
-    if 'user_id' not in session or session.get('role') not in ('Admin', 'Professor'):
+    if not is_moderator():
         return redirect(url_for('feed'))
     
     conn = get_db_connection()
-    conn.execute('UPDATE Documents SET status = ? WHERE id = ?', ('Unverified', doc_id))
+    updated = set_document_status(conn, [doc_id], 'Unverified')
     conn.commit()
+    notify_document_status(conn, updated, 'Unverified')
     conn.close()
+    invalidate('documents', f'document:{doc_id}')
     flash('Document marked as unverified.', 'warning')
     return redirect(url_for('admin'))
 
@@ -1342,20 +1889,14 @@ def delete_document(doc_id: int):
         if not doc:
             return jsonify({'success': False, 'error': 'Document not found'}), 404
             
-        # Delete the document from database
+        # Delete the document from database and release its file
         conn.execute('DELETE FROM Documents WHERE id = ?', (doc_id,))
+        release_uploaded_file(conn, doc['file_path'])
         conn.commit()
+        invalidate('documents', f'document:{doc_id}')
+        collect_garbage(conn, app.config['UPLOAD_FOLDER'])
         conn.close()
         
-        # Delete the actual file if it exists
-        if doc['file_path']:
-            try:
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(doc['file_path']))
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            except Exception as e:
-                app.logger.error(f'Error deleting file {file_path}: {str(e)}')
-        
         flash('Document deleted successfully!', 'success')
         return jsonify({'success': True})
     except Exception as e:
@@ -1376,6 +1917,7 @@ def close_question(question_id: int):
         conn.execute('UPDATE Questions SET status = ? WHERE id = ?', 
                    ('Closed', question_id))
         conn.commit()
+        invalidate('questions')
         conn.close()
         return jsonify({'success': True, 'status': 'Closed'})
     except Exception as e:
@@ -1402,20 +1944,14 @@ def delete_question(question_id: int):
         # Delete associated answers first (due to foreign key constraint)
         conn.execute('DELETE FROM Answers WHERE question_id = ?', (question_id,))
         
-        # Delete the question
+        # Delete the question and release its file
         conn.execute('DELETE FROM Questions WHERE id = ?', (question_id,))
+        release_uploaded_file(conn, question['file_path'])
         conn.commit()
+        invalidate('questions')
+        collect_garbage(conn, app.config['UPLOAD_FOLDER'])
         conn.close()
         
-        # Delete the associated file if it exists
-        if question['file_path']:
-            try:
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(question['file_path']))
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            except Exception as e:
-                app.logger.error(f'Error deleting question file {file_path}: {str(e)}')
-        
         flash('Question and its answers deleted successfully!', 'success')
         return jsonify({'success': True})
     except Exception as e:
@@ -1428,11 +1964,18 @@ def delete_question(question_id: int):
 
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename: str):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
     try:
         # Only allow serving files from the uploads directory
         uploads_dir = os.path.join(app.root_path, 'uploads')
         file_path = os.path.join(uploads_dir, filename)
         
+        # Blobs and legacy uploads only: not partial uploads, temp files or derived files
+        if not is_servable_path(filename):
+            return 'File not found', 404
+        
         # Security check to prevent directory traversal
         if not os.path.abspath(file_path).startswith(os.path.abspath(uploads_dir)):
             app.logger.warning(f'Security alert: Directory traversal attempt: {filename}')
@@ -1455,14 +1998,8 @@ def uploaded_file(filename: str):
         elif filename.lower().endswith('.gif'):
             mimetype = 'image/gif'
         
-        # Create response with proper headers
-        response = send_from_directory(
-            uploads_dir,
-            filename,
-            mimetype=mimetype,
-            as_attachment=False,
-            download_name=filename
-        )
+        # Create response with validators, range support and caching headers
+        response = send_upload(uploads_dir, filename, mimetype)
         
         # Add security headers
         response.headers['X-Content-Type-Options'] = 'nosniff'
@@ -1475,6 +2012,9 @@ def uploaded_file(filename: str):
         app.logger.info(f'Served file: {filename} as {mimetype}')
         return response
         
+    except HTTPException:
+        # e.g. 416 for an unsatisfiable Range header
+        raise
     except Exception as e:
         app.logger.error(f'Error serving file {filename}: {str(e)}')
         return f'Error loading file: {str(e)}', 500
@@ -1498,7 +2038,7 @@ def chat_api():
         return jsonify({'error': 'Message is required'}), 400
     
     try:
-        response = get_chat_response(user_input)
+        response = get_chat_response(user_input, upload_folder=app.config['UPLOAD_FOLDER'])
         return jsonify({'response': response})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1527,22 +2067,18 @@ def edit_document(doc_id):
         description = request.form.get('description', '').strip()
         
         # Handle file upload if a new file is provided
-        uploaded_file = request.files.get('file')
         file_path = document['file_path']
-        
-        if uploaded_file and uploaded_file.filename:
-            # Delete old file if it exists
-            old_file_path = os.path.join(app.config['UPLOAD_FOLDER'], document['file_path'])
-            if os.path.exists(old_file_path):
-                os.remove(old_file_path)
-            
-            # Save new file
-            filename = secure_filename(uploaded_file.filename)
-            timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
-            filename = f"{timestamp}_{filename}"
-            save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            uploaded_file.save(save_path)
-            file_path = filename
+        new_file_path = store_uploaded_file(conn)
+        if new_file_path:
+            # Release the old file once the new one is safely in place
+            release_uploaded_file(conn, document['file_path'])
+            file_path = new_file_path
+            preview = describe_uploaded_file(file_path)
+            cursor.execute('''
+                UPDATE Documents
+                SET excerpt = ?, page_count = ?, file_size = ?
+                WHERE id = ?
+            ''', (preview['excerpt'], preview['page_count'], preview['file_size'], doc_id))
         
         # Update document in database
         cursor.execute('''
@@ -1552,6 +2088,8 @@ def edit_document(doc_id):
         ''', (title, description, file_path, doc_id, session['user_id']))
         
         conn.commit()
+        invalidate('documents', f'document:{doc_id}')
+        collect_garbage(conn, app.config['UPLOAD_FOLDER'])
         conn.close()
         
         flash('Document updated successfully! It will be reviewed again by moderators.', 'success')
@@ -1566,70 +2104,149 @@ def edit_document(doc_id):
 
 @app.route('/document/preview/<int:doc_id>')
 def document_preview(doc_id):
+    """Preview metadata for the document modal.
+
+    The file itself is not read here: the excerpt and page count are stored
+    when the file is uploaded, and the client loads the content from the
+    cacheable URLs returned.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Get document details
-    cursor.execute('''
-        SELECT d.*, u.name as author_name, u.avatar_url 
-        FROM Documents d 
-        JOIN Users u ON d.user_id = u.id 
-        WHERE d.id = ?
-    ''', (doc_id,))
-    
-    document = cursor.fetchone()
-    if not document:
-        return jsonify({'error': 'Document not found'}), 404
-    
-    # Check if file exists
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], document['file_path'])
-    if not os.path.exists(file_path):
-        return jsonify({'error': 'File not found'}), 404
-    
-    # Get file extension and type
-    file_extension = os.path.splitext(file_path)[1].lower()
-    file_type = 'other'
-    
-    if file_extension in ['.pdf']:
-        file_type = 'pdf'
-    elif file_extension in ['.jpg', '.jpeg', '.png', '.gif']:
-        file_type = 'image'
-    elif file_extension in ['.doc', '.docx']:
-        file_type = 'document'
-    elif file_extension in ['.xls', '.xlsx']:
-        file_type = 'spreadsheet'
-    elif file_extension in ['.html', '.htm']:
-        file_type = 'html'
-        # Read the HTML content
-        with open(file_path, 'r', encoding='utf-8') as f:
-            html_content = f.read()
-    
-    response_data = {
+    try:
+        document = conn.execute('''
+            SELECT d.id, d.title, d.description, d.file_path, d.created_at, d.status,
+                   d.excerpt, d.page_count, d.file_size,
+                   u.name as author_name, u.avatar_url
+            FROM Documents d 
+            JOIN Users u ON d.user_id = u.id 
+            WHERE d.id = ?
+        ''', (doc_id,)).fetchone()
+        if not document:
+            return jsonify({'error': 'Document not found'}), 404
+        if not document['file_path']:
+            return jsonify({'error': 'File not found'}), 404
+
+        document = dict(document)
+        if document['file_size'] is None:
+            # Documents uploaded before preview metadata existed are filled in once
+            try:
+                preview = describe_uploaded_file(document['file_path'])
+            except OSError:
+                return jsonify({'error': 'File not found'}), 404
+            conn.execute(
+                'UPDATE Documents SET excerpt = ?, page_count = ?, file_size = ? WHERE id = ?',
+                (preview['excerpt'], preview['page_count'], preview['file_size'], doc_id))
+            conn.commit()
+            invalidate(f'document:{doc_id}')
+            document.update(preview)
+    finally:
+        conn.close()
+
+    file_type = document_file_type(document['file_path'])
+    file_url = url_for('uploaded_file', filename=document['file_path'])
+    response = jsonify({
         'id': document['id'],
         'title': document['title'],
         'description': document['description'],
         'file_path': document['file_path'],
         'file_type': file_type,
+        'file_size': document['file_size'],
+        'page_count': document['page_count'],
+        'excerpt': document['excerpt'],
+        'file_url': file_url,
+        # HTML is rendered through the sandboxed route, everything else directly
+        'view_url': url_for('serve_html', filename=document['file_path']) if file_type == 'html' else file_url,
+        'thumbnail_url': rendition_url(document['file_path'], 'thumb'),
+        'page_image_url': rendition_url(document['file_path'], 'page'),
         'author': document['author_name'],
         'author_avatar': document['avatar_url'],
         'created_at': document['created_at'],
         'status': document['status']
-    }
-    
-    # Include HTML content in response if it's an HTML file
-    if file_type == 'html' and 'html_content' in locals():
-        response_data['html_content'] = html_content
-    
-    return jsonify(response_data)
+    })
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/documents/<int:doc_id>/pages')
+def document_pages(doc_id):
+    """Page texts of a PDF document, ``count`` pages starting at page ``from`` (1-based)."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    start = request.args.get('from', 1, type=int)
+    count = request.args.get('count', 5, type=int)
+    if start < 1 or count < 1:
+        return jsonify({'error': 'Invalid page range'}), 400
+    count = min(count, MAX_PAGES_PER_REQUEST)
+
+    conn = get_db_connection()
+    try:
+        document = conn.execute('SELECT file_path FROM Documents WHERE id = ?', (doc_id,)).fetchone()
+    finally:
+        conn.close()
+    if not document or not can_paginate(document['file_path']):
+        return jsonify({'error': 'Document has no pages'}), 404
+
+    upload_folder = app.config['UPLOAD_FOLDER']
+    source = os.path.join(upload_folder, *document['file_path'].split('/'))
+    if not has_page_index(source):
+        if not os.path.exists(source):
+            return jsonify({'error': 'File not found'}), 404
+        schedule_page_index(upload_folder, document['file_path'])
+        return jsonify({'status': 'pending'}), 202, {'Retry-After': '2', 'Cache-Control': 'no-store'}
+
+    page_count, texts = read_pages(source, start - 1, count)
+    next_page = start + len(texts)
+    response = jsonify({
+        'page_count': page_count,
+        'from': start,
+        'pages': [{'number': start + i, 'text': text} for i, text in enumerate(texts)],
+        'next': next_page if next_page <= page_count else None,
+    })
+    # The URL is per document, whose file may be replaced, so revalidate
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/renditions/<kind>/<path:filename>')
+def document_rendition(kind, filename):
+    """Serve the thumbnail or first-page image of a stored document."""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    if kind not in RENDITIONS or not is_blob_path(filename) or not can_render(filename) \
+            or '..' in filename.split('/'):
+        abort(404)
+
+    upload_folder = app.config['UPLOAD_FOLDER']
+    rendition = find_rendition(upload_folder, filename, kind)
+    if not rendition:
+        if os.path.exists(os.path.join(upload_folder, *filename.split('/'))):
+            # Not rendered yet (or uploaded before renditions existed)
+            schedule_render(upload_folder, filename)
+        return 'Preview not available yet', 404, {'Cache-Control': 'no-store'}
+
+    rel_path, mimetype = rendition
+    response = send_upload(upload_folder, rel_path, mimetype, derived=True)
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
 
 @app.route('/document/html/<path:filename>')
 def serve_html(filename):
     """Serve HTML files with proper content type and security"""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
     try:
         # Only allow serving files from the uploads directory
         uploads_dir = os.path.join(app.root_path, 'uploads')
         file_path = os.path.join(uploads_dir, filename)
         
+        # Blobs and legacy uploads only: not partial uploads, temp files or derived files
+        if not is_servable_path(filename):
+            return 'File not found', 404
+        
         # Security check to prevent directory traversal
         if not os.path.abspath(file_path).startswith(os.path.abspath(uploads_dir)):
             app.logger.warning(f'Security alert: Directory traversal attempt: {filename}')
@@ -1644,16 +2261,8 @@ def serve_html(filename):
             app.logger.warning(f'Invalid file type requested: {filename}')
             return 'Invalid file type. Only HTML files are allowed.', 400
         
-        # Read the file content and send it with proper headers
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Create response with proper headers
-        response = app.response_class(
-            response=content,
-            status=200,
-            mimetype='text/html; charset=utf-8'
-        )
+        # Stream the file with validators so repeat previews get a 304
+        response = send_upload(uploads_dir, filename, 'text/html; charset=utf-8')
         
         # Add security headers
         response.headers['X-Content-Type-Options'] = 'nosniff'
@@ -1663,6 +2272,8 @@ def serve_html(filename):
         app.logger.info(f'Served HTML file: {filename}')
         return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         app.logger.error(f'Error serving HTML file {filename}: {str(e)}')
         return f'Error loading file: {str(e)}', 500
@@ -1694,19 +2305,106 @@ def track_time():
     
     return jsonify({'status': 'error', 'message': 'Invalid request'}), 400
 
+@app.route('/api/leaderboard')
+def leaderboard():
+    """Top contributors by one of the UserStats columns (``?by=stars_received``)."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    metric = request.args.get('by', 'stars_received')
+    if metric not in STAT_COLUMNS:
+        return jsonify({'error': 'Invalid statistic'}), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    
+    conn = get_db_connection()
+    try:
+        users = top_contributors(conn, metric, limit)
+    finally:
+        conn.close()
+    return jsonify({'by': metric, 'users': users})
+
+@app.route('/api/admin/view-counter')
+def view_counter_stats():
+    """Flush sizes, lag and pending views of this worker's view counter."""
+    if 'user_id' not in session or session.get('role', '').lower() != 'admin':
+        abort(403)
+    return jsonify(view_counter.stats())
+
+@app.route('/admin/profiles')
+def admin_profiles():
+    """Stored request profiles, slowest first per endpoint."""
+    if 'user_id' not in session or session.get('role', '').lower() != 'admin':
+        abort(403)
+    return render_template('admin_profiles.html',
+                           profiles=list_profiles(app.config['PROFILE_DIR']),
+                           sample_rate=app.config['PROFILE_SAMPLE_RATE'])
+
+@app.route('/admin/profiles/<route>/<profile_id>.folded')
+def download_profile(route, profile_id):
+    """A profile's collapsed stacks, ready for flamegraph.pl or speedscope."""
+    if 'user_id' not in session or session.get('role', '').lower() != 'admin':
+        abort(403)
+    profile = load_profile(app.config['PROFILE_DIR'], route, profile_id)
+    if profile is None:
+        abort(404)
+    return collapsed_stacks(profile), 200, {
+        'Content-Type': 'text/plain; charset=utf-8',
+        'Content-Disposition': f'attachment; filename="{profile["endpoint"]}-{profile["id"]}.folded"',
+    }
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint."""
+    token = app.config['METRICS_TOKEN']
+    authorized = bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not authorized and ('user_id' not in session or session.get('role', '').lower() != 'admin'):
+        abort(403)
+    return metrics_registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/api/admin/caches')
+def cache_stats():
+    if 'user_id' not in session or session.get('role', '').lower() != 'admin':
+        abort(403)
+    return jsonify({name: cache.stats() for name, cache in caches.items()})
+
+
+@app.route('/api/admin/notifications')
+def notification_stats():
+    if 'user_id' not in session or session.get('role', '').lower() != 'admin':
+        abort(403)
+    return jsonify({'streams': notification_broker.stats(), 'outbox': notification_outbox.stats()})
+
+
+@app.route('/api/admin/sessions', methods=['GET', 'POST'])
+def admin_sessions():
+    """Session store stats; POST {"user_id": n} or {"all": true} to log users out everywhere."""
+    if 'user_id' not in session or session.get('role', '').lower() != 'admin':
+        abort(403)
+    if not hasattr(app.session_interface, 'stats'):
+        return jsonify({'error': 'Sessions are stored in cookies (SESSION_BACKEND=cookie)'}), 409
+    if request.method == 'GET':
+        return jsonify(app.session_interface.stats())
+
+    data = request.get_json(silent=True) or {}
+    if data.get('all') is True:
+        revoked = revoke_sessions(app)
+    elif isinstance(data.get('user_id'), int):
+        revoked = revoke_sessions(app, data['user_id'])
+    else:
+        return jsonify({'error': 'Pass "user_id" or "all": true'}), 400
+    return jsonify({'revoked': revoked})
+
+
+@app.route('/api/admin/query-stats')
+def query_stats_report():
+    """Per-route query counts and DB time, and the costliest statements, for this worker."""
+    if 'user_id' not in session or session.get('role', '').lower() != 'admin':
+        abort(403)
+    return jsonify(query_stats.snapshot(top=request.args.get('top', 20, type=int)))
+
 @app.route('/analytics')
 def view_analytics():
-    print("\n=== Debug: Analytics Access Check ===")
-    print(f"Session data: {dict(session)}")
-    print(f"User role: {session.get('role')}")
-    print(f"User ID: {session.get('user_id')}")
-    
-    if 'user_id' not in session:
-        print("Access denied: No user_id in session")
-        abort(403)  # Forbidden
-        
-    if session.get('role', '').lower() != 'admin':
-        print(f"Access denied: User role '{session.get('role')}' is not admin")
+    if 'user_id' not in session or session.get('role', '').lower() != 'admin':
         abort(403)  # Forbidden
         
     if not analytics or not hasattr(analytics, 'redis') or not analytics.redis:
@@ -1739,6 +2437,93 @@ def view_analytics():
     
     return render_template('analytics.html', users=user_analytics)
 
+@app.cli.command('gc-uploads')
+def gc_uploads_command():
+    """Delete unreferenced blobs and orphaned upload files."""
+    conn = get_db_connection()
+    try:
+        removed = collect_garbage(conn, app.config['UPLOAD_FOLDER'])
+        orphans = sweep_orphans(conn, app.config['UPLOAD_FOLDER'])
+    finally:
+        conn.close()
+    print(f"Removed {removed} unreferenced blobs and {orphans} orphaned files")
+
+
+@app.cli.command('migrate-uploads')
+def migrate_uploads_command():
+    """Move files stored before the blob store existed into it."""
+    upload_folder = app.config['UPLOAD_FOLDER']
+    conn = get_db_connection()
+    migrated = 0
+    try:
+        for table in ('Documents', 'Questions'):
+            rows = conn.execute(
+                f'SELECT id, file_path FROM {table} WHERE file_path IS NOT NULL AND file_path != ""'
+            ).fetchall()
+            for row in rows:
+                if is_blob_path(row['file_path']):
+                    continue
+                legacy_path = os.path.join(upload_folder, os.path.basename(row['file_path']))
+                if not os.path.exists(legacy_path):
+                    continue
+                blob = import_legacy_file(conn, upload_folder, os.path.basename(row['file_path']))
+                conn.execute(f'UPDATE {table} SET file_path = ? WHERE id = ?', (blob, row['id']))
+                # Re-point later rows that shared the same legacy file
+                conn.execute(
+                    f'''UPDATE Blobs SET ref_count = ref_count + (
+                           SELECT COUNT(*) FROM {table} WHERE file_path = ?)
+                       WHERE path = ?''', (row['file_path'], blob))
+                conn.execute(f'UPDATE {table} SET file_path = ? WHERE file_path = ?', (blob, row['file_path']))
+                conn.commit()
+                migrated += 1
+    finally:
+        conn.close()
+    print(f"Migrated {migrated} files into the blob store")
+
+
+@app.cli.command('render-previews')
+def render_previews_command():
+    """Render missing thumbnails, first-page images and page texts for all documents."""
+    upload_folder = app.config['UPLOAD_FOLDER']
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            'SELECT DISTINCT file_path FROM Documents WHERE file_path IS NOT NULL AND file_path != ""'
+        ).fetchall()
+    finally:
+        conn.close()
+    rendered = 0
+    for row in rows:
+        file_path = row['file_path']
+        source = os.path.join(upload_folder, *file_path.split('/'))
+        try:
+            if is_blob_path(file_path) and render_renditions(upload_folder, file_path):
+                rendered += 1
+            if can_paginate(file_path) and os.path.exists(source) and not has_page_index(source):
+                build_page_index(source)
+        except Exception as e:
+            print(f"Error rendering previews for {file_path}: {str(e)}")
+    print(f"Rendered previews for {rendered} documents")
+
+
+@app.cli.command('rebuild-user-stats')
+def rebuild_user_stats_command():
+    """Recompute the UserStats table from the content tables."""
+    conn = get_db_connection()
+    try:
+        rebuild_user_stats(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    print("User statistics rebuilt")
+
+
 if __name__ == '__main__':
+    # multiprocessing runs the main script again in every process it starts, so each
+    # password-hashing process (see passwords.py) would open the database and connect
+    # to Redis. A main module whose spec is named __main__, as a package's __main__
+    # module run with ``python -m`` is, is not run again; those processes only need
+    # passwords.py.
+    __spec__ = ModuleSpec('__main__', None)
     port = int(os.environ.get('PORT', 9000))
     app.run(host='0.0.0.0', port=port, debug=os.environ.get('FLASK_ENV') == 'development')
\ No newline at end of file
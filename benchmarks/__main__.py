@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import platform
+import subprocess
+
+from benchmarks import MANIFEST_FILENAME, load_app
+from benchmarks.corpus import SCALES, generate_corpus
+from benchmarks.workloads import WORKLOADS, StubModel, run_workload
+from benchmarks.fanout import run_fanout
+from benchmarks.sessions import run_sessions
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _change(new, old):
+    return round((new - old) / old * 100, 1) if old else None
+
+
+def compare(results, baseline):
+    """Percentage change of each workload against a previous run."""
+    changes = {}
+    for name, result in results.items():
+        before = baseline.get('workloads', {}).get(name)
+        if not before:
+            continue
+        changes[name] = {
+            'throughput_rps_pct': _change(result['throughput_rps'], before['throughput_rps']),
+            'p50_ms_pct': _change(result['latency_ms']['p50'], before['latency_ms']['p50']),
+            'p99_ms_pct': _change(result['latency_ms']['p99'], before['latency_ms']['p99']),
+        }
+    return changes
+
+
+def cmd_generate(args):
+    manifest = generate_corpus(args.dir, args.scale, args.seed)
+    print(json.dumps(manifest['counts'], indent=2))
+    print(f"Generated in {manifest['generated_in_seconds']}s", file=sys.stderr)
+
+
+def cmd_run(args):
+    with open(os.path.join(args.dir, MANIFEST_FILENAME)) as f:
+        corpus = json.load(f)
+    app_module = load_app(args.dir)
+    import gemini_chat
+    gemini_chat.model = StubModel(args.chat_delay)
+
+    names = args.workloads.split(',') if args.workloads else list(WORKLOADS)
+    results = {}
+    for name in names:
+        print(f'Running {name}...', file=sys.stderr)
+        results[name] = run_workload(app_module.app, corpus, name, args.requests, args.concurrency,
+                                     args.warmup, args.seed)
+
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'scale': corpus['scale'],
+            'corpus_seed': corpus['seed'],
+            'seed': args.seed,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'workloads': results,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['compared_to_baseline'] = compare(results, json.load(f))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+def cmd_fanout(args):
+    result = run_fanout(args.subscribers, args.users, args.messages, args.listeners, args.redis_url, args.seed)
+    result['meta'] = {'commit': _git_commit(), 'python': platform.python_version(),
+                      'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+def cmd_sessions(args):
+    result = run_sessions(load_app(args.dir), args.requests, args.redis_url)
+    result['meta'] = {'commit': _git_commit(), 'python': platform.python_version(),
+                      'sqlite': sqlite3.sqlite_version, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help='build a synthetic corpus')
+    generate.add_argument('--dir', default='bench-data', help='where to put the database and uploads')
+    generate.add_argument('--scale', choices=SCALES, default='10k')
+    generate.add_argument('--seed', type=int, default=0)
+    generate.set_defaults(func=cmd_generate)
+
+    run = commands.add_parser('run', help='run workloads against a generated corpus')
+    run.add_argument('--dir', default='bench-data')
+    run.add_argument('--workloads', help=f"comma-separated subset of: {', '.join(WORKLOADS)}")
+    run.add_argument('--requests', type=int, default=200, help='measured requests per workload')
+    run.add_argument('--concurrency', type=int, default=1, help='client threads')
+    run.add_argument('--warmup', type=int, default=10, help='unmeasured requests per thread first')
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--chat-delay', type=float, default=0.0, help='seconds the stub chat model takes')
+    run.add_argument('--output', help='also write the JSON report here')
+    run.add_argument('--baseline', help='earlier JSON report to compare against')
+    run.set_defaults(func=cmd_run)
+
+    fanout = commands.add_parser('fanout', help='publish notifications to many idle streams')
+    fanout.add_argument('--subscribers', type=int, default=5000, help='idle subscriptions, one thread each')
+    fanout.add_argument('--users', type=int, default=1000, help='users the idle subscriptions belong to')
+    fanout.add_argument('--messages', type=int, default=2000)
+    fanout.add_argument('--listeners', type=int, default=8, help='subscriptions whose delivery is timed')
+    fanout.add_argument('--redis-url', help='publish through Redis pub/sub instead of in-process')
+    fanout.add_argument('--seed', type=int, default=0)
+    fanout.add_argument('--output', help='also write the JSON report here')
+    fanout.set_defaults(func=cmd_fanout)
+
+    sessions = commands.add_parser('sessions', help='per-request session cost, cookie vs server-side')
+    sessions.add_argument('--dir', default='bench-data', help='generated corpus whose database holds the sessions')
+    sessions.add_argument('--requests', type=int, default=5000)
+    sessions.add_argument('--redis-url', help='also measure the Redis session store')
+    sessions.add_argument('--output', help='also write the JSON report here')
+    sessions.set_defaults(func=cmd_sessions)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""
+Synthetic corpus generator.
+
+Fills the benchmark database with users, documents, questions, answers,
+stars, bookmarks and notifications at a named scale, plus a small pool of
+sample upload files (PDF, HTML and text) in the blob store that the
+documents point at. Rows are inserted in bulk through the normal schema, so
+triggers (e.g. ``UserStats``) and indexes are maintained as in production.
+"""
+
+import os
+import json
+import time
+import random
+import hashlib
+import tempfile
+from datetime import datetime, timedelta
+
+from benchmarks import DB_FILENAME, MANIFEST_FILENAME, load_app
+
+# Scale name -> number of stars; other tables are sized relative to it
+SCALES = {
+    '1k': 1_000,
+    '10k': 10_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+}
+
+# Rows per table as a fraction of the scale
+PROPORTIONS = {
+    'users': 0.02,
+    'documents': 0.2,
+    'questions': 0.2,
+    'answers': 0.5,
+    'stars': 1.0,
+    'bookmarks': 0.25,
+    'notifications': 0.25,
+}
+
+BENCH_PASSWORD = 'benchmark'
+SAMPLE_FILES = 12
+BATCH_SIZE = 10_000
+
+WORDS = (
+    'arduino sensor circuit voltage current resistor capacitor microcontroller wifi esp32 lora '
+    'protocol network packet latency algorithm graph tree sorting recursion memory cache thread '
+    'process kernel database index query transaction physics calculus matrix vector derivative '
+    'integral probability statistics regression neuron model training dataset tutorial lab '
+    'assignment project report lecture exam design prototype printer filament motor servo'
+).split()
+TAGS = ('iot', 'arduino', 'electronics', 'programming', 'math', 'physics', 'ai', 'networking',
+        'databases', 'maker', 'tutorial', 'lab')
+ROLES = ('Student',) * 8 + ('Professor',)
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def _timestamp(rng, start, span_seconds):
+    return (start + timedelta(seconds=rng.randrange(span_seconds))).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _pdf_bytes(pages):
+    """A minimal valid PDF with one line of text per page."""
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>', None,
+               '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for text in pages:
+        stream = f'BT /F1 12 Tf 72 720 Td ({text}) Tj ET'
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream')
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+                       f'/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>')
+        kids.append(f'{len(objects)} 0 R')
+    objects[1] = f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {len(kids)} >>'
+
+    out = b'%PDF-1.4\n'
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f'{number} 0 obj\n{body}\nendobj\n'.encode('latin-1')
+    xref = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('latin-1')
+    out += ''.join(f'{offset:010d} 00000 n \n' for offset in offsets).encode('latin-1')
+    out += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode('latin-1')
+    return out
+
+
+def _sample_file(rng, index):
+    kind = ('pdf', 'html', 'txt')[index % 3]
+    title = _sentence(rng, 4)
+    paragraphs = [_sentence(rng, rng.randint(30, 80)) + '.' for _ in range(rng.randint(5, 15))]
+    if kind == 'pdf':
+        return f'sample{index}.pdf', _pdf_bytes([_sentence(rng, 10) for _ in range(rng.randint(2, 12))])
+    if kind == 'html':
+        body = ''.join(f'<p>{p}</p>' for p in paragraphs)
+        return f'sample{index}.html', f'<html><head><title>{title}</title></head><body><h1>{title}</h1>{body}</body></html>'.encode()
+    return f'sample{index}.txt', '\n\n'.join([title] + paragraphs).encode()
+
+
+def _store_samples(conn, rng, upload_folder):
+    from upload_storage import add_blob
+
+    paths = []
+    for index in range(SAMPLE_FILES):
+        name, data = _sample_file(rng, index)
+        fd, temp_path = tempfile.mkstemp(dir=upload_folder, prefix='.upload-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        paths.append(add_blob(conn, upload_folder, temp_path, hashlib.sha256(data).hexdigest(),
+                              len(data), name))
+    return paths
+
+
+def _insert(conn, sql, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        conn.executemany(sql, rows[start:start + BATCH_SIZE])
+
+
+def _unique_pairs(rng, count, users, items):
+    """``count`` distinct (user, item) pairs, or as many as exist."""
+    count = min(count, len(users) * len(items))
+    pairs = set()
+    while len(pairs) < count:
+        pairs.add((rng.choice(users), rng.choice(items)))
+    return sorted(pairs)
+
+
+def generate_corpus(data_dir, scale='10k', seed=0):
+    """Build the benchmark database and uploads in ``data_dir``. Returns the manifest."""
+    if os.path.exists(os.path.join(data_dir, DB_FILENAME)):
+        raise FileExistsError(f'{data_dir} already holds a corpus; remove it or pick another --dir')
+    os.makedirs(data_dir, exist_ok=True)
+    app_module = load_app(data_dir)
+    upload_folder = app_module.app.config['UPLOAD_FOLDER']
+
+    rng = random.Random(seed)
+    size = SCALES[scale]
+    counts = {table: max(int(size * share), 3) for table, share in PROPORTIONS.items()}
+    start = datetime(2024, 1, 1)
+    span = 365 * 24 * 60 * 60
+    started = time.perf_counter()
+
+    conn = app_module.get_db_connection()
+    conn.execute('PRAGMA synchronous = OFF')
+    with conn:
+        password = app_module.hash_password(BENCH_PASSWORD)
+        first_user = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM Users').fetchone()[0]
+        _insert(conn, '''INSERT INTO Users (email, role, name, bio, password, first_login)
+                         VALUES (?, ?, ?, ?, ?, 0)''',
+                [(f'bench{i}@university.edu', rng.choice(ROLES), f'Bench User {i}',
+                  _sentence(rng, 8), password) for i in range(counts['users'])])
+        users = list(range(first_user, first_user + counts['users']))
+
+        samples = _store_samples(conn, rng, upload_folder)
+        first_document = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM Documents').fetchone()[0]
+        documents = [(_sentence(rng, rng.randint(3, 8)), _sentence(rng, rng.randint(15, 40)),
+                      ', '.join(rng.sample(TAGS, 3)), samples[i % len(samples)],
+                      rng.choice(users), 'Verified' if rng.random() < 0.8 else 'Pending',
+                      rng.randrange(500), _timestamp(rng, start, span))
+                     for i in range(counts['documents'])]
+        _insert(conn, '''INSERT INTO Documents (title, description, tags, file_path, user_id, status,
+                                                views, created_at)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', documents)
+        # One reference per document, as uploading them one by one would have taken
+        conn.executemany('UPDATE Blobs SET ref_count = ? WHERE path = ?',
+                         [(sum(1 for d in documents if d[3] == path), path) for path in samples])
+        document_ids = list(range(first_document, first_document + counts['documents']))
+
+        first_question = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM Questions').fetchone()[0]
+        _insert(conn, '''INSERT INTO Questions (title, description, tags, user_id, views, created_at)
+                         VALUES (?, ?, ?, ?, ?, ?)''',
+                [(_sentence(rng, rng.randint(5, 12)) + '?', _sentence(rng, rng.randint(20, 60)),
+                  ', '.join(rng.sample(TAGS, 2)), rng.choice(users), rng.randrange(300),
+                  _timestamp(rng, start, span)) for _ in range(counts['questions'])])
+        question_ids = list(range(first_question, first_question + counts['questions']))
+
+        first_answer = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM Answers').fetchone()[0]
+        _insert(conn, '''INSERT INTO Answers (question_id, content, user_id, is_accepted, created_at)
+                         VALUES (?, ?, ?, ?, ?)''',
+                [(rng.choice(question_ids), _sentence(rng, rng.randint(20, 80)), rng.choice(users),
+                  1 if rng.random() < 0.1 else 0, _timestamp(rng, start, span))
+                 for _ in range(counts['answers'])])
+        answer_ids = list(range(first_answer, first_answer + counts['answers']))
+
+        items = ([('document', i) for i in document_ids] + [('question', i) for i in question_ids]
+                 + [('answer', i) for i in answer_ids])
+        _insert(conn, 'INSERT INTO Stars (user_id, item_type, item_id, created_at) VALUES (?, ?, ?, ?)',
+                [(user, item_type, item_id, _timestamp(rng, start, span))
+                 for user, (item_type, item_id) in _unique_pairs(rng, counts['stars'], users, items)])
+
+        bookmarkable = [('Document', i) for i in document_ids] + [('Question', i) for i in question_ids]
+        _insert(conn, 'INSERT INTO Bookmarks (user_id, item_type, item_id, created_at) VALUES (?, ?, ?, ?)',
+                [(user, item_type, item_id, _timestamp(rng, start, span))
+                 for user, (item_type, item_id) in _unique_pairs(rng, counts['bookmarks'], users, bookmarkable)])
+
+        _insert(conn, '''INSERT INTO Notifications (user_id, message, link, is_read, created_at)
+                         VALUES (?, ?, ?, ?, ?)''',
+                [(rng.choice(users), 'Someone answered your question', f'/questions/{rng.choice(question_ids)}',
+                  1 if rng.random() < 0.7 else 0, _timestamp(rng, start, span))
+                 for _ in range(counts['notifications'])])
+    conn.execute('ANALYZE')
+    conn.close()
+
+    manifest = {
+        'scale': scale,
+        'seed': seed,
+        'counts': counts,
+        'users': [users[0], users[-1]],
+        'documents': [document_ids[0], document_ids[-1]],
+        'questions': [question_ids[0], question_ids[-1]],
+        'answers': [answer_ids[0], answer_ids[-1]],
+        'password': BENCH_PASSWORD,
+        'words': list(WORDS),
+        'generated_in_seconds': round(time.perf_counter() - started, 2),
+    }
+    with open(os.path.join(data_dir, MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
@@ -0,0 +1,106 @@
+"""
+Notification fan-out benchmark.
+
+Opens ``subscribers`` idle notification subscriptions spread over ``users``
+users, each blocked in its own thread the way an open SSE stream holds a
+server thread, plus ``listeners`` measured subscriptions. It then publishes
+``messages`` events: most go to random idle users, and every tenth goes to a
+measured user and carries its send time. The report gives the cost of
+``publish`` and the publish-to-delivery latency seen by the measured threads,
+which should not grow with the number of idle subscribers.
+"""
+
+import time
+import random
+import threading
+import tracemalloc
+
+from benchmarks.workloads import summarise
+
+_STOP = {'type': 'stop'}
+
+
+def _wait_idle(subscription):
+    # Blocks like an idle stream until the benchmark ends
+    while subscription.get() is not _STOP:
+        pass
+
+
+def run_fanout(subscribers=5000, users=1000, messages=2000, listeners=8, redis_url=None, seed=0):
+    from notifications import NotificationBroker
+
+    broker = NotificationBroker()
+    if redis_url:
+        import redis
+        broker.redis = redis.Redis.from_url(redis_url)
+        broker.redis.ping()
+    rng = random.Random(seed)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    idle = [broker.subscribe(rng.randrange(users)) for _ in range(subscribers)]
+    subscription_bytes = sum(stat.size_diff for stat in
+                             tracemalloc.take_snapshot().compare_to(before, 'filename'))
+    tracemalloc.stop()
+
+    threads = [threading.Thread(target=_wait_idle, args=(s,), daemon=True) for s in idle]
+    for thread in threads:
+        thread.start()
+
+    latencies = []
+    lock = threading.Lock()
+    expected = messages // 10
+
+    def listen(subscription, count):
+        local = []
+        for _ in range(count):
+            event = subscription.get(timeout=30)
+            if event is None:
+                break
+            local.append(time.perf_counter() - event['sent'])
+        with lock:
+            latencies.extend(local)
+
+    measured_users = [users + i for i in range(listeners)]
+    per_listener = [expected // listeners + (1 if i < expected % listeners else 0) for i in range(listeners)]
+    listener_threads = [threading.Thread(target=listen, args=(broker.subscribe(user), count), daemon=True)
+                        for user, count in zip(measured_users, per_listener)]
+    for thread in listener_threads:
+        thread.start()
+    if redis_url:
+        # Let the listener thread subscribe before anything is published
+        time.sleep(0.5)
+
+    targets = [measured_users[i % listeners] for i in range(expected)]
+    publish_times = []
+    started = time.perf_counter()
+    for i in range(messages):
+        if i % 10 == 0 and targets:
+            user = targets.pop()
+        else:
+            user = rng.randrange(users)
+        t0 = time.perf_counter()
+        broker.publish(user, {'type': 'notification', 'sent': t0})
+        publish_times.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    for thread in listener_threads:
+        thread.join(timeout=30)
+
+    for subscription in idle:
+        subscription.put(_STOP)
+    for thread in threads:
+        thread.join(timeout=5)
+
+    publish = summarise(publish_times, 0, elapsed)
+    delivery = summarise(latencies, expected - len(latencies), elapsed)
+    return {
+        'subscribers': subscribers,
+        'users': users,
+        'messages': messages,
+        'redis': bool(redis_url),
+        'bytes_per_subscription': round(subscription_bytes / subscribers) if subscribers else 0,
+        'publish': {'throughput_rps': publish['throughput_rps'], 'latency_ms': publish['latency_ms']},
+        'delivery': {'delivered': delivery['requests'], 'lost': delivery['errors'],
+                     'latency_ms': delivery['latency_ms']},
+        'broker': broker.stats(),
+    }
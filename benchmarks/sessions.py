@@ -0,0 +1,74 @@
+"""
+Session overhead benchmark.
+
+Times what every authenticated request pays for its session, opening it from
+the request cookie, reading the user's id and role the way the routes do, and
+saving it, for Flask's signed cookie sessions and for the server-side store
+with its in-memory cache (the usual case) and without it (a cold lookup,
+i.e. the first request a worker sees for a session). Also reports the size of
+the session cookie each one sends.
+"""
+
+import time
+
+from benchmarks.workloads import summarise
+
+SESSION_DATA = {'user_id': 1, 'email': 'bench0@university.edu', 'name': 'Benchmark User 0', 'role': 'Student'}
+
+
+def _cookie(app, interface):
+    # Log in once: a new session saved through the interface
+    with app.test_request_context('/') as ctx:
+        session = interface.open_session(app, ctx.request)
+        session.update(SESSION_DATA)
+        response = app.response_class()
+        interface.save_session(app, session, response)
+    header = response.headers['Set-Cookie']
+    return header.split(';', 1)[0].split('=', 1)[1]
+
+
+def _time_requests(app, interface, cookie, requests):
+    name = interface.get_cookie_name(app)
+    latencies = []
+    with app.test_request_context('/', headers={'Cookie': f'{name}={cookie}'}) as ctx:
+        started = time.perf_counter()
+        for _ in range(requests):
+            t0 = time.perf_counter()
+            session = interface.open_session(app, ctx.request)
+            if session.get('user_id') is None or session.get('role') is None:
+                raise RuntimeError('Benchmark session did not round-trip')
+            interface.save_session(app, session, app.response_class())
+            latencies.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - started
+    return latencies, elapsed
+
+
+def run_sessions(app_module, requests=5000, redis_url=None):
+    from flask.sessions import SecureCookieSessionInterface
+    from session_store import SQLiteSessionStore, RedisSessionStore, ServerSessionInterface
+
+    app = app_module.app
+    interfaces = {
+        'cookie': SecureCookieSessionInterface(),
+        'sqlite_cached': ServerSessionInterface(SQLiteSessionStore()),
+        'sqlite_uncached': ServerSessionInterface(SQLiteSessionStore(), cache_seconds=0),
+    }
+    if redis_url:
+        import redis
+        client = redis.Redis.from_url(redis_url)
+        client.ping()
+        interfaces['redis_cached'] = ServerSessionInterface(RedisSessionStore(client))
+        interfaces['redis_uncached'] = ServerSessionInterface(RedisSessionStore(client), cache_seconds=0)
+
+    results = {}
+    for label, interface in interfaces.items():
+        cookie = _cookie(app, interface)
+        latencies, elapsed = _time_requests(app, interface, cookie, requests)
+        summary = summarise(latencies, 0, elapsed)
+        summary['latency_us'] = {key: round(value * 1000, 1) for key, value in summary.pop('latency_ms').items()}
+        summary['cookie_bytes'] = len(cookie)
+        if hasattr(interface, 'revoke'):
+            summary['store'] = interface.stats()
+            interface.revoke(SESSION_DATA['user_id'])
+        results[label] = summary
+    return {'requests': requests, 'redis': bool(redis_url), 'sessions': results}
@@ -0,0 +1,157 @@
+"""
+Scripted request workloads.
+
+Each workload turns a random generator into one request (method, URL and
+body). ``run_workload`` sends them through Flask test clients, one per
+thread, each logged in as a different benchmark user, and summarises the
+latencies. The chat workload talks to a stub model with a fixed reply delay,
+so it measures the context building around the model call, not Gemini.
+
+A request counts as an error when its status is 4xx/5xx, or when a workload's
+check finds a failure reported inside a 200 response (the chat route answers
+its own errors with a normal reply).
+"""
+
+import time
+import random
+import threading
+from types import SimpleNamespace
+
+
+def _feed(rng, corpus):
+    return 'GET', rng.choice(('/feed', '/feed?sort=most_viewed', '/feed?sort=most_stars')), None
+
+
+def _search(rng, corpus):
+    return 'POST', '/search', {'data': {'query': rng.choice(corpus['words'])}}
+
+
+def _document_view(rng, corpus):
+    return 'GET', f"/documents/{rng.randint(*corpus['documents'])}", None
+
+
+def _star_toggle(rng, corpus):
+    item_type = rng.choice(('document', 'answer'))
+    return 'POST', f"/api/star/{item_type}/{rng.randint(*corpus[item_type + 's'])}", None
+
+
+def _chat(rng, corpus):
+    words = ' '.join(rng.choice(corpus['words']) for _ in range(6))
+    return 'POST', '/api/chat', {'json': {'message': f'Explain {words}'}}
+
+
+def _chat_failed(response):
+    from gemini_chat import ERROR_REPLY_PREFIX
+    reply = (response.get_json(silent=True) or {}).get('response') or ''
+    return reply.startswith(ERROR_REPLY_PREFIX)
+
+
+WORKLOADS = {
+    'feed': _feed,
+    'search': _search,
+    'document_view': _document_view,
+    'star_toggle': _star_toggle,
+    'chat': _chat,
+}
+
+# Checks for failures that come back with a 200
+FAILED_REPLIES = {
+    'chat': _chat_failed,
+}
+
+
+class StubModel:
+    """Stands in for the Gemini model: a canned reply after ``delay`` seconds."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def generate_content(self, prompt):
+        if self.delay:
+            time.sleep(self.delay)
+        return SimpleNamespace(text=f'Stub reply to a {len(prompt)} character prompt.')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarise(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        'requests': count,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(count / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {
+            'mean': ms(sum(latencies) / count) if count else 0.0,
+            'p50': ms(percentile(latencies, 0.50)),
+            'p90': ms(percentile(latencies, 0.90)),
+            'p95': ms(percentile(latencies, 0.95)),
+            'p99': ms(percentile(latencies, 0.99)),
+            'max': ms(latencies[-1]) if count else 0.0,
+        },
+    }
+
+
+def _logged_in_client(app, corpus, user_id):
+    client = app.test_client()
+    response = client.post('/login', data={'email': f"bench{user_id - corpus['users'][0]}@university.edu",
+                                           'password': corpus['password']})
+    if response.status_code >= 400:
+        raise RuntimeError(f'Benchmark login failed with status {response.status_code}')
+    return client
+
+
+def run_workload(app, corpus, name, requests=200, concurrency=1, warmup=10, seed=0):
+    """Send ``requests`` requests of workload ``name`` and return their summary."""
+    make_request = WORKLOADS[name]
+    failed_reply = FAILED_REPLIES.get(name)
+    per_thread = [requests // concurrency + (1 if i < requests % concurrency else 0)
+                  for i in range(concurrency)]
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    ready = threading.Barrier(concurrency + 1)
+
+    def worker(index, count):
+        rng = random.Random(f'{seed}-{name}-{index}')
+        try:
+            client = _logged_in_client(app, corpus, rng.randint(*corpus['users']))
+            for _ in range(warmup):
+                method, url, kwargs = make_request(rng, corpus)
+                client.open(url, method=method, **(kwargs or {}))
+        except Exception:
+            # Release the other threads instead of leaving them waiting forever
+            ready.abort()
+            raise
+        ready.wait()
+        local, failed = [], 0
+        for _ in range(count):
+            method, url, kwargs = make_request(rng, corpus)
+            started = time.perf_counter()
+            response = client.open(url, method=method, **(kwargs or {}))
+            local.append(time.perf_counter() - started)
+            if response.status_code >= 400 or (failed_reply and failed_reply(response)):
+                failed += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(i, count), daemon=True)
+               for i, count in enumerate(per_thread)]
+    for thread in threads:
+        thread.start()
+    try:
+        ready.wait()
+    except threading.BrokenBarrierError:
+        raise RuntimeError(f'A {name} client failed to start')
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return summarise(latencies, errors[0], time.perf_counter() - started)
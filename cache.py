@@ -0,0 +1,209 @@
+"""
+Read-model caching with tag-based invalidation.
+
+A ``Cache`` keeps computed values (feed pages, search results, document rows)
+in an in-process LRU and, when ``CACHE_REDIS_URL`` is set, in Redis as well
+so workers share them. Every entry is stored with the tags it depends on
+(``'documents'``, ``'document:42'``, ...) and the version of each tag at the
+time; write paths call ``invalidate(*tags)``, which bumps those versions so
+every entry built on the old data misses on its next read. No entry has to
+be found and deleted.
+
+With Redis the tag versions live there too, so an invalidation in one worker
+is seen by all of them. Without it, other workers only notice once their
+copies reach ``CACHE_TTL``. Redis errors are logged and treated as misses.
+"""
+
+import json
+import time
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from metrics import registry as metrics_registry
+from timestamps import format_timestamp, parse_timestamp
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+TAG_VERSIONS_KEY = 'cache:tags'
+
+cache_requests = metrics_registry.counter(
+    'cache_requests_total', 'Cache lookups by cache and result.', ('cache', 'result'))
+
+
+class TagVersions:
+    """Current version of every tag: in Redis when available, else in this process."""
+
+    def __init__(self):
+        self.redis = None
+        self._lock = threading.Lock()
+        self._local = {}
+
+    def get(self, tags):
+        if self.redis is not None:
+            try:
+                return tuple(int(v or 0) for v in self.redis.hmget(TAG_VERSIONS_KEY, tags))
+            except Exception as e:
+                print(f"Warning: cache tag versions unavailable: {str(e)}")
+                return None
+        with self._lock:
+            return tuple(self._local.get(tag, 0) for tag in tags)
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._local[tag] = self._local.get(tag, 0) + 1
+        if self.redis is not None:
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for tag in tags:
+                    pipe.hincrby(TAG_VERSIONS_KEY, tag, 1)
+                pipe.execute()
+            except Exception as e:
+                print(f"Warning: cache invalidation of {', '.join(tags)} not shared: {str(e)}")
+
+
+def _json_default(value):
+    # Rows carry TIMESTAMP columns as datetimes; keep them datetimes through Redis
+    if isinstance(value, datetime):
+        return {'$timestamp': format_timestamp(value)}
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _json_object_hook(obj):
+    if len(obj) == 1 and '$timestamp' in obj:
+        return parse_timestamp(obj['$timestamp'])
+    return obj
+
+
+tag_versions = TagVersions()
+caches = {}
+
+
+class Cache:
+    """A named cache. ``shared=False`` keeps it in-process even when Redis is configured."""
+
+    def __init__(self, name, maxsize=256, ttl=60, shared=True):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared = shared
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {'hits': 0, 'redis_hits': 0, 'misses': 0}
+        caches[name] = self
+
+    def _count(self, result):
+        with self._lock:
+            self._stats[result] += 1
+        metrics_registry.inc(cache_requests, (self.name, result))
+
+    def get_or_set(self, key, tags, compute):
+        """Return the cached value for ``key``, or compute, cache and return it.
+
+        ``compute`` must return JSON-serialisable data when Redis is used;
+        None results are not cached. Callers must not modify the value.
+        """
+        if not self.enabled:
+            return compute()
+        tags = tuple(tags)
+        versions = tag_versions.get(tags) if tags else ()
+        if versions is None:
+            self._count('misses')
+            return compute()
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires, entry_versions = entry
+                if expires > now and entry_versions == versions:
+                    self._entries.move_to_end(key)
+                else:
+                    entry = None
+                    del self._entries[key]
+        if entry is not None:
+            self._count('hits')
+            return value
+
+        value = self._redis_get(key, versions)
+        if value is not None:
+            self._count('redis_hits')
+        else:
+            self._count('misses')
+            value = compute()
+            if value is None:
+                return None
+            self._redis_set(key, value, versions)
+        with self._lock:
+            self._entries[key] = (value, now + self.ttl, versions)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def _redis_key(self, key):
+        return f'cache:{self.name}:{key}'
+
+    def _redis_get(self, key, versions):
+        client = tag_versions.redis if self.shared else None
+        if client is None:
+            return None
+        try:
+            raw = client.get(self._redis_key(key))
+        except Exception as e:
+            print(f"Warning: cache {self.name} read from Redis failed: {str(e)}")
+            return None
+        if raw is None:
+            return None
+        stored = json.loads(raw, object_hook=_json_object_hook)
+        return stored['value'] if tuple(stored['versions']) == versions else None
+
+    def _redis_set(self, key, value, versions):
+        client = tag_versions.redis if self.shared else None
+        if client is None:
+            return
+        try:
+            client.set(self._redis_key(key), json.dumps({'versions': versions, 'value': value}, default=_json_default), ex=self.ttl)
+        except Exception as e:
+            print(f"Warning: cache {self.name} write to Redis failed: {str(e)}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['redis_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['redis_hits']) / lookups if lookups else 0.0
+        return stats
+
+
+def invalidate(*tags):
+    """Make every cached value that depends on any of ``tags`` stale."""
+    if tags:
+        tag_versions.bump(tags)
+
+
+def init_cache(app):
+    """Apply CACHE_ENABLED, CACHE_TTL and CACHE_REDIS_URL to every cache."""
+    for cache in caches.values():
+        cache.enabled = app.config.get('CACHE_ENABLED', True)
+        cache.ttl = app.config.get('CACHE_TTL', cache.ttl)
+    url = app.config.get('CACHE_REDIS_URL')
+    if not url:
+        return
+    if redis is None:
+        print("Warning: CACHE_REDIS_URL is set but the redis package is not installed; caching in-process only.")
+        return
+    try:
+        client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        client.ping()
+        tag_versions.redis = client
+    except Exception as e:
+        print(f"Warning: Failed to connect to the cache Redis: {e}. Caching in-process only.")
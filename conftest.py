@@ -0,0 +1,20 @@
+"""
+Test setup shared by every test module.
+
+Importing the app creates and seeds its database, and ``db_utils`` fixes the
+database path when it is first imported, by whichever test module gets there
+first. The scratch database is therefore chosen here, before any of them is
+collected, so a test run never touches the tracked database.db.
+"""
+
+import os
+import shutil
+import tempfile
+
+TEST_DIR = tempfile.mkdtemp(prefix='fuldocs-tests-')
+os.environ['DATABASE_PATH'] = os.path.join(TEST_DIR, 'database.db')
+os.environ.setdefault('GEMINI_API_KEY', 'test')
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(TEST_DIR, ignore_errors=True)
@@ -0,0 +1,180 @@
+"""
+SQL instrumentation for connections returned by ``get_db_connection``.
+
+Every statement run through an ``InstrumentedConnection`` (or a cursor made
+from one) is counted and timed. Within a request the totals are kept on
+``g`` and, when the request ends, folded into per-route aggregates; statements
+slower than ``SLOW_QUERY_MS`` are logged with the route that ran them. In
+debug mode each response carries its totals in ``X-DB-Queries`` and
+``X-DB-Time-Ms``.
+
+Timings cover ``execute``, which for SQLite includes planning and stepping to
+the first row (and the whole statement for writes and sorted reads); rows
+fetched afterwards are not timed.
+"""
+
+import re
+import time
+import threading
+from functools import lru_cache
+from sqlite3 import Connection, Cursor
+from flask import g, request, has_request_context, has_app_context, current_app
+
+# Statements slower than this are logged (overridden by the SLOW_QUERY_MS setting)
+DEFAULT_SLOW_QUERY_MS = 100
+
+# Distinct normalized statements kept in the aggregate table
+MAX_TRACKED_STATEMENTS = 500
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """Collapse a statement to its shape: literals become ``?``, ``IN`` lists one ``?...``."""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    return _PLACEHOLDER_LIST.sub('(?...)', sql)
+
+
+class QueryStats:
+    """Per-route and per-statement aggregates, shared by the threads of a worker."""
+
+    def __init__(self):
+        self.slow_query_ms = DEFAULT_SLOW_QUERY_MS
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._statements = {}
+
+    def record_statement(self, sql, seconds):
+        shape = normalize_sql(sql)
+        with self._lock:
+            entry = self._statements.get(shape)
+            if entry is None:
+                if len(self._statements) >= MAX_TRACKED_STATEMENTS:
+                    return shape
+                entry = self._statements[shape] = {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+            entry['count'] += 1
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+        return shape
+
+    def record_request(self, route, queries, seconds, slow):
+        with self._lock:
+            entry = self._routes.get(route)
+            if entry is None:
+                entry = self._routes[route] = {
+                    'requests': 0, 'queries': 0, 'db_seconds': 0.0,
+                    'max_queries': 0, 'max_db_seconds': 0.0, 'slow_queries': 0,
+                }
+            entry['requests'] += 1
+            entry['queries'] += queries
+            entry['db_seconds'] += seconds
+            entry['max_queries'] = max(entry['max_queries'], queries)
+            entry['max_db_seconds'] = max(entry['max_db_seconds'], seconds)
+            entry['slow_queries'] += slow
+
+    def snapshot(self, top=20):
+        """Route aggregates plus the ``top`` statements by total time."""
+        with self._lock:
+            routes = {route: dict(entry) for route, entry in self._routes.items()}
+            statements = sorted(
+                ({'sql': shape, **entry} for shape, entry in self._statements.items()),
+                key=lambda entry: entry['seconds'], reverse=True)[:top]
+        for entry in routes.values():
+            entry['avg_queries'] = entry['queries'] / entry['requests']
+            entry['avg_db_seconds'] = entry['db_seconds'] / entry['requests']
+        return {'slow_query_ms': self.slow_query_ms, 'routes': routes, 'statements': statements}
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+            self._statements.clear()
+
+
+query_stats = QueryStats()
+
+
+def _route():
+    if has_request_context():
+        # One key for every unrouted URL (scanners, typos), as in metrics.py, so stats stay bounded
+        return request.endpoint or 'unmatched'
+    return None
+
+
+def _record(sql, seconds):
+    shape = query_stats.record_statement(sql, seconds)
+    route = _route()
+    if route is not None:
+        current = g.get('db_stats')
+        if current is None:
+            current = g.db_stats = {'queries': 0, 'seconds': 0.0, 'slow': 0}
+        current['queries'] += 1
+        current['seconds'] += seconds
+    if seconds * 1000 >= query_stats.slow_query_ms:
+        if route is not None:
+            current['slow'] += 1
+        message = f"Slow query ({seconds * 1000:.1f} ms) in {route or 'background task'}: {shape}"
+        if has_app_context():
+            current_app.logger.warning(message)
+        else:
+            print(f"Warning: {message}")
+
+
+class InstrumentedCursor(Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record(sql, time.perf_counter() - started)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            _record(sql_script, time.perf_counter() - started)
+
+
+class InstrumentedConnection(Connection):
+    """``sqlite3.Connection`` whose statements are counted and timed; pass as ``factory``."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def init_db_instrumentation(app):
+    """Apply SLOW_QUERY_MS and fold each request's query totals into the route aggregates."""
+    query_stats.slow_query_ms = app.config.get('SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_MS)
+
+    @app.after_request
+    def record_db_stats(response):
+        current = g.get('db_stats')
+        if current is None:
+            current = {'queries': 0, 'seconds': 0.0, 'slow': 0}
+        query_stats.record_request(_route(), current['queries'], current['seconds'], current['slow'])
+        if app.debug or app.config.get('DB_STATS_HEADERS'):
+            response.headers['X-DB-Queries'] = str(current['queries'])
+            response.headers['X-DB-Time-Ms'] = f"{current['seconds'] * 1000:.2f}"
+        return response
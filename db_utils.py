@@ -1,13 +1,15 @@
 import os
 import sqlite3
 from datetime import datetime, timedelta
+from db_instrumentation import InstrumentedConnection
+import timestamps  # registers the TIMESTAMP converter and datetime adapter
 
-# Get the absolute path to the database file
-DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.db')
+# Get the absolute path to the database file (DATABASE_PATH overrides it, e.g. for tests)
+DATABASE = os.environ.get('DATABASE_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.db')
 
 def get_db_connection():
     """Create and return a database connection."""
-    conn = sqlite3.connect(DATABASE)
+    conn = sqlite3.connect(DATABASE, factory=InstrumentedConnection, detect_types=sqlite3.PARSE_DECLTYPES)
     conn.row_factory = sqlite3.Row
     return conn
 
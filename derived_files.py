@@ -0,0 +1,67 @@
+"""
+Files derived from uploads, and the background queues that produce them.
+
+Renditions (thumbnails), page texts (document_pages) and compressed variants
+(file_serving) are written next to their source with ``write_atomic``, so a
+reader never sees a half-written file; ``sweep_orphans`` removes the
+``TEMP_PREFIX`` files a crash leaves behind. The slow ones are produced on a
+``BackgroundQueue`` so uploads and page views don't wait for them.
+"""
+
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Prefix of the temporary files write_atomic renames into place
+TEMP_PREFIX = '.variant-'
+
+# Every BackgroundQueue by name, for monitoring
+queues = {}
+
+
+def write_atomic(path, data):
+    """Write ``data`` to ``path`` through a temporary file in the same directory."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=TEMP_PREFIX)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class BackgroundQueue:
+    """A small thread pool that runs at most one job per key at a time."""
+
+    def __init__(self, name, workers=1):
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._pending = set()
+        self._lock = threading.Lock()
+        queues[name] = self
+
+    def submit(self, key, func, *args):
+        """Run ``func(*args)`` in the background unless a job for ``key`` is already queued or running."""
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+        self._executor.submit(self._run, key, func, args)
+        return True
+
+    def _run(self, key, func, args):
+        try:
+            func(*args)
+        except Exception as e:
+            print(f"Error in background job {self.name} for {key}: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def queue_length(self):
+        """Jobs queued or running, for monitoring."""
+        with self._lock:
+            return len(self._pending)
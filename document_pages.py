@@ -0,0 +1,94 @@
+"""
+Per-page text of PDF documents for paginated viewing.
+
+When a PDF is stored its pages are extracted once into ``<blob>.pages``, a
+UTF-8 file with the page texts back to back, plus ``<blob>.pages.idx``, a
+JSON list of the byte offsets where each page starts (and where the last one
+ends). Serving a range of pages is then a seek and a read instead of
+reparsing the PDF.
+"""
+
+import os
+import json
+from PyPDF2 import PdfReader
+from derived_files import BackgroundQueue, write_atomic
+
+PAGES_SUFFIX = '.pages'
+INDEX_SUFFIX = '.pages.idx'
+
+# Upper bound for one request to /documents/<id>/pages
+MAX_PAGES_PER_REQUEST = 20
+
+page_index_queue = BackgroundQueue('page_index')
+
+
+def can_paginate(file_path):
+    return os.path.splitext(file_path or '')[1].lower() == '.pdf'
+
+
+def build_page_index(source):
+    """Extract the pages of a PDF into ``.pages``/``.pages.idx`` files. Returns the page count."""
+    offsets = [0]
+    chunks = []
+    with open(source, 'rb') as f:
+        for page in PdfReader(f).pages:
+            try:
+                text = page.extract_text() or ''
+            except Exception:
+                # One bad page shouldn't lose the rest of the document
+                text = ''
+            data = text.encode('utf-8')
+            chunks.append(data)
+            offsets.append(offsets[-1] + len(data))
+
+    write_atomic(source + PAGES_SUFFIX, b''.join(chunks))
+    # Written last: an index means the pages file is complete
+    write_atomic(source + INDEX_SUFFIX, json.dumps(offsets).encode('utf-8'))
+    return len(chunks)
+
+
+def has_page_index(source):
+    return os.path.exists(source + INDEX_SUFFIX)
+
+
+def read_pages(source, start, count):
+    """Return ``(page_count, texts)`` for ``count`` pages from the 0-based ``start``.
+
+    Raises FileNotFoundError when the index hasn't been built yet.
+    """
+    with open(source + INDEX_SUFFIX, 'rb') as f:
+        offsets = json.load(f)
+    page_count = len(offsets) - 1
+    start = min(max(start, 0), page_count)
+    end = min(start + count, page_count)
+    if start >= end:
+        return page_count, []
+
+    with open(source + PAGES_SUFFIX, 'rb') as f:
+        f.seek(offsets[start])
+        data = f.read(offsets[end] - offsets[start])
+    texts = []
+    for i in range(start, end):
+        page = data[offsets[i] - offsets[start]:offsets[i + 1] - offsets[start]]
+        texts.append(page.decode('utf-8', errors='replace'))
+    return page_count, texts
+
+
+def _index_job(source):
+    try:
+        build_page_index(source)
+    except Exception as e:
+        print(f"Error extracting pages of {source}: {str(e)}")
+        # Record an empty index so unreadable PDFs aren't reparsed on every request;
+        # viewers fall back to the original file
+        try:
+            write_atomic(source + INDEX_SUFFIX, b'[0]')
+        except OSError:
+            pass
+
+
+def schedule_page_index(upload_folder, file_path):
+    """Queue a PDF for page extraction in the background; duplicates are ignored."""
+    if can_paginate(file_path):
+        source = os.path.join(upload_folder, *file_path.split('/'))
+        page_index_queue.submit(source, _index_job, source)
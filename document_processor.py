@@ -1,4 +1,6 @@
 import os
+import re
+from html.parser import HTMLParser
 from PyPDF2 import PdfReader
 from docx import Document
 from db_utils import get_db_connection
@@ -26,21 +28,99 @@ def extract_text_from_file(file_path):
         print(f"Error extracting text from {file_path}: {str(e)}")
         return ""
 
-def get_document_context():
-    """Get context from all documents in the uploads directory."""
-    uploads_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
-    context = []
-    
-    if not os.path.exists(uploads_dir):
+# Characters of plain text kept for document previews
+PREVIEW_EXCERPT_LENGTH = 300
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """Collect the visible text of an HTML document."""
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style', 'head'):
+            self._skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style', 'head') and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def build_preview(file_path, excerpt_length=PREVIEW_EXCERPT_LENGTH):
+    """Compute the preview metadata stored with a document at upload time.
+
+    Returns a dict with ``excerpt`` (plain text, may be empty), ``page_count``
+    (PDFs only, else None) and ``file_size``.
+    """
+    _, ext = os.path.splitext(file_path.lower())
+    text = ''
+    page_count = None
+
+    try:
+        if ext == '.pdf':
+            with open(file_path, 'rb') as f:
+                reader = PdfReader(f)
+                page_count = len(reader.pages)
+                # A few pages are enough for an excerpt
+                for page in reader.pages[:3]:
+                    text += (page.extract_text() or '') + '\n'
+                    if len(text) >= excerpt_length:
+                        break
+        elif ext in ('.html', '.htm'):
+            parser = _HTMLTextExtractor()
+            with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                parser.feed(f.read())
+            text = ' '.join(parser.parts)
+        else:
+            text = extract_text_from_file(file_path) or ''
+    except Exception as e:
+        print(f"Error building preview for {file_path}: {str(e)}")
+
+    text = re.sub(r'\s+', ' ', text).strip()
+    if len(text) > excerpt_length:
+        text = text[:excerpt_length].rsplit(' ', 1)[0] + '...'
+    return {
+        'excerpt': text,
+        'page_count': page_count,
+        'file_size': os.path.getsize(file_path),
+    }
+
+# Uploads folder used when the caller doesn't pass the app's UPLOAD_FOLDER
+UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+
+def get_document_context(upload_folder=None):
+    """Get context from the text of every document, under its title."""
+    upload_folder = upload_folder or UPLOAD_FOLDER
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            "SELECT title, file_path FROM Documents WHERE file_path IS NOT NULL AND file_path != '' "
+            "ORDER BY created_at DESC"
+        ).fetchall()
+    except Exception as e:
+        print(f"Error fetching documents for context: {str(e)}")
         return ""
-        
-    for filename in os.listdir(uploads_dir):
-        file_path = os.path.join(uploads_dir, filename)
-        if os.path.isfile(file_path):
-            text = extract_text_from_file(file_path)
-            if text:
-                context.append(f"Document: {filename}\n{text}")
-    
+    finally:
+        conn.close()
+
+    context = []
+    texts = {}
+    for row in rows:
+        file_path = row['file_path']
+        # Blobs are shared by documents with the same content; read each once
+        if file_path not in texts:
+            full_path = os.path.join(upload_folder, *file_path.split('/'))
+            texts[file_path] = extract_text_from_file(full_path) if os.path.isfile(full_path) else None
+        if texts[file_path]:
+            context.append(f"Document: {row['title']}\nFile: {file_path}\n{texts[file_path]}")
+
     return "\n\n".join(context)
 
 def get_documents_metadata() -> list[dict]:
@@ -0,0 +1,231 @@
+"""
+HTTP delivery of uploaded files.
+
+Responses carry strong validators (the SHA-256 for content-addressed blobs,
+mtime/size for older uploads) and a per-type Cache-Control policy. Conditional
+requests are answered with 304 and byte ranges with 206, so a repeat view costs
+a header exchange instead of the whole file.
+
+Text uploads (HTML tutorials and the like) also get precompressed ``.gz`` and
+``.br`` siblings on disk; the best one the client accepts is sent with
+``Content-Encoding`` and ``Vary: Accept-Encoding``.
+
+File bodies are streamed with ``wsgi.file_wrapper`` by default. Setting
+``FILE_OFFLOAD`` hands the transfer to the front proxy instead, so the app only
+does the access and path checks:
+
+- ``x-sendfile`` (Apache mod_xsendfile, lighttpd): the absolute path is sent
+  in an ``X-Sendfile`` header.
+- ``x-accel-redirect`` (nginx): the path is sent in ``X-Accel-Redirect`` under
+  ``FILE_OFFLOAD_PREFIX``, which must map to an internal location, e.g.::
+
+      location /protected-uploads/ {
+          internal;
+          alias /srv/fuldocs/uploads/;
+          gzip_static on;
+      }
+
+  nginx then serves byte ranges, conditional requests and ``.gz`` variants
+  itself.
+"""
+
+import os
+import gzip
+from urllib.parse import quote
+from flask import current_app, request, send_file
+from werkzeug.utils import send_file as werkzeug_send_file
+from upload_storage import is_blob_path
+from derived_files import write_atomic
+
+# Brotli is optional; without it only gzip variants are produced
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Cache-Control per file kind; override entries with app.config['UPLOAD_CACHE_POLICIES']
+DEFAULT_CACHE_POLICIES = {
+    # Content-addressed blobs never change under the same URL
+    'blob': 'private, max-age=31536000, immutable',
+    # Renditions of a blob keep their URL when re-rendered (an SVG card replaced by a PNG)
+    'rendition': 'private, max-age=3600, must-revalidate',
+    'html': 'private, max-age=300, must-revalidate',
+    'pdf': 'private, max-age=3600, must-revalidate',
+    'image': 'private, max-age=86400',
+    'default': 'private, no-cache',
+}
+
+
+# Extensions worth precompressing
+COMPRESSIBLE_EXTENSIONS = {'.html', '.htm', '.txt', '.css', '.js', '.json', '.svg', '.xml', '.csv', '.md'}
+
+# Variant suffix per Content-Encoding, in order of preference
+ENCODING_SUFFIXES = (('br', '.br'), ('gzip', '.gz'))
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9  # 11 compresses ~1% better but is 20x slower
+
+
+def file_kind(filename):
+    """Classify an upload by extension for picking its cache policy."""
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in ('.html', '.htm'):
+        return 'html'
+    if ext == '.pdf':
+        return 'pdf'
+    if ext in ('.jpg', '.jpeg', '.png', '.gif', '.svg'):
+        return 'image'
+    return 'default'
+
+
+def file_etag(filename, stat, derived=False):
+    """Strong ETag for an upload: its content hash when known, else mtime and size."""
+    if is_blob_path(filename) and not derived:
+        return os.path.splitext(os.path.basename(filename))[0]
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+
+def cache_policy(filename, derived=False):
+    """Return the Cache-Control header value for an upload."""
+    policies = dict(DEFAULT_CACHE_POLICIES)
+    policies.update(current_app.config.get('UPLOAD_CACHE_POLICIES', {}))
+    if derived:
+        kind = 'rendition'
+    else:
+        kind = 'blob' if is_blob_path(filename) else file_kind(filename)
+    return policies.get(kind, policies['default'])
+
+
+def is_compressible(filename):
+    return os.path.splitext(filename)[1].lower() in COMPRESSIBLE_EXTENSIONS
+
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _available_encodings():
+    return [(encoding, suffix) for encoding, suffix in ENCODING_SUFFIXES
+            if encoding != 'br' or brotli is not None]
+
+
+def precompress(path):
+    """Write ``.gz``/``.br`` siblings of a text file unless they are already up to date."""
+    if not is_compressible(path):
+        return
+    source_mtime = os.path.getmtime(path)
+    data = None
+    for encoding, suffix in _available_encodings():
+        variant = path + suffix
+        if os.path.exists(variant) and os.path.getmtime(variant) >= source_mtime:
+            continue
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        write_atomic(variant, _compress(data, encoding))
+
+
+def select_variant(path, stat):
+    """Pick the smallest precompressed variant the client accepts.
+
+    Variants are generated on first use and cached on disk. Returns
+    ``(encoding, variant_path, variant_stat)`` or None to send ``path`` as is.
+    """
+    accepted = [(encoding, suffix) for encoding, suffix in _available_encodings()
+                if request.accept_encodings[encoding] > 0]
+    if not accepted:
+        return None
+    # Highest q-value first; ties keep our own preference order
+    accepted.sort(key=lambda item: -request.accept_encodings[item[0]])
+    try:
+        precompress(path)
+    except OSError as e:
+        current_app.logger.error(f'Error precompressing {path}: {str(e)}')
+        return None
+
+    for encoding, suffix in accepted:
+        try:
+            variant_stat = os.stat(path + suffix)
+        except FileNotFoundError:
+            continue
+        # Incompressible content (e.g. embedded images) is sent as is
+        if variant_stat.st_size < stat.st_size:
+            return encoding, path + suffix, variant_stat
+    return None
+
+
+def _offload_file(path, filename, mimetype, etag, last_modified):
+    """Build an empty response that tells the front proxy to send the file.
+
+    Only 304s are answered here; ranges are left to the proxy.
+    """
+    response = werkzeug_send_file(
+        path,
+        request.environ,
+        mimetype=mimetype,
+        as_attachment=False,
+        download_name=os.path.basename(filename),
+        conditional=False,
+        etag=etag,
+        last_modified=last_modified,
+        use_x_sendfile=True,
+        response_class=current_app.response_class,
+    )
+    if current_app.config.get('FILE_OFFLOAD') == 'x-accel-redirect':
+        del response.headers['X-Sendfile']
+        prefix = current_app.config.get('FILE_OFFLOAD_PREFIX', '/protected-uploads/')
+        response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(filename)
+    # The proxy sets the real length; the app sends no body
+    del response.headers['Content-Length']
+
+    response.make_conditional(request.environ)
+    if response.status_code == 304:
+        response.headers.pop('X-Sendfile', None)
+        response.headers.pop('X-Accel-Redirect', None)
+    return response
+
+
+def send_upload(upload_folder, filename, mimetype, derived=False):
+    """Send an upload with validators, conditional/range handling and caching headers.
+
+    ``filename`` is relative to ``upload_folder`` and must already have been
+    checked by the caller. ``derived`` marks a file generated from a blob, such
+    as a rendition: it lives in the blob store but isn't content-addressed.
+    """
+    path = os.path.join(upload_folder, filename)
+    stat = os.stat(path)
+    etag = file_etag(filename, stat, derived)
+    offload = current_app.config.get('FILE_OFFLOAD')
+    # Werkzeug appends the charset for text/* types itself
+    mimetype = mimetype.split(';')[0]
+
+    variant = None
+    # nginx picks compressed variants itself (gzip_static)
+    if is_compressible(filename) and offload != 'x-accel-redirect':
+        variant = select_variant(path, stat)
+    if variant:
+        encoding, path, _ = variant
+        # Each representation needs its own strong ETag
+        etag = f'{etag}-{encoding}'
+
+    if offload:
+        response = _offload_file(path, filename, mimetype, etag, stat.st_mtime)
+    else:
+        # Streams the file through wsgi.file_wrapper, never reading it whole
+        response = send_file(
+            path,
+            mimetype=mimetype,
+            as_attachment=False,
+            download_name=os.path.basename(filename),
+            conditional=True,
+            etag=etag,
+            last_modified=stat.st_mtime,
+        )
+    if variant:
+        response.headers['Content-Encoding'] = variant[0]
+    if is_compressible(filename):
+        response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = cache_policy(filename, derived)
+    return response
@@ -37,6 +37,9 @@ model = genai.GenerativeModel(
 conversation_cache: Dict[str, Dict[str, Any]] = {}
 CACHE_EXPIRY = 900  # 15 minutes in seconds
 
+# Start of the reply sent when building the prompt or calling the model failed
+ERROR_REPLY_PREFIX = 'I encountered an error: '
+
 def get_document_links() -> str:
     """Generate clickable links for all uploaded documents."""
     docs = get_documents_metadata()
@@ -74,12 +77,13 @@ def update_conversation_history(session_id: str, role: str, content: str) -> Non
     if len(conversation_cache[session_id]['history']) > 20:  # Keep last 20 messages
         conversation_cache[session_id]['history'] = conversation_cache[session_id]['history'][-20:]
 
-def get_chat_response(user_input: str, session_id: str = 'default') -> str:
+def get_chat_response(user_input: str, session_id: str = 'default', upload_folder: Optional[str] = None) -> str:
     """Get a response from Gemini based on user input, document context, and database content.
     
     Args:
         user_input: The user's message
         session_id: Unique identifier for the conversation session
+        upload_folder: Where the documents' files are stored (the app's UPLOAD_FOLDER)
         
     Returns:
         str: The AI's response
@@ -89,7 +93,7 @@ def get_chat_response(user_input: str, session_id: str = 'default') -> str:
         update_conversation_history(session_id, 'user', user_input)
         
         # Get context from multiple sources
-        document_context = get_document_context()
+        document_context = get_document_context(upload_folder)
         database_context = get_database_context()
         document_links = get_document_links()
 
@@ -139,6 +143,6 @@ AI (respond in Markdown):"""
         return response_text
         
     except Exception as e:
-        error_msg = f"I encountered an error: {str(e)}"
+        error_msg = f"{ERROR_REPLY_PREFIX}{str(e)}"
         print(f"Error in get_chat_response: {error_msg}")
         return error_msg
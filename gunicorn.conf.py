@@ -0,0 +1,20 @@
+"""
+gunicorn settings, picked up automatically by ``gunicorn app:app``.
+
+Every logged-in page holds a notification stream open (see notifications.py),
+so workers must be able to serve other requests meanwhile: ``gthread`` gives
+each worker a pool of threads, and an idle stream costs one of them. gunicorn's
+default ``sync`` worker serves one request at a time; the app notices and
+degrades streams to slow polling, but ``gthread`` (or ``gevent``) is required
+for live notifications.
+"""
+
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# Streams per worker are capped by this; leave room for ordinary requests
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+# Streams send a keep-alive every NOTIFICATIONS_HEARTBEAT seconds
+keepalive = 20
@@ -1,6 +1,6 @@
 import sqlite3
 import os
-import hashlib
+from passwords import hash_password
 
 def list_users():
     db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.db')
@@ -36,13 +36,6 @@ def list_users():
     conn.close()
     return users, has_password
 
-def hash_password(password):
-    """Hash a password using the same method as in app.py"""
-    import os
-    salt = os.urandom(16)
-    pwd_hash = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000)
-    return salt.hex() + pwd_hash.hex()
-
 def reset_password(user_id, new_password):
     db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.db')
     conn = sqlite3.connect(db_path)
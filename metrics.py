@@ -0,0 +1,297 @@
+"""
+In-process metrics with a Prometheus text endpoint.
+
+Each request's latency is observed in histograms labelled by endpoint,
+method and status, alongside the time it spent in the database, rendering
+templates and talking to Redis. Gauges (queues, pending work) are read
+from callbacks when ``/metrics`` is scraped.
+
+With several gunicorn workers, set ``METRICS_MULTIPROC_DIR`` to a directory
+shared by them: every worker writes its histograms and counters to
+``<dir>/<pid>.json`` (at most once per ``METRICS_WRITE_INTERVAL`` seconds and
+on every scrape) and ``/metrics`` merges the files, so whichever worker
+answers the scrape reports the whole server. Counts from exited workers are
+kept so totals never go backwards; their gauges are dropped. Empty the
+directory whenever the server is (re)started.
+"""
+
+import os
+import json
+import time
+import tempfile
+import threading
+from bisect import bisect_left
+from flask import g, request, before_render_template, template_rendered
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, labels, value):
+        # Per-bucket (not cumulative) counts, then sum and count
+        data = self._values.get(labels)
+        if data is None:
+            data = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        data[bisect_left(self.buckets, value)] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    def dump(self):
+        return [[list(labels), list(data)] for labels, data in self._values.items()]
+
+    @staticmethod
+    def merge(into, data):
+        return [a + b for a, b in zip(into, data)] if into else list(data)
+
+    def lines(self, values):
+        for labels, data in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), data):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield _sample(f'{self.name}_bucket', self.labelnames + ('le',), labels + (le,), cumulative)
+            yield _sample(f'{self.name}_sum', self.labelnames, labels, data[-2])
+            yield _sample(f'{self.name}_count', self.labelnames, labels, data[-1])
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dump(self):
+        return [[list(labels), value] for labels, value in self._values.items()]
+
+    @staticmethod
+    def merge(into, value):
+        return (into or 0) + value
+
+    def lines(self, values):
+        for labels, value in sorted(values.items()):
+            yield _sample(self.name, self.labelnames, labels, value)
+
+
+class Gauge:
+    """Value read from ``callback`` at scrape time: a number, or ``{labels: value}``."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames, callback):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def dump(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"Error reading gauge {self.name}: {str(e)}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [[list(labels), value] for labels, value in values.items()]
+
+    merge = staticmethod(Counter.merge)
+    lines = Counter.lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _sample(name, labelnames, labels, value):
+    if labelnames:
+        pairs = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(labelnames, labels))
+        return f'{name}{{{pairs}}} {value}'
+    return f'{name} {value}'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self.multiproc_dir = None
+        self.write_interval = 1.0
+        self._last_write = 0.0
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, callback, labelnames=()):
+        return self._register(Gauge(name, help, labelnames, callback))
+
+    def observe(self, histogram, labels, value):
+        with self._lock:
+            histogram.observe(labels, value)
+
+    def inc(self, counter, labels=(), amount=1):
+        with self._lock:
+            counter.inc(labels, amount)
+
+    def dump(self):
+        """This process's values, JSON-serialisable."""
+        with self._lock:
+            dumped = {name: metric.dump() for name, metric in self._metrics.items()
+                      if metric.kind != 'gauge'}
+        dumped.update({name: metric.dump() for name, metric in self._metrics.items()
+                       if metric.kind == 'gauge'})
+        return dumped
+
+    def write(self, force=False):
+        """Write this worker's values to the multiprocess directory (throttled)."""
+        if not self.multiproc_dir:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_write < self.write_interval:
+            return
+        self._last_write = now
+        data = json.dumps(self.dump()).encode('utf-8')
+        fd, temp_path = tempfile.mkstemp(dir=self.multiproc_dir, prefix='.metrics-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, os.path.join(self.multiproc_dir, f'{os.getpid()}.json'))
+        except OSError as e:
+            print(f"Error writing metrics: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _collect(self):
+        if not self.multiproc_dir:
+            return [(os.getpid(), self.dump())]
+        self.write(force=True)
+        dumps = []
+        for entry in os.scandir(self.multiproc_dir):
+            pid, ext = os.path.splitext(entry.name)
+            if ext != '.json' or not pid.isdigit():
+                continue
+            try:
+                with open(entry.path, 'rb') as f:
+                    dumps.append((int(pid), json.load(f)))
+            except (OSError, ValueError):
+                continue
+        return dumps
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        merged = {name: {} for name in self._metrics}
+        for pid, dumped in self._collect():
+            alive = pid == os.getpid() or _pid_alive(pid)
+            for name, values in dumped.items():
+                metric = self._metrics.get(name)
+                if metric is None or (metric.kind == 'gauge' and not alive):
+                    continue
+                for labels, data in values:
+                    labels = tuple(labels)
+                    merged[name][labels] = metric.merge(merged[name].get(labels), data)
+
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            lines.extend(metric.lines(merged[name]))
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+request_duration = registry.histogram(
+    'http_request_duration_seconds', 'Request latency.', ('endpoint', 'method', 'status'))
+request_db_time = registry.histogram(
+    'http_request_db_seconds', 'Time per request spent running SQL.', ('endpoint',))
+request_db_queries = registry.histogram(
+    'http_request_db_queries', 'SQL statements per request.', ('endpoint',), QUERY_COUNT_BUCKETS)
+request_render_time = registry.histogram(
+    'http_request_render_seconds', 'Time per request spent rendering templates.', ('endpoint',))
+request_redis_time = registry.histogram(
+    'http_request_redis_seconds', 'Time per request spent waiting on Redis.', ('endpoint',))
+requests_total = registry.counter(
+    'http_requests_total', 'Requests served.', ('endpoint', 'method', 'status'))
+
+
+def record_timing(kind, seconds):
+    """Add time spent on ``kind`` (``'redis'``, ``'render'``, ...) to the current request."""
+    timings = g.setdefault('timings', {})
+    timings[kind] = timings.get(kind, 0.0) + seconds
+
+
+def init_metrics(app):
+    """Time every request and apply the METRICS_* settings."""
+    registry.multiproc_dir = app.config.get('METRICS_MULTIPROC_DIR') or None
+    registry.write_interval = app.config.get('METRICS_WRITE_INTERVAL', 1.0)
+    if registry.multiproc_dir:
+        os.makedirs(registry.multiproc_dir, exist_ok=True)
+
+    def render_started(sender, template, context, **extra):
+        g.render_started = time.perf_counter()
+
+    def render_finished(sender, template, context, **extra):
+        started = g.pop('render_started', None)
+        if started is not None:
+            record_timing('render', time.perf_counter() - started)
+
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def remember_status(response):
+        g.response_status = response.status_code
+        return response
+
+    # Observed at teardown so time spent in every after_request hook is included
+    @app.teardown_request
+    def observe_request(exc):
+        started = g.pop('request_started', None)
+        if started is None:
+            return
+        endpoint = request.endpoint or 'unmatched'
+        status = str(g.get('response_status', 500))
+        labels = (endpoint, request.method, status)
+        timings = g.get('timings', {})
+        db_stats = g.get('db_stats') or {'queries': 0, 'seconds': 0.0}
+        registry.observe(request_duration, labels, time.perf_counter() - started)
+        registry.inc(requests_total, labels)
+        registry.observe(request_db_time, (endpoint,), db_stats['seconds'])
+        registry.observe(request_db_queries, (endpoint,), db_stats['queries'])
+        registry.observe(request_render_time, (endpoint,), timings.get('render', 0.0))
+        registry.observe(request_redis_time, (endpoint,), timings.get('redis', 0.0))
+        registry.write()
@@ -0,0 +1,124 @@
+"""
+Moderation queue queries for the admin panel and its JSON API.
+
+Queues are paged with keyset cursors on ``(created_at, id)``, newest first,
+so every page costs the same however deep it is; the ``(status, created_at)``
+indexes created in ``init_db`` serve both the status filter and the order.
+Rows without a ``created_at`` sort last, newest id first.
+"""
+
+import base64
+import json
+from datetime import datetime
+from timestamps import format_timestamp
+
+DOCUMENT_STATUSES = ('Pending', 'Verified', 'Unverified')
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(row):
+    """Opaque cursor pointing just past ``row``."""
+    created_at = row['created_at']
+    if isinstance(created_at, datetime):
+        created_at = format_timestamp(created_at)
+    # Text that isn't a timestamp is kept as stored, and None as null
+    raw = json.dumps([created_at, row['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(created_at, id)`` from a cursor, or None for the first page.
+
+    Raises ValueError for a malformed cursor.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, item_id = json.loads(raw)
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(item_id, int) or not isinstance(created_at, (str, type(None))):
+        raise ValueError('Invalid cursor')
+    return created_at, item_id
+
+
+def _select(conn, table, columns, conditions, params, order, limit):
+    return conn.execute(
+        f'''SELECT {columns}, u.email AS author, u.name AS author_name
+            FROM {table} t
+            JOIN Users u ON t.user_id = u.id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY {order}
+            LIMIT ?''', (*params, limit)).fetchall()
+
+
+def _page(conn, table, columns, status, cursor, limit):
+    conditions = []
+    params = []
+    if status:
+        conditions.append('t.status = ?')
+        params.append(status)
+    position = decode_cursor(cursor)
+
+    # One extra row tells whether there is a next page. A NULL created_at never
+    # compares less than the cursor, so dated rows and undated ones (which come
+    # after them) are read by separate queries, each on the index.
+    rows = []
+    if not position or position[0] is not None:
+        dated = conditions + ['t.created_at IS NOT NULL']
+        dated_params = list(params)
+        if position:
+            dated.append('(t.created_at, t.id) < (?, ?)')
+            dated_params.extend(position)
+        rows = _select(conn, table, columns, dated, dated_params,
+                       't.created_at DESC, t.id DESC', limit + 1)
+    if len(rows) <= limit:
+        undated = conditions + ['t.created_at IS NULL']
+        undated_params = list(params)
+        if position and position[0] is None:
+            undated.append('t.id < ?')
+            undated_params.append(position[1])
+        rows += _select(conn, table, columns, undated, undated_params,
+                        't.id DESC', limit + 1 - len(rows))
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = encode_cursor(items[-1]) if len(rows) > limit else None
+    return items, next_cursor
+
+
+def documents_page(conn, status=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Return ``(documents, next_cursor)`` for the document queue."""
+    return _page(conn, 'Documents',
+                 't.id, t.title, t.description, t.status, t.created_at, t.file_path',
+                 status, cursor, limit)
+
+
+def questions_page(conn, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Return ``(questions, next_cursor)`` for the question queue."""
+    return _page(conn, 'Questions',
+                 't.id, t.title, t.description, t.status, t.created_at',
+                 None, cursor, limit)
+
+
+def status_counts(conn):
+    """Number of documents per status (answered from the status index)."""
+    counts = dict.fromkeys(DOCUMENT_STATUSES, 0)
+    for row in conn.execute('SELECT status, COUNT(*) AS count FROM Documents GROUP BY status'):
+        counts[row['status']] = row['count']
+    return counts
+
+
+def set_document_status(conn, doc_ids, status):
+    """Set the status of many documents in one statement. Returns the ids updated.
+
+    The caller commits.
+    """
+    if status not in DOCUMENT_STATUSES:
+        raise ValueError(f'Invalid status: {status}')
+    rows = conn.execute(
+        '''UPDATE Documents SET status = ?
+           WHERE id IN (SELECT value FROM json_each(?)) AND status != ?
+           RETURNING id''', (status, json.dumps([int(i) for i in doc_ids]), status)).fetchall()
+    return [row['id'] for row in rows]
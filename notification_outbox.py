@@ -0,0 +1,271 @@
+"""
+Batched notification writes.
+
+Routes queue notifications with ``notification_outbox.add()`` instead of
+inserting them. Every ``flush_interval`` seconds (sooner once ``max_pending``
+are waiting) the queued ones are written in one transaction and pushed to
+open notification streams.
+
+Notifications with the same group (e.g. answers to one question) collapse
+into one row: queued duplicates are merged before writing, and an unread row
+already in the table for that group is updated instead of a new row being
+added, so five answers read "5 new answers to your question". The partial
+unique index on ``(user_id, group_key) WHERE is_read = 0`` makes that an
+upsert. Once a row is read, the next event in its group starts a new one.
+
+Because a row can change after it was sent, streams don't use its id as the
+SSE event id but its ``version``: every insert or update of a user's row sets
+it to one more than the user's highest, so a reconnecting browser's
+Last-Event-ID selects exactly the rows created or updated since.
+
+Digests: every ``digest_interval`` seconds, a user's unread notifications
+older than ``digest_after`` seconds are folded into a single digest row and
+the originals are marked read.
+"""
+
+import os
+import json
+import time
+import atexit
+import threading
+from db_utils import get_db_connection
+from timestamps import TIMESTAMP_FORMAT
+from notifications import notification_broker, notification_event, unread_count
+
+# kind -> (message for one event, message for several); {count} and the fields passed to add() fill them in
+NOTIFICATION_KINDS = {
+    'answer': ('{actor} answered your question "{title}"',
+               '{count} new answers to your question "{title}"'),
+    'verification_request': ('{actor} asked you to verify "{title}"',
+                             '{count} documents are waiting for your verification'),
+    'verified': ('Your document "{title}" was verified',
+                 '{count} of your documents were verified'),
+    'unverified': ('Your document "{title}" was marked unverified',
+                   '{count} of your documents were marked unverified'),
+}
+DIGEST_GROUP = 'digest'
+DIGEST_MESSAGE = '{count} notifications you have not read'
+
+# Parameters: user_id, message, link, group_key, event_count, user_id again, printf template
+UPSERT_SQL = '''
+    INSERT INTO Notifications (user_id, message, link, group_key, event_count, version)
+    VALUES (?, ?, ?, ?, ?, (SELECT COALESCE(MAX(version), 0) + 1 FROM Notifications WHERE user_id = ?))
+    ON CONFLICT (user_id, group_key) WHERE is_read = 0 AND group_key IS NOT NULL
+    DO UPDATE SET event_count = event_count + excluded.event_count,
+                  message = printf(?, event_count + excluded.event_count),
+                  link = excluded.link,
+                  created_at = CURRENT_TIMESTAMP,
+                  version = excluded.version
+    RETURNING id, user_id
+'''
+
+
+def _printf_template(message, fields):
+    # {count} becomes printf's %d; any % in the other fields must survive printf
+    escaped = {key: str(value).replace('%', '%%') for key, value in fields.items()}
+    return message.replace('%', '%%').format(count='%d', **escaped)
+
+
+class NotificationOutbox:
+    def __init__(self, flush_interval=1.0, max_pending=500, digest_after=0, digest_interval=3600):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # Unread notifications older than this many seconds are folded into a digest (0 = never)
+        self.digest_after = digest_after
+        self.digest_interval = digest_interval
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = {}
+        self._pending_total = 0
+        self._last_digest = time.monotonic()
+        self._thread = None
+        self._pid = None
+        self._metrics = {
+            'queued': 0,
+            'collapsed': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'rows_written': 0,
+            'last_flush_rows': 0,
+            'last_flush_seconds': 0.0,
+            'digests': 0,
+        }
+
+    def configure(self, flush_interval=None, max_pending=None, digest_after=None, digest_interval=None):
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        if max_pending is not None:
+            self.max_pending = max_pending
+        if digest_after is not None:
+            self.digest_after = digest_after
+        if digest_interval is not None:
+            self.digest_interval = digest_interval
+
+    def add(self, user_id, kind, link=None, group=None, **fields):
+        """Queue a notification of ``kind`` for ``user_id``.
+
+        Notifications with the same ``kind`` and ``group`` (default: one group
+        per kind) collapse into one row while unread. ``fields`` fill in the
+        kind's messages; the latest event's values are used.
+        """
+        if kind not in NOTIFICATION_KINDS:
+            raise ValueError(f'Unknown notification kind: {kind}')
+        group_key = kind if group is None else f'{kind}:{group}'
+        with self._lock:
+            entry = self._pending.get((user_id, group_key))
+            if entry is None:
+                self._pending[(user_id, group_key)] = {'kind': kind, 'count': 1, 'link': link, 'fields': fields}
+            else:
+                entry.update(count=entry['count'] + 1, link=link, fields=fields)
+                self._metrics['collapsed'] += 1
+            self._pending_total += 1
+            self._metrics['queued'] += 1
+            force_flush = self._pending_total >= self.max_pending
+
+        self._ensure_thread()
+        if force_flush:
+            self._wake.set()
+
+    def flush(self):
+        """Write queued notifications in one transaction and push them. Returns rows written."""
+        with self._flush_lock:
+            with self._lock:
+                batch = self._pending
+                total = self._pending_total
+                self._pending = {}
+                self._pending_total = 0
+            if not batch:
+                return 0
+
+            started = time.monotonic()
+            try:
+                conn = get_db_connection()
+                try:
+                    with conn:
+                        ids = []
+                        for (user_id, group_key), entry in batch.items():
+                            one, many = NOTIFICATION_KINDS[entry['kind']]
+                            fields = entry['fields']
+                            if entry['count'] == 1:
+                                message = one.format(**fields)
+                            else:
+                                message = many.format(count=entry['count'], **fields)
+                            ids.append(conn.execute(
+                                UPSERT_SQL, (user_id, message, entry['link'], group_key, entry['count'],
+                                             user_id, _printf_template(many, fields))).fetchone()['id'])
+                    self._publish(conn, ids)
+                finally:
+                    conn.close()
+            except Exception as e:
+                print(f"Error writing notifications: {str(e)}")
+                self._requeue(batch, total)
+                with self._lock:
+                    self._metrics['flush_errors'] += 1
+                return 0
+
+            with self._lock:
+                self._metrics['flushes'] += 1
+                self._metrics['rows_written'] += len(batch)
+                self._metrics['last_flush_rows'] = len(batch)
+                self._metrics['last_flush_seconds'] = time.monotonic() - started
+            return len(batch)
+
+    def make_digests(self):
+        """Fold each user's old unread notifications into one digest row. Returns users digested."""
+        if not self.digest_after:
+            return 0
+        cutoff = time.strftime(TIMESTAMP_FORMAT, time.gmtime(time.time() - self.digest_after))
+        conn = get_db_connection()
+        try:
+            stale = {}
+            for row in conn.execute('SELECT id, user_id, event_count FROM Notifications '
+                                    'WHERE is_read = 0 AND created_at < ? AND group_key IS NOT ?',
+                                    (cutoff, DIGEST_GROUP)):
+                stale.setdefault(row['user_id'], []).append((row['id'], row['event_count']))
+            stale = {user_id: rows for user_id, rows in stale.items() if len(rows) > 1}
+            if not stale:
+                return 0
+            template = _printf_template(DIGEST_MESSAGE, {})
+            with conn:
+                ids = []
+                for user_id, rows in stale.items():
+                    count = sum(event_count for _, event_count in rows)
+                    ids.append(conn.execute(
+                        UPSERT_SQL, (user_id, DIGEST_MESSAGE.format(count=count), None, DIGEST_GROUP, count,
+                                     user_id, template)).fetchone()['id'])
+                conn.executemany('UPDATE Notifications SET is_read = 1 WHERE id = ?',
+                                 [(notification_id,) for rows in stale.values() for notification_id, _ in rows])
+            self._publish(conn, ids)
+        finally:
+            conn.close()
+        with self._lock:
+            self._metrics['digests'] += len(stale)
+        return len(stale)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._metrics)
+            stats['pending'] = self._pending_total
+            stats['pending_rows'] = len(self._pending)
+        return stats
+
+    def _publish(self, conn, ids):
+        # Push the committed rows, with each user's new unread count, to open streams.
+        # They are already written, so a failure here must not requeue them.
+        try:
+            for row in conn.execute('SELECT * FROM Notifications WHERE id IN (SELECT value FROM json_each(?))',
+                                    (json.dumps(ids),)).fetchall():
+                event = notification_event(row)
+                event['unread'] = unread_count(conn, row['user_id'])
+                notification_broker.publish(row['user_id'], {'type': 'notification', 'data': event})
+        except Exception as e:
+            print(f"Warning: written notifications not pushed to streams: {str(e)}")
+
+    def _requeue(self, batch, total):
+        # Merge a failed batch back so it is retried with the next flush
+        with self._lock:
+            for key, entry in batch.items():
+                pending = self._pending.get(key)
+                if pending is None:
+                    self._pending[key] = entry
+                else:
+                    pending['count'] += entry['count']
+            self._pending_total += total
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='notification-outbox', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            if self.digest_after and time.monotonic() - self._last_digest >= self.digest_interval:
+                self._last_digest = time.monotonic()
+                try:
+                    self.make_digests()
+                except Exception as e:
+                    print(f"Error making notification digests: {str(e)}")
+
+
+notification_outbox = NotificationOutbox()
+atexit.register(notification_outbox.flush)
+
+
+def init_notification_outbox(app):
+    """Apply the app's NOTIFICATION_* settings to the shared outbox."""
+    notification_outbox.configure(
+        flush_interval=app.config.get('NOTIFICATION_FLUSH_INTERVAL'),
+        max_pending=app.config.get('NOTIFICATION_MAX_PENDING'),
+        digest_after=app.config.get('NOTIFICATION_DIGEST_AFTER'),
+        digest_interval=app.config.get('NOTIFICATION_DIGEST_INTERVAL'),
+    )
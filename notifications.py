@@ -0,0 +1,214 @@
+"""
+Server push for notifications.
+
+Each open ``/api/notifications/stream`` connection subscribes to the
+``NotificationBroker`` for its user and sleeps on its own queue until a
+notification for that user is published, so idle clients cost a queue and a
+waiting thread rather than a poll every few seconds.
+
+Without Redis, ``publish`` hands events straight to this process's
+subscribers. With ``NOTIFICATIONS_REDIS_URL`` set, events are published on one
+Redis channel and a listener thread in every worker fans them out to its own
+subscribers, so a notification created in one worker reaches a stream held
+open by another. The listener is started lazily and restarted after a fork.
+
+A held-open stream occupies whatever serves the request, so streams are only
+held where that is cheap: threaded servers (gunicorn ``gthread``, see
+gunicorn.conf.py, and the Flask dev server) and gevent/eventlet workers. On
+gunicorn's default ``sync`` worker, or past ``NOTIFICATIONS_MAX_STREAMS`` open
+streams for one user in a worker, the stream answers once and tells the
+browser to come back later, which turns it into slow polling.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import threading
+from metrics import registry as metrics_registry
+from timestamps import format_timestamp
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+CHANNEL = 'notifications'
+
+notifications_published = metrics_registry.counter(
+    'notifications_published_total', 'Notification events published.')
+notifications_delivered = metrics_registry.counter(
+    'notifications_delivered_total', 'Notification events queued for open streams.')
+
+
+def unread_count(conn, user_id):
+    return conn.execute('SELECT COUNT(*) FROM Notifications WHERE user_id = ? AND is_read = 0',
+                        (user_id,)).fetchone()[0]
+
+
+def notification_event(row):
+    """The JSON form of a Notifications row sent to browsers."""
+    return {'id': row['id'], 'version': row['version'], 'message': row['message'], 'link': row['link'],
+            'count': row['event_count'], 'is_read': bool(row['is_read']),
+            'created_at': format_timestamp(row['created_at'])}
+
+
+def can_hold_streams(environ):
+    """Whether the server can keep a response open without blocking a whole worker."""
+    if environ.get('wsgi.multithread'):
+        return True
+    # Green threads: an idle stream is a parked greenlet
+    if 'gevent' in sys.modules:
+        from gevent import monkey
+        if monkey.is_module_patched('socket'):
+            return True
+    if 'eventlet' in sys.modules:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('socket'):
+            return True
+    return False
+
+
+def format_sse(data, event=None, event_id=None):
+    """One Server-Sent Events message carrying ``data`` as JSON."""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event:
+        lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, separators=(",", ":"))}')
+    return '\n'.join(lines) + '\n\n'
+
+
+class Subscription:
+    def __init__(self, broker, user_id):
+        self.broker = broker
+        self.user_id = user_id
+        self._queue = queue.SimpleQueue()
+
+    def put(self, event):
+        self._queue.put(event)
+
+    def get(self, timeout=None):
+        """The next event, or None if none arrives within ``timeout`` seconds."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class NotificationBroker:
+    def __init__(self):
+        self.redis = None
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._listener = None
+        self._listener_pid = None
+        self._stats = {'published': 0, 'delivered': 0, 'redis_errors': 0, 'refused': 0}
+
+    def subscribe(self, user_id, limit=None):
+        """Subscribe to ``user_id``'s events; None if the user already has ``limit`` subscriptions."""
+        subscription = Subscription(self, user_id)
+        with self._lock:
+            if limit is not None and len(self._subscribers.get(user_id, ())) >= limit:
+                self._stats['refused'] += 1
+                return None
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        if self.redis is not None:
+            self._ensure_listener()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def publish(self, user_id, event):
+        """Send ``event`` (JSON-serialisable) to every open stream of ``user_id``."""
+        with self._lock:
+            self._stats['published'] += 1
+        metrics_registry.inc(notifications_published)
+        if self.redis is not None:
+            try:
+                self.redis.publish(CHANNEL, json.dumps({'user_id': user_id, 'event': event}))
+                return
+            except Exception as e:
+                with self._lock:
+                    self._stats['redis_errors'] += 1
+                print(f"Warning: notification not published to Redis, delivering locally: {str(e)}")
+        self._deliver(user_id, event)
+
+    def _deliver(self, user_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+            self._stats['delivered'] += len(subscribers)
+        for subscription in subscribers:
+            subscription.put(event)
+        if subscribers:
+            metrics_registry.inc(notifications_delivered, amount=len(subscribers))
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is not None and self._listener_pid == os.getpid() and self._listener.is_alive():
+                return
+            self._listener_pid = os.getpid()
+            self._listener = threading.Thread(target=self._listen, name='notification-listener', daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                for message in pubsub.listen():
+                    if message.get('type') != 'message':
+                        continue
+                    data = json.loads(message['data'])
+                    self._deliver(data['user_id'], data['event'])
+            except Exception as e:
+                with self._lock:
+                    self._stats['redis_errors'] += 1
+                print(f"Warning: notification listener lost Redis, reconnecting: {str(e)}")
+                time.sleep(1)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['users'] = len(self._subscribers)
+            stats['subscribers'] = sum(len(s) for s in self._subscribers.values())
+        stats['redis'] = self.redis is not None
+        return stats
+
+
+notification_broker = NotificationBroker()
+
+
+def init_notifications(app):
+    """Connect the broker to NOTIFICATIONS_REDIS_URL when it is set."""
+    url = app.config.get('NOTIFICATIONS_REDIS_URL')
+    if not url:
+        return
+    if redis is None:
+        print("Warning: NOTIFICATIONS_REDIS_URL is set but the redis package is not installed; "
+              "notifications reach streams in this process only.")
+        return
+    try:
+        client = redis.Redis.from_url(url, socket_connect_timeout=1)
+        client.ping()
+        notification_broker.redis = client
+    except Exception as e:
+        print(f"Warning: Failed to connect to the notifications Redis: {e}. Delivering in-process only.")
@@ -0,0 +1,258 @@
+"""
+Password hashing off the request thread.
+
+PBKDF2 at 100,000 iterations costs tens of milliseconds of pure CPU, so a
+burst of logins used to tie up every worker. ``password_hasher`` runs hashes
+in a small process pool instead (``PASSWORD_WORKERS`` processes, 0 = inline)
+and admits at most ``PASSWORD_MAX_QUEUE`` waiting jobs per worker process;
+past that, ``PasswordHasherBusy`` is raised at once rather than queueing
+requests behind one another. A slot is only freed when its hash has really
+finished, so hashes abandoned after ``PASSWORD_TIMEOUT`` still count. The
+pool starts its processes from a fork server that has only this module
+loaded. Like ``spawn``, multiprocessing still runs the main script again in
+each of them unless it is a ``__main__`` module (``app.py`` makes itself one
+when run directly), so other scripts that import the app keep their own code
+under ``if __name__ == '__main__'``.
+
+Before a login reaches the hasher it takes a token from two buckets, one for
+the client IP and one for the account, so guessing at one account or from one
+address is slowed to ``LOGIN_*_RATE`` attempts a minute after a short burst.
+Buckets live in each worker process. The IP is ``request.remote_addr``, so
+behind a reverse proxy ``TRUSTED_PROXY_HOPS`` must be set for it to be the
+client's address rather than the proxy's.
+
+New hashes are stored as ``pbkdf2_sha256$<iterations>$<salt>$<hash>``. The
+original format (hex salt then hex hash, 100,000 iterations) still verifies,
+and ``needs_rehash`` tells login to re-store a password in the current format
+and ``PASSWORD_ITERATIONS`` once it has the plain text.
+"""
+
+import os
+import hmac
+import time
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from metrics import registry as metrics_registry
+
+ALGORITHM = 'pbkdf2_sha256'
+LEGACY_ITERATIONS = 100000
+DEFAULT_ITERATIONS = 100000
+
+password_hashes = metrics_registry.counter(
+    'password_hashes_total', 'Password hashes computed, by outcome.', ('result',))
+login_throttled = metrics_registry.counter(
+    'login_throttled_total', 'Login attempts refused before hashing, by bucket.', ('bucket',))
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing queue is full or a hash did not finish in time."""
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+
+
+def _parse(stored_password):
+    # (iterations, salt, hash bytes) for either stored format
+    if stored_password.startswith(ALGORITHM + '$'):
+        _, iterations, salt, pwd_hash = stored_password.split('$')
+        return int(iterations), bytes.fromhex(salt), bytes.fromhex(pwd_hash)
+    return LEGACY_ITERATIONS, bytes.fromhex(stored_password[:32]), bytes.fromhex(stored_password[32:])
+
+
+def hash_password(password, iterations=DEFAULT_ITERATIONS):
+    """Hash ``password`` on this thread."""
+    salt = os.urandom(16)
+    return f'{ALGORITHM}${iterations}${salt.hex()}${_pbkdf2(password, salt, iterations).hex()}'
+
+
+def verify_password(stored_password, provided_password):
+    """Check ``provided_password`` against a stored hash on this thread."""
+    try:
+        iterations, salt, pwd_hash = _parse(stored_password)
+    except ValueError:
+        return False
+    return hmac.compare_digest(_pbkdf2(provided_password, salt, iterations), pwd_hash)
+
+
+def needs_rehash(stored_password, iterations=DEFAULT_ITERATIONS):
+    """True if the hash is in the old format or uses other parameters than ``iterations``."""
+    if not stored_password.startswith(ALGORITHM + '$'):
+        return True
+    try:
+        return _parse(stored_password)[0] != iterations
+    except ValueError:
+        return True
+
+
+class PasswordHasher:
+    def __init__(self, workers=2, max_queue=16, timeout=5.0, iterations=DEFAULT_ITERATIONS):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.iterations = iterations
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + max_queue)
+        self._pool = None
+        self._pid = None
+        self._stats = {'hashed': 0, 'verified': 0, 'busy': 0, 'timeouts': 0, 'in_flight': 0}
+
+    def configure(self, workers=None, max_queue=None, timeout=None, iterations=None):
+        with self._lock:
+            if workers is not None:
+                self.workers = workers
+            if max_queue is not None:
+                self.max_queue = max_queue
+            if timeout is not None:
+                self.timeout = timeout
+            if iterations is not None:
+                self.iterations = iterations
+            self._slots = threading.BoundedSemaphore(max(self.workers, 1) + self.max_queue)
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def hash(self, password):
+        """Hash ``password`` with the current parameters in the pool."""
+        return self._run(hash_password, password, self.iterations, stat='hashed')
+
+    def verify(self, stored_password, provided_password):
+        return self._run(verify_password, stored_password, provided_password, stat='verified')
+
+    def needs_rehash(self, stored_password):
+        return needs_rehash(stored_password, self.iterations)
+
+    def _executor(self):
+        # One pool per process; a forked worker (gunicorn) starts its own. Hash processes
+        # come from a fork server rather than being forked from this process, which by
+        # now runs the outbox, view-counter and notification threads
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload([__name__])
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._pool
+
+    def _run(self, func, *args, stat):
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['busy'] += 1
+            metrics_registry.inc(password_hashes, ('busy',))
+            raise PasswordHasherBusy('Too many password hashes queued')
+        with self._lock:
+            self._stats['in_flight'] += 1
+
+        def done(_future=None):
+            with self._lock:
+                self._stats['in_flight'] -= 1
+            slots.release()
+
+        if not self.workers:
+            try:
+                result = func(*args)
+            finally:
+                done()
+        else:
+            try:
+                future = self._executor().submit(func, *args)
+            except BrokenProcessPool:
+                # A hash process died; start a fresh pool for the next request
+                with self._lock:
+                    self._pool = None
+                done()
+                raise PasswordHasherBusy('Password hashing pool restarted')
+            except Exception:
+                done()
+                raise
+            # The slot is given back when the job ends, not when we stop waiting for it,
+            # so jobs abandoned after a timeout still count against the queue limit
+            future.add_done_callback(done)
+            try:
+                result = future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                future.cancel()
+                with self._lock:
+                    self._stats['timeouts'] += 1
+                metrics_registry.inc(password_hashes, ('timeout',))
+                raise PasswordHasherBusy('Password hash did not finish in time')
+        with self._lock:
+            self._stats[stat] += 1
+        metrics_registry.inc(password_hashes, ('ok',))
+        return result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(workers=self.workers, max_queue=self.max_queue, iterations=self.iterations)
+        return stats
+
+
+class TokenBucket:
+    """Per-key token buckets: ``burst`` attempts at once, refilled at ``rate`` per minute (burst 0 = no limit)."""
+
+    def __init__(self, name, rate, burst, max_keys=100000):
+        self.name = name
+        self.rate = rate / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key):
+        """Spend a token for ``key``. Returns 0 on success, else seconds until one is available."""
+        if not self.burst:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / self.rate if self.rate else 60
+            # Least recently used keys go first; a dropped bucket was most likely full again anyway
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        if wait:
+            metrics_registry.inc(login_throttled, (self.name,))
+        return wait
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+password_hasher = PasswordHasher()
+login_ip_bucket = TokenBucket('ip', rate=10, burst=20)
+login_account_bucket = TokenBucket('account', rate=2, burst=5)
+
+
+def throttle_login(ip, email):
+    """Spend a login attempt for ``ip`` and ``email``; seconds to wait if refused, else 0."""
+    wait = login_ip_bucket.take(ip)
+    if not wait:
+        wait = login_account_bucket.take((email or '').strip().lower())
+    return wait
+
+
+def init_passwords(app):
+    """Apply the PASSWORD_* and LOGIN_* settings."""
+    password_hasher.configure(
+        workers=app.config.get('PASSWORD_WORKERS'),
+        max_queue=app.config.get('PASSWORD_MAX_QUEUE'),
+        timeout=app.config.get('PASSWORD_TIMEOUT'),
+        iterations=app.config.get('PASSWORD_ITERATIONS'),
+    )
+    for bucket, prefix in ((login_ip_bucket, 'LOGIN_IP'), (login_account_bucket, 'LOGIN_ACCOUNT')):
+        if app.config.get(f'{prefix}_RATE') is not None:
+            bucket.rate = app.config[f'{prefix}_RATE'] / 60.0
+        if app.config.get(f'{prefix}_BURST') is not None:
+            bucket.burst = app.config[f'{prefix}_BURST']
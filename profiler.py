@@ -0,0 +1,188 @@
+"""
+Opt-in sampling profiler for live requests.
+
+A fraction of requests (``PROFILE_SAMPLE_RATE``), plus any request from an
+admin carrying the ``X-Profile`` header, is profiled by a background thread
+that samples the request thread's stack every ``PROFILE_INTERVAL`` seconds.
+Samples are wall-clock, so time blocked on SQLite, Redis or the chat model
+shows up as well as CPU work.
+
+Profiles are stored as JSON under ``PROFILE_DIR/<endpoint>/`` with their
+stacks in collapsed form (``outer;inner;leaf count``), which flamegraph.pl,
+speedscope and similar tools read directly. Only the ``PROFILE_KEEP``
+slowest profiles of each endpoint are kept.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import threading
+from collections import Counter
+from datetime import datetime
+from flask import g, request, session
+
+PROFILE_HEADER = 'X-Profile'
+DEFAULT_INTERVAL = 0.005
+
+
+def _frame_label(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class StackSampler:
+    """Samples one thread's stack from a helper thread until stopped."""
+
+    def __init__(self, thread_id, interval=DEFAULT_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def _run(self):
+        labels = {}
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = _frame_label(code)
+                stack.append(label)
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+
+def _safe_name(endpoint):
+    # No leading dots: '.', '..' or a hidden name must not become the directory or file used
+    name = ''.join(c if c.isalnum() or c in '._-' else '_' for c in endpoint).lstrip('.')
+    return name or '_'
+
+
+def save_profile(profile_dir, profile, keep):
+    """Write a profile and prune its endpoint down to the ``keep`` slowest."""
+    endpoint_dir = os.path.join(profile_dir, _safe_name(profile['endpoint']))
+    os.makedirs(endpoint_dir, exist_ok=True)
+    with open(os.path.join(endpoint_dir, f"{profile['id']}.json"), 'w') as f:
+        json.dump(profile, f)
+
+    profiles = []
+    for entry in os.scandir(endpoint_dir):
+        if entry.name.endswith('.json'):
+            try:
+                with open(entry.path) as f:
+                    profiles.append((json.load(f)['duration'], entry.path))
+            except (OSError, ValueError, KeyError):
+                profiles.append((-1, entry.path))
+    profiles.sort(reverse=True)
+    for _, path in profiles[keep:]:
+        os.remove(path)
+
+
+def list_profiles(profile_dir):
+    """Stored profiles without their stacks, slowest first within each endpoint."""
+    profiles = []
+    if not os.path.isdir(profile_dir):
+        return profiles
+    for endpoint_dir in os.scandir(profile_dir):
+        if not endpoint_dir.is_dir():
+            continue
+        for entry in os.scandir(endpoint_dir.path):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path) as f:
+                    profile = json.load(f)
+            except (OSError, ValueError):
+                continue
+            stacks = profile.pop('stacks', {})
+            # Leaf frames with the most samples: where the time actually went
+            leaves = Counter()
+            for stack, count in stacks.items():
+                leaves[stack.rsplit(';', 1)[-1]] += count
+            profile['hot_frames'] = leaves.most_common(5)
+            profile['recorded_at'] = datetime.fromtimestamp(profile['created_at'])
+            profiles.append(profile)
+    profiles.sort(key=lambda p: (p['endpoint'], -p['duration']))
+    return profiles
+
+
+def load_profile(profile_dir, endpoint, profile_id):
+    """Return a stored profile, or None if there is no such profile."""
+    path = os.path.join(profile_dir, _safe_name(endpoint), f'{_safe_name(profile_id)}.json')
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def collapsed_stacks(profile):
+    """The profile's stacks in the collapsed format flame graph tools read."""
+    return ''.join(f'{stack} {count}\n' for stack, count in
+                   sorted(profile['stacks'].items(), key=lambda item: -item[1]))
+
+
+def init_profiler(app):
+    """Profile sampled requests according to the PROFILE_* settings."""
+
+    def wants_profile():
+        if request.headers.get(PROFILE_HEADER) and session.get('role', '').lower() == 'admin':
+            return True
+        rate = app.config.get('PROFILE_SAMPLE_RATE', 0)
+        return rate > 0 and random.random() < rate
+
+    @app.before_request
+    def start_profiler():
+        if request.endpoint == 'static' or not wants_profile():
+            return
+        interval = app.config.get('PROFILE_INTERVAL', DEFAULT_INTERVAL)
+        g.profiler = StackSampler(threading.get_ident(), interval).start()
+        g.profile_started = time.perf_counter()
+
+    @app.after_request
+    def remember_profile_status(response):
+        if 'profiler' in g:
+            g.profile_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def save_request_profile(exc):
+        sampler = g.pop('profiler', None)
+        if sampler is None:
+            return
+        duration = time.perf_counter() - g.pop('profile_started')
+        sampler.stop()
+        profile = {
+            'id': f'{int(time.time())}-{uuid.uuid4().hex[:8]}',
+            'endpoint': request.endpoint or 'unmatched',
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': g.get('profile_status', 500),
+            'duration': duration,
+            'created_at': time.time(),
+            'interval': sampler.interval,
+            'samples': sampler.samples,
+            'stacks': dict(sampler.stacks),
+        }
+        try:
+            save_profile(app.config['PROFILE_DIR'], profile, app.config.get('PROFILE_KEEP', 10))
+        except OSError as e:
+            app.logger.error(f"Error saving profile: {str(e)}")
@@ -0,0 +1,349 @@
+"""
+Server-side sessions.
+
+The session cookie holds only an opaque random id. The session data (user
+id, email, name, role) lives in the ``Sessions`` table, or in Redis when
+``SESSION_REDIS_URL`` is set, keyed by a SHA-256 of the id so the stored keys
+can't be replayed as cookies. Loaded sessions are kept in an in-process LRU
+for ``SESSION_CACHE_SECONDS``, so most requests neither verify a signature
+nor read storage.
+
+Expiry slides: each request pushes it ``SESSION_LIFETIME`` seconds ahead,
+but the stored expiry is only rewritten once it has moved by
+``SESSION_REFRESH_SECONDS``, so steady traffic doesn't write on every
+request. ``revoke_sessions`` ends all sessions of a user, or everyone's;
+other workers notice once their cached copy is ``SESSION_CACHE_SECONDS``
+old, or sooner if they try to write it: existing sessions are only ever
+updated, never re-inserted, so a revoked one can't be written back. The id is replaced whenever the logged-in user changes, so an id
+handed out before login is useless afterwards.
+
+``SESSION_BACKEND = 'cookie'`` keeps Flask's signed cookie sessions.
+"""
+
+import json
+import time
+import secrets
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from db_utils import get_db_connection
+from timestamps import utc_now
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+def _key(sid):
+    return hashlib.sha256(sid.encode('utf-8')).hexdigest()
+
+
+def _ttl(expires_at):
+    return max(int((expires_at - utc_now()).total_seconds()), 1)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, stored_expires_at=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = sid is None
+        self.modified = False
+        self.stored_expires_at = stored_expires_at
+        self.loaded_user_id = self.get('user_id')
+
+
+class SQLiteSessionStore:
+    """Sessions in the ``Sessions`` table created by ``init_db``."""
+
+    def load(self, key):
+        conn = get_db_connection()
+        try:
+            row = conn.execute('SELECT data, expires_at FROM Sessions WHERE id = ? AND expires_at > ?',
+                               (key, utc_now())).fetchone()
+        finally:
+            conn.close()
+        return (json.loads(row['data']), row['expires_at']) if row else None
+
+    def create(self, key, data, expires_at):
+        conn = get_db_connection()
+        try:
+            with conn:
+                conn.execute('INSERT INTO Sessions (id, user_id, data, expires_at) VALUES (?, ?, ?, ?)',
+                             (key, data.get('user_id'), json.dumps(data), expires_at))
+        finally:
+            conn.close()
+
+    def update(self, key, data, expires_at):
+        """Rewrite a live session; False if it has ended (revoked, logged out or expired)."""
+        conn = get_db_connection()
+        try:
+            with conn:
+                return conn.execute('UPDATE Sessions SET data = ?, expires_at = ? WHERE id = ? AND expires_at > ?',
+                                    (json.dumps(data), expires_at, key, utc_now())).rowcount > 0
+        finally:
+            conn.close()
+
+    def touch(self, key, expires_at):
+        conn = get_db_connection()
+        try:
+            with conn:
+                return conn.execute('UPDATE Sessions SET expires_at = ? WHERE id = ? AND expires_at > ?',
+                                    (expires_at, key, utc_now())).rowcount > 0
+        finally:
+            conn.close()
+
+    def delete(self, key):
+        conn = get_db_connection()
+        try:
+            with conn:
+                conn.execute('DELETE FROM Sessions WHERE id = ?', (key,))
+        finally:
+            conn.close()
+
+    def revoke(self, user_id=None):
+        conn = get_db_connection()
+        try:
+            with conn:
+                if user_id is None:
+                    return conn.execute('DELETE FROM Sessions').rowcount
+                return conn.execute('DELETE FROM Sessions WHERE user_id = ?', (user_id,)).rowcount
+        finally:
+            conn.close()
+
+    def purge_expired(self):
+        conn = get_db_connection()
+        try:
+            with conn:
+                return conn.execute('DELETE FROM Sessions WHERE expires_at <= ?', (utc_now(),)).rowcount
+        finally:
+            conn.close()
+
+
+class RedisSessionStore:
+    """Sessions as ``session:<key>`` values that Redis expires, indexed per user for revocation."""
+
+    def __init__(self, client):
+        self.redis = client
+
+    def load(self, key):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.get(f'session:{key}')
+        pipe.ttl(f'session:{key}')
+        raw, ttl = pipe.execute()
+        if raw is None or ttl is None or ttl < 0:
+            return None
+        return json.loads(raw), utc_now() + timedelta(seconds=ttl)
+
+    def create(self, key, data, expires_at):
+        pipe = self.redis.pipeline()
+        pipe.set(f'session:{key}', json.dumps(data), ex=_ttl(expires_at), nx=True)
+        if data.get('user_id') is not None:
+            pipe.sadd(f'session-user:{data["user_id"]}', key)
+        pipe.execute()
+
+    def update(self, key, data, expires_at):
+        # XX: only while the key still exists, so a revoked session stays gone
+        return bool(self.redis.set(f'session:{key}', json.dumps(data), ex=_ttl(expires_at), xx=True))
+
+    def touch(self, key, expires_at):
+        return bool(self.redis.expire(f'session:{key}', _ttl(expires_at)))
+
+    def delete(self, key):
+        self.redis.delete(f'session:{key}')
+
+    def revoke(self, user_id=None):
+        if user_id is None:
+            keys = list(self.redis.scan_iter(match='session:*', count=1000))
+            keys += list(self.redis.scan_iter(match='session-user:*', count=1000))
+        else:
+            keys = [f'session:{key.decode() if isinstance(key, bytes) else key}'
+                    for key in self.redis.smembers(f'session-user:{user_id}')]
+            keys.append(f'session-user:{user_id}')
+        return self.redis.delete(*keys) if keys else 0
+
+    def purge_expired(self):
+        # Redis expires the sessions themselves
+        return 0
+
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, store, lifetime=7 * 24 * 3600, refresh=3600, cache_seconds=10, cache_size=10000):
+        self.store = store
+        self.lifetime = timedelta(seconds=lifetime)
+        self.refresh = timedelta(seconds=refresh)
+        self.cache_seconds = cache_seconds
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._stats = {'cache_hits': 0, 'loads': 0, 'writes': 0, 'touches': 0, 'revoked': 0, 'purged': 0}
+        self._last_purge = time.monotonic()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _load(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                data, expires_at, cached_at = entry
+                if now - cached_at < self.cache_seconds and expires_at > utc_now():
+                    self._cache.move_to_end(key)
+                    self._stats['cache_hits'] += 1
+                    return dict(data), expires_at
+                del self._cache[key]
+        self._count('loads')
+        record = self.store.load(key)
+        if record is not None:
+            self._remember(key, *record)
+        return record
+
+    def _remember(self, key, data, expires_at):
+        if not self.cache_seconds:
+            return
+        with self._lock:
+            self._cache[key] = (dict(data), expires_at, time.monotonic())
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _forget(self, key=None, user_id=None):
+        with self._lock:
+            if key is not None:
+                self._cache.pop(key, None)
+            elif user_id is None:
+                self._cache.clear()
+            else:
+                for cached_key in [k for k, entry in self._cache.items() if entry[0].get('user_id') == user_id]:
+                    del self._cache[cached_key]
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            record = self._load(_key(sid))
+            if record is not None:
+                data, expires_at = record
+                return ServerSession(data, sid=sid, stored_expires_at=expires_at)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.sid is not None:
+                key = _key(session.sid)
+                self.store.delete(key)
+                self._forget(key)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        response.vary.add('Cookie')
+        data = dict(session)
+        expires_at = utc_now() + self.lifetime
+        if session.sid is None or session.get('user_id') != session.loaded_user_id:
+            # New session, or a different user logged in: never reuse the old id
+            if session.sid is not None:
+                old_key = _key(session.sid)
+                self.store.delete(old_key)
+                self._forget(old_key)
+            session.sid = secrets.token_urlsafe(32)
+            key = _key(session.sid)
+            self.store.create(key, data, expires_at)
+        else:
+            # Existing sessions are only ever updated: one revoked meanwhile (possibly
+            # still cached in this worker) is ended here rather than written back
+            key = _key(session.sid)
+            if not session.modified:
+                if expires_at - session.stored_expires_at < self.refresh:
+                    return
+                alive = self.store.touch(key, expires_at)
+                self._count('touches')
+            else:
+                alive = self.store.update(key, data, expires_at)
+            if not alive:
+                self._forget(key)
+                session.clear()
+                response.delete_cookie(name, domain=domain, path=path)
+                return
+            if not session.modified:
+                self._remember(key, data, expires_at)
+                return
+
+        self._remember(key, data, expires_at)
+        self._count('writes')
+        self._purge_expired()
+        response.set_cookie(
+            name, session.sid, expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+    def _purge_expired(self):
+        # Abandoned sessions are dropped hourly, piggybacking on a write
+        with self._lock:
+            if time.monotonic() - self._last_purge < 3600:
+                return
+            self._last_purge = time.monotonic()
+        try:
+            purged = self.store.purge_expired()
+        except Exception as e:
+            print(f"Warning: expired sessions not purged: {str(e)}")
+            return
+        with self._lock:
+            self._stats['purged'] += purged
+
+    def revoke(self, user_id=None):
+        """End every session of ``user_id``, or every session if None. Returns how many were stored."""
+        count = self.store.revoke(user_id)
+        self._forget(user_id=user_id)
+        with self._lock:
+            self._stats['revoked'] += count
+        return count
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cached'] = len(self._cache)
+        return stats
+
+
+def revoke_sessions(app, user_id=None):
+    """Log out ``user_id`` everywhere (or everyone). Returns the number of sessions ended."""
+    interface = app.session_interface
+    if not isinstance(interface, ServerSessionInterface):
+        raise RuntimeError('Sessions can only be revoked with a server-side SESSION_BACKEND')
+    return interface.revoke(user_id)
+
+
+def init_sessions(app):
+    """Install the SESSION_BACKEND session interface ('sqlite', 'redis' or 'cookie')."""
+    backend = app.config.get('SESSION_BACKEND', 'sqlite')
+    if backend == 'cookie':
+        return
+    store = SQLiteSessionStore()
+    if backend == 'redis':
+        if redis is None:
+            print("Warning: SESSION_BACKEND is redis but the redis package is not installed; using SQLite.")
+        else:
+            try:
+                client = redis.Redis.from_url(app.config['SESSION_REDIS_URL'], socket_timeout=1,
+                                              socket_connect_timeout=1)
+                client.ping()
+                store = RedisSessionStore(client)
+            except Exception as e:
+                print(f"Warning: Failed to connect to the session Redis: {e}. Using SQLite.")
+    app.session_interface = ServerSessionInterface(
+        store,
+        lifetime=app.config.get('SESSION_LIFETIME', 7 * 24 * 3600),
+        refresh=app.config.get('SESSION_REFRESH_SECONDS', 3600),
+        cache_seconds=app.config.get('SESSION_CACHE_SECONDS', 10),
+        cache_size=app.config.get('SESSION_CACHE_SIZE', 10000),
+    )
@@ -0,0 +1,87 @@
+// Resumable chunked uploads for large attachments.
+//
+// Forms marked with data-chunked-upload send files larger than the
+// threshold through /api/uploads in fixed-size chunks, then submit the
+// form with the resulting upload_id instead of the file itself.
+
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+const CHUNK_RETRIES = 3;
+
+async function uploadStatus(uploadId) {
+  const response = await fetch(`/api/uploads/${uploadId}`, { credentials: 'same-origin' });
+  if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+  return response.json();
+}
+
+async function uploadInChunks(file, onProgress) {
+  const response = await fetch('/api/uploads', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    credentials: 'same-origin',
+    body: JSON.stringify({ filename: file.name, size: file.size })
+  });
+  const upload = await response.json();
+  if (!response.ok) throw new Error(upload.error || `HTTP error! status: ${response.status}`);
+
+  let offset = upload.offset;
+  let retries = 0;
+  while (offset < file.size) {
+    const end = Math.min(offset + upload.chunk_size, file.size);
+    try {
+      const chunkResponse = await fetch(`/api/uploads/${upload.upload_id}`, {
+        method: 'PUT',
+        headers: { 'Content-Range': `bytes ${offset}-${end - 1}/${file.size}` },
+        credentials: 'same-origin',
+        body: file.slice(offset, end)
+      });
+      const status = await chunkResponse.json();
+      if (!chunkResponse.ok && chunkResponse.status !== 409) {
+        throw new Error(status.error || `HTTP error! status: ${chunkResponse.status}`);
+      }
+      // On 409 the server tells us where to resume from
+      offset = status.offset !== undefined ? status.offset : (await uploadStatus(upload.upload_id)).offset;
+      retries = 0;
+    } catch (error) {
+      if (++retries > CHUNK_RETRIES) throw error;
+      offset = (await uploadStatus(upload.upload_id)).offset;
+    }
+    if (onProgress) onProgress(offset / file.size);
+  }
+  return upload.upload_id;
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+  document.querySelectorAll('form[data-chunked-upload]').forEach(function(form) {
+    form.addEventListener('submit', async function(event) {
+      const fileInput = form.querySelector('input[type="file"][name="file"]');
+      const file = fileInput && fileInput.files[0];
+      if (!file || file.size < CHUNKED_UPLOAD_THRESHOLD) return;
+
+      event.preventDefault();
+      const submitBtn = form.querySelector('[type="submit"]');
+      const originalText = submitBtn ? submitBtn.innerHTML : '';
+      if (submitBtn) submitBtn.disabled = true;
+
+      try {
+        const uploadId = await uploadInChunks(file, function(progress) {
+          if (submitBtn) submitBtn.textContent = `Uploading... ${Math.round(progress * 100)}%`;
+        });
+        const hidden = document.createElement('input');
+        hidden.type = 'hidden';
+        hidden.name = 'upload_id';
+        hidden.value = uploadId;
+        form.appendChild(hidden);
+        // The file is already on the server, don't send it again
+        fileInput.removeAttribute('name');
+        form.submit();
+      } catch (error) {
+        console.error('Chunked upload failed:', error);
+        alert('Upload failed: ' + (error.message || 'Please try again.'));
+        if (submitBtn) {
+          submitBtn.disabled = false;
+          submitBtn.innerHTML = originalText;
+        }
+      }
+    });
+  });
+});
@@ -38,11 +38,11 @@ async function showDocumentPreview(docId) {
       const date = new Date(doc.created_at);
       previewDate.textContent = date.toLocaleDateString();
     }
-    if (previewDescription) previewDescription.textContent = doc.description || '';
+    if (previewDescription) previewDescription.textContent = doc.description || doc.excerpt || '';
     
     // Set download link
-    if (downloadBtn && doc.file_path) {
-      downloadBtn.href = `/uploads/${encodeURIComponent(doc.file_path)}`;
+    if (downloadBtn && doc.file_url) {
+      downloadBtn.href = doc.file_url;
       downloadBtn.download = doc.file_path.split('/').pop();
     }
     
@@ -50,11 +50,11 @@ async function showDocumentPreview(docId) {
     if (doc.file_path) {
       const fileType = doc.file_type || doc.file_path.split('.').pop().toLowerCase();
       
-      if (['jpg', 'jpeg', 'png', 'gif'].includes(fileType)) {
+      if (fileType === 'image' || ['jpg', 'jpeg', 'png', 'gif'].includes(fileType)) {
         // Image preview
         filePreview.innerHTML = `
           <div class="text-center">
-            <img src="/uploads/${encodeURIComponent(doc.file_path)}" 
+            <img src="${doc.view_url}" 
                  alt="${doc.title}" 
                  class="img-fluid rounded">
           </div>`;
@@ -63,20 +63,22 @@ async function showDocumentPreview(docId) {
         // PDF preview using iframe
         filePreview.innerHTML = `
           <div class="ratio ratio-16x9">
-            <iframe src="/uploads/${encodeURIComponent(doc.file_path)}" 
+            <iframe src="${doc.view_url}" 
                     style="width: 100%; height: 100%; border: 1px solid #dee2e6; border-radius: 0.25rem;">
             </iframe>
           </div>`;
+        showPagePlaceholder(filePreview, doc);
       }
       else if (['html', 'htm'].includes(fileType)) {
         // HTML preview using iframe
         filePreview.innerHTML = `
           <div class="ratio ratio-16x9">
-            <iframe src="/document/html/${encodeURIComponent(doc.file_path)}" 
+            <iframe src="${doc.view_url}" 
                     sandbox="allow-same-origin allow-scripts"
                     style="width: 100%; height: 100%; border: 1px solid #dee2e6; border-radius: 0.25rem;">
             </iframe>
           </div>`;
+        showPagePlaceholder(filePreview, doc);
       }
       else {
         // Unsupported file type
@@ -0,0 +1,73 @@
+// Live notification badge: one EventSource per page instead of polling
+(function() {
+    'use strict';
+
+    if (!window.EventSource) return;
+
+    const badge = document.getElementById('notificationsBadge');
+    const menu = document.getElementById('notificationsMenu');
+    const toggle = document.getElementById('notificationsToggle');
+    if (!badge || !menu || !toggle) return;
+
+    function setUnread(count) {
+        badge.textContent = count > 99 ? '99+' : count;
+        badge.style.display = count > 0 ? '' : 'none';
+    }
+
+    function renderItem(notification) {
+        const li = document.createElement('li');
+        li.dataset.id = notification.id;
+        const link = document.createElement('a');
+        link.className = 'dropdown-item small' + (notification.is_read ? ' text-muted' : ' fw-semibold');
+        link.href = notification.link || '#';
+        link.textContent = notification.message;
+        const time = document.createElement('div');
+        time.className = 'text-muted small';
+        time.textContent = notification.created_at;
+        link.appendChild(time);
+        li.appendChild(link);
+        return li;
+    }
+
+    function renderMenu(notifications) {
+        menu.innerHTML = '';
+        if (!notifications.length) {
+            menu.innerHTML = '<li><span class="dropdown-item-text text-muted small">No notifications yet</span></li>';
+            return;
+        }
+        notifications.forEach(n => menu.appendChild(renderItem(n)));
+    }
+
+    // Opening the menu loads the latest notifications and marks them read
+    toggle.addEventListener('show.bs.dropdown', async function() {
+        try {
+            const response = await fetch('/api/notifications', { credentials: 'same-origin' });
+            if (!response.ok) return;
+            const data = await response.json();
+            renderMenu(data.notifications);
+            if (data.unread > 0) {
+                await fetch('/api/notifications/read', { method: 'POST', credentials: 'same-origin' });
+                setUnread(0);
+            }
+        } catch (error) {
+            console.error('Error loading notifications:', error);
+        }
+    });
+
+    // The browser reconnects by itself and sends Last-Event-ID
+    const source = new EventSource('/api/notifications/stream');
+    source.addEventListener('count', function(e) {
+        setUnread(JSON.parse(e.data).unread);
+    });
+    source.addEventListener('notification', function(e) {
+        const notification = JSON.parse(e.data);
+        if (notification.unread !== undefined) setUnread(notification.unread);
+        const empty = menu.querySelector('.dropdown-item-text');
+        if (empty) empty.parentElement.remove();
+        // Grouped notifications come again with the same id and a new count
+        const existing = menu.querySelector(`li[data-id="${notification.id}"]`);
+        if (existing) existing.remove();
+        menu.insertBefore(renderItem(notification), menu.firstChild);
+    });
+    window.addEventListener('beforeunload', () => source.close());
+})();
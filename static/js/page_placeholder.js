@@ -0,0 +1,19 @@
+// Show the low-res first page image until the full document has loaded
+function showPagePlaceholder(container, doc) {
+  const frame = container.firstElementChild;
+  const iframe = container.querySelector('iframe');
+  if (!doc.page_image_url || !frame || !iframe) return;
+  const img = document.createElement('img');
+  img.src = doc.page_image_url;
+  img.alt = doc.title;
+  img.className = 'img-fluid d-block mx-auto border rounded';
+  img.style.maxHeight = '600px';
+  const reveal = () => {
+    img.remove();
+    frame.style.display = '';
+  };
+  frame.style.display = 'none';
+  container.prepend(img);
+  iframe.addEventListener('load', reveal);
+  img.onerror = reveal;
+}
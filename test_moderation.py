@@ -0,0 +1,53 @@
+"""
+Keyset pagination of the moderation queues.
+
+Walking the pages by cursor returns every row once, newest first. A row whose
+``created_at`` is NULL or not a timestamp must not break the cursor: NULLs
+come after every dated row, and text sorts the way SQLite stores it.
+"""
+
+import sqlite3
+
+import pytest
+
+import timestamps  # registers the TIMESTAMP converter
+from moderation import decode_cursor, documents_page, encode_cursor
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES)
+    conn.row_factory = sqlite3.Row
+    conn.execute('CREATE TABLE Users (id INTEGER PRIMARY KEY, email TEXT, name TEXT)')
+    conn.execute('''CREATE TABLE Documents (id INTEGER PRIMARY KEY, user_id INTEGER, title TEXT,
+                        description TEXT, status TEXT, created_at TIMESTAMP, file_path TEXT)''')
+    conn.execute('CREATE INDEX idx_documents_status_created ON Documents(status, created_at)')
+    conn.execute("INSERT INTO Users (id, email, name) VALUES (1, 'student@university.edu', 'Student')")
+    conn.executemany(
+        "INSERT INTO Documents (id, user_id, title, status, created_at) VALUES (?, 1, 'Notes', 'Pending', ?)",
+        [(1, '2025-01-01 10:00:00'), (2, None), (3, '2025-03-01 10:00:00'), (4, 'yesterday'),
+         (5, None), (6, '2025-02-01 10:00:00'), (7, None)])
+    yield conn
+    conn.close()
+
+
+def _walk(conn, limit, status=None):
+    ids, cursor = [], None
+    while True:
+        items, cursor = documents_page(conn, status, cursor, limit)
+        ids.extend(item['id'] for item in items)
+        if not cursor:
+            return ids
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 10])
+def test_pages_return_every_row_once_with_nulls_last(conn, limit):
+    assert _walk(conn, limit) == [4, 3, 6, 1, 7, 5, 2]
+    assert _walk(conn, limit, status='Pending') == [4, 3, 6, 1, 7, 5, 2]
+
+
+def test_cursors_for_undated_rows_round_trip():
+    assert decode_cursor(encode_cursor({'created_at': None, 'id': 5})) == (None, 5)
+    assert decode_cursor(encode_cursor({'created_at': 'yesterday', 'id': 4})) == ('yesterday', 4)
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor({'created_at': 12, 'id': 4}))
@@ -0,0 +1,150 @@
+"""
+Batched, grouped notifications.
+
+Events in one group collapse while unread: in the outbox before a flush, and
+onto the unread row in the table after one. Every write of a row gives it a
+new, higher version, which streams send as the SSE event id, so replaying
+from a Last-Event-ID returns exactly the rows created or updated since.
+"""
+
+import sqlite3
+
+import pytest
+
+import notification_outbox as outbox_module
+import timestamps  # registers the TIMESTAMP converter
+from notification_outbox import NotificationOutbox
+from notifications import notification_broker
+
+STUDENT, PROFESSOR = 3, 2
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / 'notifications.db')
+
+    def connect():
+        conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    conn = connect()
+    conn.execute('''CREATE TABLE Notifications (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        message TEXT NOT NULL,
+                        link TEXT,
+                        is_read BOOLEAN DEFAULT 0,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        group_key TEXT,
+                        event_count INTEGER NOT NULL DEFAULT 1,
+                        version INTEGER)''')
+    conn.execute('CREATE INDEX idx_notifications_user_version ON Notifications(user_id, version)')
+    conn.execute('CREATE UNIQUE INDEX idx_notifications_unread_group '
+                 'ON Notifications(user_id, group_key) WHERE is_read = 0 AND group_key IS NOT NULL')
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(outbox_module, 'get_db_connection', connect)
+    return connect
+
+
+def _rows(db, user_id=STUDENT):
+    conn = db()
+    try:
+        return [dict(row) for row in conn.execute(
+            'SELECT id, message, event_count, is_read, version FROM Notifications WHERE user_id = ? ORDER BY id',
+            (user_id,))]
+    finally:
+        conn.close()
+
+
+def _answer(outbox):
+    outbox.add(STUDENT, 'answer', link='/questions/1', group=1, actor='Professor', title='Ohm')
+
+
+def test_queued_events_in_a_group_collapse_before_writing(db):
+    outbox = NotificationOutbox(flush_interval=3600)
+    for _ in range(3):
+        _answer(outbox)
+    outbox.add(STUDENT, 'answer', link='/questions/2', group=2, actor='Professor', title='Volts')
+
+    assert outbox.flush() == 2
+    assert outbox.stats()['collapsed'] == 2
+    assert [(row['message'], row['event_count']) for row in _rows(db)] == [
+        ('3 new answers to your question "Ohm"', 3),
+        ('Professor answered your question "Volts"', 1),
+    ]
+
+
+def test_new_events_update_the_unread_row_with_a_higher_version(db):
+    outbox = NotificationOutbox(flush_interval=3600)
+    subscription = notification_broker.subscribe(STUDENT)
+    try:
+        _answer(outbox)
+        outbox.flush()
+        outbox.add(STUDENT, 'verified', link='/document/1', title='Notes')
+        outbox.flush()
+        first = _rows(db)[0]
+        before = first['version']
+
+        _answer(outbox)
+        outbox.flush()
+        grouped, verified = _rows(db)
+        assert grouped['id'] == first['id']
+        assert grouped['event_count'] == 2
+        assert grouped['message'] == '2 new answers to your question "Ohm"'
+        # The updated row sorts after everything the browser has already seen
+        assert grouped['version'] > verified['version'] > before
+
+        pushed = [subscription.get(timeout=1)['data'] for _ in range(3)]
+        assert [event['version'] for event in pushed] == [before, verified['version'], grouped['version']]
+        assert pushed[-1]['id'] == first['id'] and pushed[-1]['count'] == 2
+    finally:
+        subscription.close()
+
+    # Replaying from what the browser last saw returns the update, not older rows
+    conn = db()
+    replay = [row['id'] for row in conn.execute(
+        'SELECT id FROM Notifications WHERE user_id = ? AND version > ? ORDER BY version',
+        (STUDENT, verified['version']))]
+    conn.close()
+    assert replay == [first['id']]
+
+
+def test_read_rows_are_not_updated(db):
+    outbox = NotificationOutbox(flush_interval=3600)
+    _answer(outbox)
+    outbox.flush()
+    conn = db()
+    conn.execute('UPDATE Notifications SET is_read = 1')
+    conn.commit()
+    conn.close()
+
+    _answer(outbox)
+    outbox.flush()
+    read, unread = _rows(db)
+    assert (read['is_read'], read['event_count']) == (1, 1)
+    assert (unread['is_read'], unread['event_count']) == (0, 1)
+    assert unread['version'] > read['version']
+
+
+def test_digests_fold_old_unread_notifications(db):
+    outbox = NotificationOutbox(flush_interval=3600, digest_after=60)
+    _answer(outbox)
+    _answer(outbox)
+    outbox.add(STUDENT, 'verified', link='/document/1', title='Notes')
+    outbox.add(PROFESSOR, 'verification_request', link='/document/1', actor='Student', title='Notes')
+    outbox.flush()
+    conn = db()
+    conn.execute("UPDATE Notifications SET created_at = datetime('now', '-1 hour')")
+    conn.commit()
+    conn.close()
+
+    # The professor has a single unread notification, which needs no digest
+    assert outbox.make_digests() == 1
+    rows = _rows(db)
+    assert [row['is_read'] for row in rows[:2]] == [1, 1]
+    digest = rows[2]
+    assert (digest['message'], digest['event_count'], digest['is_read']) == ('3 notifications you have not read', 3, 0)
+    assert digest['version'] > max(row['version'] for row in rows[:2])
+    assert [row['is_read'] for row in _rows(db, PROFESSOR)] == [0]
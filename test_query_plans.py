@@ -0,0 +1,249 @@
+"""
+Query-plan regression tests.
+
+Drives the app's pages against a scratch database, records every SQL
+statement they run and checks its EXPLAIN QUERY PLAN. A query that falls back
+to a full table scan (a missing index, or a rewrite that stops using one)
+fails here instead of slowing down production.
+"""
+
+import os
+import re
+import sys
+
+import pytest
+
+# conftest.py points DATABASE_PATH at a scratch directory before anything imports db_utils
+from conftest import TEST_DIR
+import db_utils
+
+# Importing the app runs init_db, so check the database before doing that
+assert os.path.dirname(db_utils.DATABASE) == TEST_DIR, f'not a scratch database: {db_utils.DATABASE}'
+
+import app as app_module  # noqa: E402
+
+# Full scans that are expected, keyed by a fragment of the statement
+ALLOWED_SCANS = {
+    # Substring search can't use a b-tree index
+    "LIKE '%": 'substring search',
+    # Maintenance jobs that deliberately visit every row
+    'INSERT INTO UserStats (user_id, documents': 'rebuild-user-stats',
+}
+
+_BARE_SCAN = re.compile(r'^SCAN (\w+)$')
+# Common table expressions are small intermediate results, not tables
+_CTE_NAME = re.compile(r'(?:\bWITH|,)\s+(\w+)\s+AS\s*\(', re.IGNORECASE)
+_EXPLAINED = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+
+# Hot lookups and the index that must serve each of them, filter and order alike
+HOT_QUERIES = [
+    ("SELECT id FROM Documents WHERE status = 'Verified' ORDER BY created_at DESC",
+     'idx_documents_status_created'),
+    ('SELECT id FROM Documents WHERE user_id = 1 ORDER BY created_at DESC LIMIT 10',
+     'idx_documents_user_created'),
+    ('SELECT id FROM Questions WHERE user_id = 1 ORDER BY created_at DESC LIMIT 10',
+     'idx_questions_user_created'),
+    ("SELECT id FROM Stars WHERE user_id = 1 AND item_type = 'document' AND item_id = 1",
+     'sqlite_autoindex_Stars_1'),
+    ("SELECT COUNT(*) FROM Stars WHERE item_type = 'document' AND item_id = 1",
+     'idx_stars_item'),
+    ("SELECT item_id, count FROM ItemCounters WHERE item_type = 'answer' "
+     "AND item_id IN (SELECT value FROM json_each('[1, 2]')) AND counter = 'stars'",
+     'sqlite_autoindex_ItemCounters_1'),
+    ('SELECT id FROM Notifications WHERE user_id = 1 AND is_read = 0 ORDER BY created_at DESC',
+     'idx_notifications_user_unread'),
+    ('SELECT id FROM Notifications WHERE user_id = 1 AND version > 3 ORDER BY version LIMIT 50',
+     'idx_notifications_user_version'),
+    ('SELECT id FROM Answers WHERE question_id = 1 ORDER BY is_accepted DESC, created_at ASC',
+     'idx_answers_question_accepted'),
+    ('SELECT id FROM Bookmarks WHERE user_id = 1 ORDER BY created_at DESC, id DESC LIMIT 20',
+     'idx_bookmarks_user_created'),
+    ('SELECT user_id FROM UserStats WHERE stars_received > 0 ORDER BY stars_received DESC LIMIT 10',
+     'idx_user_stats_stars_received'),
+    ('DELETE FROM Blobs WHERE ref_count <= 0 RETURNING path',
+     'idx_blobs_unreferenced'),
+    ('DELETE FROM Sessions WHERE user_id = 1',
+     'idx_sessions_user'),
+]
+
+# Ids of the PDF documents added by _seed, after the app's sample documents
+PDF_DOCUMENT = 101
+
+STATEMENTS = []
+_connect = db_utils.get_db_connection
+
+
+def _traced_connection():
+    conn = _connect()
+    conn.set_trace_callback(STATEMENTS.append)
+    return conn
+
+
+@pytest.fixture(scope='module')
+def client():
+    with pytest.MonkeyPatch.context() as mp:
+        for module in (db_utils, app_module, sys.modules['view_counter'], sys.modules['notification_outbox'],
+                       sys.modules['session_store']):
+            mp.setattr(module, 'get_db_connection', _traced_connection)
+        app_module.app.config.update(TESTING=True, UPLOAD_FOLDER=os.path.join(TEST_DIR, 'uploads'))
+        os.makedirs(app_module.app.config['UPLOAD_FOLDER'], exist_ok=True)
+        assert os.path.dirname(db_utils.DATABASE) == TEST_DIR
+        _seed()
+        yield app_module.app.test_client()
+
+
+def _seed():
+    conn = _connect()
+    users = {row['email']: row['id'] for row in conn.execute('SELECT id, email FROM Users')}
+    student = users['student@university.edu']
+    professor = users['professor@university.edu']
+    for i in range(3):
+        # Preview metadata and page texts as stored at upload, so their pages load without the PDFs
+        conn.execute(
+            '''INSERT INTO Documents (id, title, description, file_path, user_id, status,
+                                      excerpt, page_count, file_size)
+               VALUES (?, ?, ?, ?, ?, ?, ?, 1, 100)''',
+            (PDF_DOCUMENT + i, f'Notes {i}', 'Lecture notes', f'notes{i}.pdf', professor,
+             ('Verified', 'Pending')[i % 2], 'Lecture notes'))
+        source = os.path.join(app_module.app.config['UPLOAD_FOLDER'], f'notes{i}.pdf')
+        with open(source + '.pages', 'wb') as f:
+            f.write(b'Page one')
+        with open(source + '.pages.idx', 'wb') as f:
+            f.write(b'[0, 8]')
+        conn.execute(
+            'INSERT INTO Questions (title, description, user_id) VALUES (?, ?, ?)',
+            (f'Question {i}', 'How does it work?', student))
+    conn.execute('INSERT INTO Answers (question_id, content, user_id) VALUES (1, ?, ?)',
+                 ('Like this.', professor))
+    conn.execute('INSERT INTO Notifications (user_id, message, link) VALUES (?, ?, ?)',
+                 (student, 'Your question was answered', '/questions/1'))
+    conn.commit()
+    conn.close()
+
+
+def _login(client, email):
+    _visit(client, [('GET', '/logout', 302),
+                    ('POST', '/login', 302, {'data': {'email': email, 'password': '77777777'}})])
+
+
+def _visit(client, requests):
+    """Make each ``(method, url, expected_status[, kwargs])`` request.
+
+    A page that starts failing or redirecting would silently drop its queries
+    from the plan check, so every status is asserted.
+    """
+    for method, url, expected, *options in requests:
+        response = client.open(url, method=method, **(options[0] if options else {}))
+        assert response.status_code == expected, f'{method} {url}: {response.status_code}, expected {expected}'
+
+
+STUDENT_REQUESTS = [
+    ('GET', '/', 302),
+    ('GET', '/welcome', 200),
+    ('GET', '/feed', 200),
+    ('GET', '/feed?sort=most_viewed', 200),
+    ('GET', '/feed?sort=most_stars', 200),
+    ('GET', '/profile/3', 200),
+    ('GET', '/profile/edit', 200),
+    ('GET', '/documents/1', 200),
+    ('GET', '/questions/1', 200),
+    ('GET', '/bookmarks', 200),
+    ('GET', '/api/bookmarks', 200),
+    ('GET', f'/document/preview/{PDF_DOCUMENT}', 200),
+    ('GET', f'/documents/{PDF_DOCUMENT}/pages', 200),
+    ('GET', '/api/leaderboard', 200),
+    ('GET', '/api/leaderboard?by=documents', 200),
+    ('GET', '/api/leaderboard?by=answers', 200),
+    ('GET', '/chat', 200),
+    ('GET', '/api/notifications', 200),
+    ('POST', '/search', 200, {'data': {'query': 'notes'}}),
+    ('POST', '/questions/1', 200, {'data': {'content': 'Thanks!'}}),
+    ('POST', '/api/star/document/1', 200),
+    ('POST', '/api/star/answer/1', 200),
+    ('POST', '/bookmark/Document/1', 200),
+    ('POST', '/bookmark/Question/1', 200),
+    ('GET', '/bookmarks', 200),
+    ('POST', '/api/star/document/1', 200),
+    ('POST', '/api/notifications/read', 200, {'json': {'ids': [1]}}),
+    ('POST', '/api/notifications/read', 200),
+]
+
+PROFESSOR_REQUESTS = [
+    ('GET', f'/document/edit/{PDF_DOCUMENT}', 200),
+    ('POST', '/answer/1/accept', 200),
+    ('GET', '/questions/1', 200),
+]
+
+ADMIN_REQUESTS = [
+    ('GET', '/admin', 200),
+    ('GET', '/admin?tab=questions', 200),
+    ('GET', '/admin?status=Pending', 200),
+    ('GET', '/api/moderation/documents?status=Verified', 200),
+    ('GET', '/api/moderation/questions', 200),
+    ('GET', '/verify/2', 302),
+    ('GET', '/unverify/2', 302),
+    ('GET', '/api/admin/view-counter', 200),
+    ('GET', '/api/admin/sessions', 200),
+    ('POST', '/api/admin/sessions', 200, {'json': {'user_id': 2}}),
+    ('POST', '/api/moderation/documents/status', 200, {'json': {'ids': [1, 2], 'status': 'Verified'}}),
+    ('POST', '/admin/documents/status', 302, {'data': {'doc_ids': ['3'], 'status': 'Pending'}}),
+    ('POST', '/admin/close_question/2', 200),
+    ('POST', '/admin/delete_question/3', 200),
+    ('POST', '/admin/delete_document/3', 200),
+]
+
+
+def _exercise(client):
+    """Visit the app's pages the way users do."""
+    _login(client, 'student@university.edu')
+    _visit(client, STUDENT_REQUESTS)
+
+    _login(client, 'professor@university.edu')
+    _visit(client, PROFESSOR_REQUESTS)
+
+    _login(client, 'admin@university.edu')
+    _visit(client, ADMIN_REQUESTS)
+
+    app_module.view_counter.flush()
+    app_module.notification_outbox.flush()
+    # Context handed to the chat assistant
+    db_utils.get_database_context()
+
+
+def _full_scans(conn, sql):
+    ctes = set(_CTE_NAME.findall(sql))
+    plan = conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+    return [row['detail'] for row in plan
+            if (match := _BARE_SCAN.match(row['detail'])) and match.group(1) not in ctes]
+
+
+def test_production_queries_avoid_full_scans(client):
+    _exercise(client)
+    statements = {sql.strip() for sql in STATEMENTS}
+    statements = sorted(sql for sql in statements if sql.upper().startswith(_EXPLAINED))
+    # Guard against the trace silently capturing nothing
+    assert len(statements) > 50
+
+    conn = _connect()
+    try:
+        regressions = []
+        for sql in statements:
+            if any(fragment in sql for fragment in ALLOWED_SCANS):
+                continue
+            scans = _full_scans(conn, sql)
+            if scans:
+                regressions.append(f"{', '.join(scans)}: {' '.join(sql.split())}")
+    finally:
+        conn.close()
+    assert not regressions, 'Full table scans:\n' + '\n'.join(regressions)
+
+
+@pytest.mark.parametrize('sql, index', HOT_QUERIES)
+def test_hot_queries_use_their_index(sql, index):
+    conn = _connect()
+    try:
+        plan = [row['detail'] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+    finally:
+        conn.close()
+    assert any(f' INDEX {index} ' in detail for detail in plan), plan
+    assert not any(detail.startswith('USE TEMP B-TREE') for detail in plan), plan
@@ -0,0 +1,80 @@
+"""
+Server-side session revocation.
+
+A revoked session may still sit in another worker's cache. Whatever that
+worker does with it next, the session must stay gone.
+"""
+
+import sqlite3
+
+import pytest
+from flask import Flask
+
+import session_store
+from session_store import ServerSessionInterface, SQLiteSessionStore, revoke_sessions
+
+USER = {'user_id': 7, 'email': 'student@university.edu', 'name': 'Student', 'role': 'Student'}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    path = str(tmp_path / 'sessions.db')
+
+    def connect():
+        conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    conn = connect()
+    conn.execute('''CREATE TABLE Sessions (id TEXT PRIMARY KEY, user_id INTEGER, data TEXT NOT NULL,
+                                           expires_at TIMESTAMP NOT NULL)''')
+    conn.close()
+    monkeypatch.setattr(session_store, 'get_db_connection', connect)
+    store = SQLiteSessionStore()
+    store.count = lambda: connect().execute('SELECT COUNT(*) FROM Sessions').fetchone()[0]
+    return store
+
+
+def _save(app, interface, cookie=None, **changes):
+    """Run one request through ``interface``; returns the session and the response."""
+    headers = {'Cookie': f'session={cookie}'} if cookie else {}
+    with app.test_request_context('/', headers=headers) as ctx:
+        session = interface.open_session(app, ctx.request)
+        session.update(changes)
+        response = app.response_class()
+        interface.save_session(app, session, response)
+    return session, response
+
+
+def test_revoked_session_is_not_written_back_by_a_worker_that_cached_it(store):
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    first, second = ServerSessionInterface(store), ServerSessionInterface(store)
+    app.session_interface = first
+
+    session, _ = _save(app, first, **USER)
+    cookie = session.sid
+    # The second worker has the session in its cache
+    assert _save(app, second, cookie)[0]['user_id'] == USER['user_id']
+
+    assert revoke_sessions(app, USER['user_id']) == 1
+    session, response = _save(app, second, cookie, _flashes=[('info', 'Saved')])
+
+    assert store.count() == 0
+    assert dict(session) == {}
+    assert 'session=;' in response.headers['Set-Cookie']
+    assert _save(app, first, cookie)[0].get('user_id') is None
+
+
+def test_revoked_session_is_not_revived_by_an_expiry_refresh(store):
+    app = Flask(__name__)
+    first, second = ServerSessionInterface(store), ServerSessionInterface(store, refresh=0)
+
+    cookie = _save(app, first, **USER)[0].sid
+    _save(app, second, cookie)
+    first.revoke(USER['user_id'])
+
+    session, response = _save(app, second, cookie)
+    assert store.count() == 0
+    assert dict(session) == {}
+    assert 'session=;' in response.headers['Set-Cookie']
@@ -0,0 +1,165 @@
+"""
+Blob store garbage collection.
+
+Blob paths keep the original extension, so the same bytes uploaded as
+``notes`` and ``notes.pdf`` are two blobs, ``<sha256>`` and ``<sha256>.pdf``,
+side by side. Collecting one must leave the other and its derived files.
+
+Of everything in the uploads folder only blobs and pre-blob-store uploads
+are served as files.
+
+Chunks of one resumable upload are appended one at a time: a request that
+races another for the same range is told to resume, not appended twice. The
+upload is hashed as its chunks arrive; a worker that missed some of them reads
+back only those. A user can only have a few uploads in progress at once.
+"""
+
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import upload_storage
+from upload_storage import (BLOB_DIR, UploadError, append_chunk, blob_path, claim_chunked_upload,
+                            collect_garbage, create_chunked_upload, get_chunked_upload,
+                            is_servable_path)
+
+SHA256 = 'ab' * 32
+
+
+def _touch(folder, rel_path):
+    path = os.path.join(folder, *rel_path.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'%PDF-1.4')
+    return path
+
+
+def _blobs_db(*rows):
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    conn.execute('CREATE TABLE Blobs (path TEXT PRIMARY KEY, sha256 TEXT, size INTEGER, ref_count INTEGER)')
+    conn.executemany('INSERT INTO Blobs (path, sha256, size, ref_count) VALUES (?, ?, 8, ?)', rows)
+    return conn
+
+
+def test_collecting_a_blob_keeps_a_live_blob_with_the_same_hash(tmp_path):
+    folder = str(tmp_path)
+    bare, pdf = blob_path(SHA256, 'notes'), blob_path(SHA256, 'notes.pdf')
+    assert bare == f'{BLOB_DIR}/ab/ab/{SHA256}' and pdf == bare + '.pdf'
+    live = [_touch(folder, pdf + suffix) for suffix in ('', '.pages', '.pages.idx', '.thumb.svg', '.thumb.svg.gz')]
+    dead = [_touch(folder, bare + suffix) for suffix in ('', '.gz', '.thumb.png')]
+
+    conn = _blobs_db((bare, SHA256, 0), (pdf, SHA256, 1))
+    assert collect_garbage(conn, folder) == 1
+
+    assert [path for path in dead if os.path.exists(path)] == []
+    assert all(os.path.exists(path) for path in live)
+    assert [row['path'] for row in conn.execute('SELECT path FROM Blobs')] == [pdf]
+
+
+def test_collecting_the_extension_blob_keeps_the_bare_one(tmp_path):
+    folder = str(tmp_path)
+    bare, pdf = blob_path(SHA256, 'notes'), blob_path(SHA256, 'notes.pdf')
+    kept, removed = _touch(folder, bare), _touch(folder, pdf)
+
+    collect_garbage(_blobs_db((bare, SHA256, 1), (pdf, SHA256, 0)), folder)
+
+    assert os.path.exists(kept) and not os.path.exists(removed)
+
+
+def test_only_blobs_and_legacy_uploads_are_servable():
+    blob = blob_path(SHA256, 'notes.pdf')
+    assert is_servable_path(blob)
+    assert is_servable_path(blob_path(SHA256, 'notes'))
+    assert is_servable_path('20251205173420_huhu.pdf')
+
+    assert not is_servable_path('.partial/' + 'ab' * 16 + '.part')
+    assert not is_servable_path('.partial/' + 'ab' * 16 + '.json')
+    assert not is_servable_path('blobs/ab/ab/.upload-x1y2.tmp')
+    assert not is_servable_path('.variant-abc123')
+    assert not is_servable_path(blob + '.thumb.svg')
+    assert not is_servable_path(blob + '.pages.idx')
+    assert not is_servable_path('blobs/../database.db')
+    assert not is_servable_path('somewhere/else.pdf')
+    assert not is_servable_path('')
+
+
+class _SlowBody(io.BytesIO):
+    """Request body that stalls on its first read until ``go`` is set."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.reading, self.go = threading.Event(), threading.Event()
+
+    def read(self, size=-1):
+        self.reading.set()
+        self.go.wait(5)
+        return super().read(size)
+
+
+def test_concurrent_appends_of_the_same_chunk_write_it_once(tmp_path):
+    folder = str(tmp_path)
+    upload_id = create_chunked_upload(folder, 1, 'notes.pdf', 8, 1024)['upload_id']
+    slow = _SlowBody(b'%PDF')
+    results = []
+
+    def send(body):
+        try:
+            results.append(append_chunk(folder, upload_id, 1, body, 'bytes 0-3/8')['offset'])
+        except UploadError as e:
+            results.append(e.status)
+
+    first = threading.Thread(target=send, args=(slow,))
+    first.start()
+    assert slow.reading.wait(5)
+    second = threading.Thread(target=send, args=(io.BytesIO(b'%PDF'),))
+    second.start()
+    # The second request has to wait for the first to finish its write
+    time.sleep(0.2)
+    slow.go.set()
+    first.join(5)
+    second.join(5)
+
+    assert sorted(results) == [4, 409]
+    assert get_chunked_upload(folder, upload_id, 1)['offset'] == 4
+    with pytest.raises(UploadError) as error:
+        append_chunk(folder, upload_id, 1, io.BytesIO(b'-1.4'), 'bytes 0-3/8')
+    assert error.value.status == 409
+
+
+def test_a_claimed_upload_is_hashed_from_its_chunks(tmp_path):
+    folder = str(tmp_path)
+    data = os.urandom(300)
+    upload_id = create_chunked_upload(folder, 1, 'notes.pdf', len(data), 1024)['upload_id']
+    append_chunk(folder, upload_id, 1, io.BytesIO(data[:100]), 'bytes 0-99/300')
+    # A short body leaves neither bytes nor hash state behind
+    with pytest.raises(UploadError):
+        append_chunk(folder, upload_id, 1, io.BytesIO(data[100:150]), 'bytes 100-199/300')
+    append_chunk(folder, upload_id, 1, io.BytesIO(data[100:200]), 'bytes 100-199/300')
+    # The last chunk lands on another worker, which has hashed nothing yet
+    upload_storage._upload_hashes.pop(upload_id)
+    append_chunk(folder, upload_id, 1, io.BytesIO(data[200:]), 'bytes 200-299/300')
+
+    part_path, sha256, size, name = claim_chunked_upload(folder, upload_id, 1)
+    assert (sha256, size, name) == (hashlib.sha256(data).hexdigest(), 300, 'notes.pdf')
+    assert upload_id not in upload_storage._upload_hashes
+
+
+def test_a_user_cannot_start_more_uploads_than_the_limit(tmp_path):
+    folder = str(tmp_path)
+    started = [create_chunked_upload(folder, 1, 'notes.pdf', 8, 1024, max_open=2)['upload_id']
+               for _ in range(2)]
+    with pytest.raises(UploadError) as error:
+        create_chunked_upload(folder, 1, 'notes.pdf', 8, 1024, max_open=2)
+    assert error.value.status == 429
+    assert len(os.listdir(os.path.join(folder, '.partial'))) == 4
+    # Other users are not affected, and finishing an upload frees its place
+    create_chunked_upload(folder, 2, 'notes.pdf', 8, 1024, max_open=2)
+    append_chunk(folder, started[0], 1, io.BytesIO(b'%PDF-1.4'), 'bytes 0-7/8')
+    claim_chunked_upload(folder, started[0], 1)
+    create_chunked_upload(folder, 1, 'notes.pdf', 8, 1024, max_open=2)
@@ -0,0 +1,58 @@
+"""
+Write-behind view counts.
+
+A document page shows the cached row's ``views`` plus the views still pending
+in this worker. Once those are flushed they are no longer pending, so the
+cached row has to be reloaded or the count shown would drop.
+"""
+
+import sqlite3
+
+import pytest
+
+import view_counter as view_counter_module
+from cache import Cache
+from view_counter import ViewCounter
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / 'views.db')
+
+    def connect():
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    conn = connect()
+    conn.execute('CREATE TABLE Documents (id INTEGER PRIMARY KEY, views INTEGER DEFAULT 0)')
+    conn.execute('CREATE TABLE Questions (id INTEGER PRIMARY KEY, views INTEGER DEFAULT 0)')
+    conn.execute('INSERT INTO Documents (id, views) VALUES (7, 10)')
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(view_counter_module, 'get_db_connection', connect)
+    return connect
+
+
+def test_shown_view_count_does_not_drop_after_a_flush(db):
+    counter = ViewCounter(flush_interval=3600)
+    document_cache = Cache('test_view_counter_documents')
+
+    def shown():
+        def load():
+            conn = db()
+            try:
+                return dict(conn.execute('SELECT id, views FROM Documents WHERE id = 7').fetchone())
+            finally:
+                conn.close()
+        row = document_cache.get_or_set(7, ('document:7',), load)
+        return row['views'] + counter.pending('document', 7)
+
+    assert shown() == 10
+    counter.record('document', 7)
+    counter.record('document', 7)
+    assert shown() == 12
+
+    assert counter.flush() == 2
+    assert counter.pending('document', 7) == 0
+    assert shown() == 12
@@ -0,0 +1,120 @@
+"""
+Thumbnails and first-page images for uploaded documents.
+
+Each PDF or HTML blob gets two renditions stored next to it in the blob store:
+``<blob>.thumb.<ext>`` for feed and search cards and ``<blob>.page.<ext>`` for
+the preview modal to show while the full document loads. They are removed
+together with the blob, but unlike it they can change under the same URL (a
+text card is replaced by a PNG once PyMuPDF is available), so they get the
+revalidating ``rendition`` cache policy rather than the immutable one.
+
+With PyMuPDF installed PDFs are rendered to PNG; otherwise (and for HTML,
+which would need a browser engine to render) a lightweight SVG card with the
+document's opening text is produced. Rendering runs on a small background pool
+so uploads don't wait for it.
+"""
+
+import os
+import html
+import textwrap
+from document_processor import build_preview
+from derived_files import BackgroundQueue, write_atomic
+
+# PyMuPDF is optional; without it PDFs get text cards like HTML documents
+try:
+    import fitz
+except ImportError:
+    fitz = None
+
+# Width in pixels of each rendition
+RENDITIONS = {
+    'thumb': 240,
+    'page': 800,
+}
+
+RENDERABLE_EXTENSIONS = {'.pdf', '.html', '.htm'}
+
+# Checked in order, so a PNG render wins over an earlier text card
+RENDITION_FORMATS = (('.png', 'image/png'), ('.svg', 'image/svg+xml'))
+
+# Portrait page proportions (A4) for text cards
+PAGE_RATIO = 1.414
+
+render_queue = BackgroundQueue('thumbnails', workers=2)
+
+
+def can_render(file_path):
+    return os.path.splitext(file_path or '')[1].lower() in RENDERABLE_EXTENSIONS
+
+
+def find_rendition(upload_folder, file_path, kind):
+    """Return ``(relative_path, mimetype)`` of an existing rendition, or None."""
+    for ext, mimetype in RENDITION_FORMATS:
+        rel_path = f'{file_path}.{kind}{ext}'
+        if os.path.exists(os.path.join(upload_folder, *rel_path.split('/'))):
+            return rel_path, mimetype
+    return None
+
+
+def _render_pdf_page(source, width):
+    with fitz.open(source) as doc:
+        page = doc[0]
+        zoom = width / page.rect.width
+        return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False).tobytes('png')
+
+
+def _text_card(text, label, width):
+    """An SVG page showing the start of the document's text."""
+    height = round(width * PAGE_RATIO)
+    font_size = max(8, width // 30)
+    line_height = round(font_size * 1.4)
+    margin = font_size * 2
+    chars_per_line = max(10, int((width - 2 * margin) / (font_size * 0.55)))
+    max_lines = max(1, (height - 2 * margin - line_height) // line_height)
+    lines = textwrap.wrap(text, chars_per_line)[:max_lines]
+
+    rows = [
+        f'<text x="{margin}" y="{margin + (i + 2) * line_height}">{html.escape(line)}</text>'
+        for i, line in enumerate(lines)
+    ]
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}">'
+        f'<rect width="100%" height="100%" fill="#fff" stroke="#dee2e6"/>'
+        f'<text x="{margin}" y="{margin + line_height}" font-family="sans-serif" '
+        f'font-size="{font_size}" font-weight="bold" fill="#0d6efd">{html.escape(label)}</text>'
+        f'<g font-family="sans-serif" font-size="{font_size}" fill="#495057">{"".join(rows)}</g>'
+        f'</svg>'
+    ).encode('utf-8')
+
+
+def render_renditions(upload_folder, file_path):
+    """Render the missing renditions of a stored file. Returns the kinds written."""
+    if not can_render(file_path):
+        return []
+    source = os.path.join(upload_folder, *file_path.split('/'))
+    ext = os.path.splitext(file_path)[1].lower()
+    use_pdf_renderer = ext == '.pdf' and fitz is not None
+    text = None
+    written = []
+
+    for kind, width in RENDITIONS.items():
+        existing = find_rendition(upload_folder, file_path, kind)
+        if existing and (existing[0].endswith('.png') or not use_pdf_renderer):
+            continue
+        if use_pdf_renderer:
+            data, suffix = _render_pdf_page(source, width), '.png'
+        else:
+            if text is None:
+                # Enough text to fill the larger rendition
+                text = build_preview(source, excerpt_length=2000)['excerpt']
+            data, suffix = _text_card(text, ext.lstrip('.').upper(), width), '.svg'
+        write_atomic(f'{source}.{kind}{suffix}', data)
+        written.append(kind)
+    return written
+
+
+def schedule_render(upload_folder, file_path):
+    """Queue a file for background rendering; duplicate requests are ignored."""
+    if can_render(file_path):
+        render_queue.submit(file_path, render_renditions, upload_folder, file_path)
@@ -0,0 +1,78 @@
+"""
+Timestamp storage.
+
+Every TIMESTAMP column holds UTC time in one strict format,
+``YYYY-MM-DD HH:MM:SS`` (what SQLite's ``CURRENT_TIMESTAMP`` writes), so text
+order is time order and the ``created_at`` indexes serve sorts directly.
+Connections are opened with ``PARSE_DECLTYPES`` and the converter registered
+here, so those columns arrive as ``datetime`` objects and templates only
+format them. Computed columns such as ``MAX(created_at)`` are still strings.
+"""
+
+import sqlite3
+from datetime import datetime, timezone
+from flask.json.provider import DefaultJSONProvider
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Bumped into PRAGMA user_version once stored timestamps are canonical
+TIMESTAMPS_SCHEMA_VERSION = 1
+
+
+def utc_now():
+    """The current time as a naive UTC datetime, the form stored timestamps take."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def format_timestamp(value):
+    """The canonical stored form of a naive UTC datetime."""
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+def parse_timestamp(value):
+    """A datetime from a stored timestamp, or the text itself if it isn't one."""
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return value
+
+
+sqlite3.register_converter('timestamp', parse_timestamp)
+sqlite3.register_adapter(datetime, format_timestamp)
+
+
+def normalize_timestamps(conn):
+    """Rewrite every TIMESTAMP value not already in the canonical format.
+
+    Runs once per database (tracked in ``PRAGMA user_version``). Values with
+    a UTC offset are converted to UTC; ones SQLite can't parse are left alone.
+    The caller commits.
+    """
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= TIMESTAMPS_SCHEMA_VERSION:
+        return
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    for table in tables:
+        for column in conn.execute(f'PRAGMA table_info("{table}")').fetchall():
+            if (column[2] or '').upper() != 'TIMESTAMP':
+                continue
+            canonical = f"strftime('%Y-%m-%d %H:%M:%S', \"{column[1]}\")"
+            conn.execute(f'''UPDATE "{table}" SET "{column[1]}" = {canonical}
+                             WHERE {canonical} IS NOT NULL AND "{column[1]}" != {canonical}''')
+    conn.execute(f'PRAGMA user_version = {TIMESTAMPS_SCHEMA_VERSION}')
+
+
+class TimestampJSONProvider(DefaultJSONProvider):
+    """Serialises datetimes in the stored format, as the API returned them before."""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, datetime):
+            return format_timestamp(o)
+        return DefaultJSONProvider.default(o)
+
+
+def init_timestamps(app):
+    app.json = TimestampJSONProvider(app)
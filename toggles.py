@@ -0,0 +1,103 @@
+"""
+Per-user on/off toggles on items (stars, bookmarks, ...) with maintained counts.
+
+A toggle is one row per (user, item) in its table. Flipping it is an
+``INSERT ... ON CONFLICT DO NOTHING`` that only succeeds when the item exists,
+falling back to ``DELETE ... RETURNING`` when the row was already there, and
+the item's total in ``ItemCounters`` is adjusted in the same transaction. No
+separate existence or state checks are needed, and two clicks racing each
+other are serialized by SQLite's write lock instead of surfacing as
+``IntegrityError``.
+
+Counter rows are created on first use from the actual row count, so items
+toggled before ``ItemCounters`` existed start out correct.
+"""
+
+import json
+
+# Toggle kind -> (table with one row per user and item, counter name)
+TOGGLES = {
+    'star': ('Stars', 'stars'),
+    'bookmark': ('Bookmarks', 'bookmarks'),
+}
+
+# Item type as used by the toggle tables -> table the item lives in
+ITEM_TABLES = {
+    'answer': 'Answers',
+    'document': 'Documents',
+    'question': 'Questions',
+    # Bookmarks use capitalised item types
+    'Document': 'Documents',
+    'Question': 'Questions',
+}
+
+
+def _adjust_counter(conn, table, counter, item_type, item_id, delta):
+    row = conn.execute(
+        '''UPDATE ItemCounters SET count = max(count + ?, 0)
+           WHERE item_type = ? AND item_id = ? AND counter = ?
+           RETURNING count''', (delta, item_type, item_id, counter)).fetchone()
+    if row:
+        return row['count']
+    # First toggle since counters were introduced: seed from the rows themselves
+    return conn.execute(
+        f'''INSERT INTO ItemCounters (item_type, item_id, counter, count)
+            SELECT ?, ?, ?, COUNT(*) FROM {table} WHERE item_type = ? AND item_id = ?
+            RETURNING count''', (item_type, item_id, counter, item_type, item_id)).fetchone()['count']
+
+
+def toggle(conn, kind, user_id, item_type, item_id):
+    """Flip a user's toggle on an item.
+
+    Returns ``(active, count)`` with the new state and the item's total, or
+    None if the item doesn't exist. The caller commits.
+    """
+    table, counter = TOGGLES[kind]
+    item_table = ITEM_TABLES[item_type]
+
+    inserted = conn.execute(
+        f'''INSERT INTO {table} (user_id, item_type, item_id)
+            SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM {item_table} WHERE id = ?)
+            ON CONFLICT (user_id, item_type, item_id) DO NOTHING''',
+        (user_id, item_type, item_id, item_id)).rowcount
+    if inserted:
+        return True, _adjust_counter(conn, table, counter, item_type, item_id, 1)
+
+    removed = conn.execute(
+        f'DELETE FROM {table} WHERE user_id = ? AND item_type = ? AND item_id = ? RETURNING id',
+        (user_id, item_type, item_id)).fetchone()
+    if not removed:
+        # Nothing to insert into and nothing to remove: the item is gone
+        return None
+    return False, _adjust_counter(conn, table, counter, item_type, item_id, -1)
+
+
+def get_count(conn, kind, item_type, item_id):
+    """Current total of a toggle on an item."""
+    table, counter = TOGGLES[kind]
+    row = conn.execute(
+        'SELECT count FROM ItemCounters WHERE item_type = ? AND item_id = ? AND counter = ?',
+        (item_type, item_id, counter)).fetchone()
+    if row:
+        return row['count']
+    return conn.execute(
+        f'SELECT COUNT(*) AS count FROM {table} WHERE item_type = ? AND item_id = ?',
+        (item_type, item_id)).fetchone()['count']
+
+
+def get_counts(conn, kind, item_type, item_ids):
+    """Current totals of a toggle on many items, as ``{item_id: count}``."""
+    table, counter = TOGGLES[kind]
+    counts = {row['item_id']: row['count'] for row in conn.execute(
+        '''SELECT item_id, count FROM ItemCounters
+           WHERE item_type = ? AND item_id IN (SELECT value FROM json_each(?)) AND counter = ?''',
+        (item_type, json.dumps([int(i) for i in item_ids]), counter))}
+    missing = [item_id for item_id in item_ids if item_id not in counts]
+    if missing:
+        # Items without a counter row yet, as in get_count
+        counts.update(dict.fromkeys(missing, 0))
+        counts.update((row['item_id'], row['count']) for row in conn.execute(
+            f'''SELECT item_id, COUNT(*) AS count FROM {table}
+                WHERE item_type = ? AND item_id IN (SELECT value FROM json_each(?))
+                GROUP BY item_id''', (item_type, json.dumps(missing))))
+    return counts
@@ -0,0 +1,501 @@
+"""
+Streaming, content-addressed upload storage.
+
+Uploads are written to disk in fixed-size chunks while a SHA-256 digest is
+computed, then atomically renamed into a content-addressed blob store under
+the uploads folder (``blobs/ab/cd/<sha256><ext>``). Identical files are stored
+once; the ``Blobs`` table counts how many Documents and Questions point at
+each blob, and blobs are garbage collected when the last reference goes away.
+
+Large files can also be sent through a resumable chunked-upload API so that no
+single request has to carry the whole file.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from flask import Request, current_app
+from werkzeug.utils import secure_filename
+from derived_files import TEMP_PREFIX
+
+try:
+    import fcntl
+except ImportError:  # Windows: chunk appends are only serialized within one process
+    fcntl = None
+
+# Size of the blocks read from request bodies and files
+CHUNK_SIZE = 64 * 1024
+
+# Directory (inside the uploads folder) holding in-progress chunked uploads
+PARTIAL_DIR = '.partial'
+
+# Directory (inside the uploads folder) holding content-addressed blobs
+BLOB_DIR = 'blobs'
+
+# Abandoned chunked uploads are removed after this many seconds
+PARTIAL_UPLOAD_TTL = 24 * 60 * 60
+
+# Chunked uploads one user may have started and not yet finished
+MAX_OPEN_UPLOADS = 5
+
+# Files derived from a blob and stored beside it as ``<blob><suffix>``: page texts
+# (document_pages), renditions (thumbnails) and precompressed variants of the blob
+# and of SVG renditions (file_serving)
+_DERIVED = ('', '.pages', '.pages.idx', '.thumb.png', '.thumb.svg', '.page.png', '.page.svg')
+DERIVATIVE_SUFFIXES = tuple(suffix + encoding for suffix in _DERIVED for encoding in ('', '.gz', '.br')
+                            if suffix + encoding)
+
+_UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+_EXTENSION_RE = re.compile(r'^\.[a-z0-9]{1,10}$')
+_BLOB_PATH_RE = re.compile(rf'^{BLOB_DIR}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/[0-9a-f]{{64}}(\.[a-z0-9]{{1,10}})?$')
+
+
+class UploadError(Exception):
+    """Raised when an upload request cannot be accepted."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class HashingFile:
+    """Temporary file in the upload folder that hashes everything written to it."""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.name = tempfile.mkstemp(dir=directory, prefix='.upload-', suffix='.tmp')
+        self._file = os.fdopen(fd, 'w+b')
+        self._sha256 = hashlib.sha256()
+        self._committed = False
+        self.size = 0
+
+    def write(self, data):
+        self._sha256.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+    def finish(self):
+        """Flush the file to disk and keep it after ``close()``; returns its path."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._committed = True
+        return self.name
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if not self._committed and os.path.exists(self.name):
+            os.remove(self.name)
+
+    def __getattr__(self, name):
+        # seek/read/tell/flush etc. are served by the underlying file
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class StreamingRequest(Request):
+    """Request class that streams multipart file parts straight into the uploads folder."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        return HashingFile(current_app.config['UPLOAD_FOLDER'])
+
+
+def blob_path(sha256, original_name):
+    """Return the path of a blob relative to the uploads folder.
+
+    The extension of the original filename is kept so the file type can still
+    be told from the path.
+    """
+    ext = os.path.splitext(secure_filename(original_name or ''))[1].lower()
+    if not _EXTENSION_RE.match(ext):
+        ext = ''
+    return f'{BLOB_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}'
+
+
+def is_blob_path(path):
+    """Whether ``path`` points into the content-addressed blob store."""
+    return bool(path) and path.startswith(f'{BLOB_DIR}/')
+
+
+def is_servable_path(path):
+    """Whether ``path`` may be served as an upload: a blob as ``blob_path`` names it,
+    or a pre-blob-store upload saved directly in the uploads folder.
+
+    Partial uploads, temporary files (all dot-names) and the renditions and page
+    texts stored beside blobs are not.
+    """
+    if not path or any(not part or part.startswith('.') for part in path.split('/')):
+        return False
+    if '/' not in path:
+        return secure_filename(path) == path
+    return bool(_BLOB_PATH_RE.match(path))
+
+
+def remove_with_derivatives(full_path):
+    """Delete a stored file together with the siblings derived from it (``<name>.gz`` etc.).
+
+    Only the known ``DERIVATIVE_SUFFIXES`` are removed: ``<sha256>`` and
+    ``<sha256>.pdf`` are separate blobs, and one must not take the other along.
+    """
+    for path in (full_path, *(full_path + suffix for suffix in DERIVATIVE_SUFFIXES)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def hash_file(path):
+    """Compute the SHA-256 of a file on disk in constant memory."""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def receive_upload(file_storage, upload_folder):
+    """Persist an uploaded ``FileStorage`` to a temporary file.
+
+    Returns ``(temp_path, sha256, size)`` ready to be passed to ``add_blob``.
+    Files parsed by ``StreamingRequest`` are already on disk and hashed; any
+    other stream is copied in chunks.
+    """
+    stream = file_storage.stream
+    if not isinstance(stream, HashingFile):
+        stream.seek(0)
+        target = HashingFile(upload_folder)
+        try:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                target.write(chunk)
+        except Exception:
+            target.close()
+            raise
+        stream = target
+
+    return stream.finish(), stream.hexdigest(), stream.size
+
+
+def add_blob(conn, upload_folder, temp_path, sha256, size, original_name):
+    """Move a received file into the blob store and take a reference to it.
+
+    The reference is taken on ``conn`` before the file is moved so that a
+    concurrent ``collect_garbage`` (which needs the same write lock) cannot
+    delete the blob in between. The caller commits. Returns the blob path.
+    """
+    path = blob_path(sha256, original_name)
+    conn.execute(
+        '''INSERT INTO Blobs (path, sha256, size, ref_count) VALUES (?, ?, ?, 1)
+           ON CONFLICT(path) DO UPDATE SET ref_count = ref_count + 1''',
+        (path, sha256, size))
+
+    destination = os.path.join(upload_folder, *path.split('/'))
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    # Replacing an existing blob is harmless: its content is identical
+    os.replace(temp_path, destination)
+    return path
+
+
+def release_blob(conn, path):
+    """Drop one reference to a blob. Returns False if ``path`` is not a managed blob."""
+    if not is_blob_path(path):
+        return False
+    cursor = conn.execute('UPDATE Blobs SET ref_count = ref_count - 1 WHERE path = ?', (path,))
+    return cursor.rowcount > 0
+
+
+def collect_garbage(conn, upload_folder):
+    """Delete blobs that are no longer referenced and return how many were removed.
+
+    Files are removed while the write lock taken by the DELETE is held, so
+    ``add_blob`` can never see a row that is about to disappear.
+    """
+    rows = conn.execute('DELETE FROM Blobs WHERE ref_count <= 0 RETURNING path').fetchall()
+    for row in rows:
+        remove_with_derivatives(os.path.join(upload_folder, *row['path'].split('/')))
+    conn.commit()
+    return len(rows)
+
+
+def sweep_orphans(conn, upload_folder, min_age=PARTIAL_UPLOAD_TTL):
+    """Remove blob files with no ``Blobs`` row and leftover temp files.
+
+    Only files older than ``min_age`` seconds are touched so uploads that are
+    still in flight are left alone. Returns the number of files removed.
+    """
+    known = {row['path'] for row in conn.execute('SELECT path FROM Blobs')}
+    cutoff = time.time() - min_age
+    removed = 0
+    for root, dirs, files in os.walk(upload_folder):
+        rel_root = os.path.relpath(root, upload_folder).replace(os.sep, '/')
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in files:
+            rel_path = name if rel_root == '.' else f'{rel_root}/{name}'
+            is_temp = name.startswith(('.upload-', TEMP_PREFIX))
+            if not is_temp and (not is_blob_path(rel_path)
+                                or not known.isdisjoint(_blob_candidates(rel_path))):
+                continue
+            full_path = os.path.join(root, name)
+            try:
+                if os.path.getmtime(full_path) < cutoff:
+                    os.remove(full_path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def _blob_candidates(rel_path):
+    """Blob paths a file may belong to: itself, or the blob it was derived from."""
+    directory, name = rel_path.rsplit('/', 1)
+    sha256, rest = name[:64], name[64:]
+    ext = '.' + rest.split('.')[1] if rest.startswith('.') else ''
+    return {rel_path, f'{directory}/{sha256}', f'{directory}/{sha256}{ext}'}
+
+
+def import_legacy_file(conn, upload_folder, filename):
+    """Move a pre-blob-store upload into the blob store and return its blob path."""
+    source = os.path.join(upload_folder, filename)
+    sha256 = hash_file(source)
+    path = add_blob(conn, upload_folder, source, sha256, os.path.getsize(source), filename)
+    # Variants of the old file are regenerated next to the blob on demand
+    remove_with_derivatives(source)
+    return path
+
+
+def _partial_dir(upload_folder):
+    path = os.path.join(upload_folder, PARTIAL_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _partial_paths(upload_folder, upload_id):
+    if not upload_id or not _UPLOAD_ID_RE.match(upload_id):
+        raise UploadError('Invalid upload id', 404)
+    directory = _partial_dir(upload_folder)
+    return (os.path.join(directory, f'{upload_id}.json'),
+            os.path.join(directory, f'{upload_id}.part'))
+
+
+def _load_upload(upload_folder, upload_id, user_id):
+    meta_path, part_path = _partial_paths(upload_folder, upload_id)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        raise UploadError('Upload not found', 404)
+    if meta['user_id'] != user_id:
+        raise UploadError('Upload not found', 404)
+    return meta, part_path
+
+
+_append_lock = threading.Lock()
+
+# Running SHA-256 of the chunked uploads this worker appended to, as
+# {upload_id: (bytes hashed, sha256)}, so finishing one doesn't re-read the file
+_upload_hashes = {}
+_upload_hashes_lock = threading.Lock()
+
+
+@contextmanager
+def _locked_upload(f):
+    """Hold an exclusive lock on the open ``.part`` file of a chunked upload.
+
+    Buffered writes are flushed before the lock is let go, so the next holder
+    sees the file at its full size.
+    """
+    if fcntl is None:
+        with _append_lock:
+            try:
+                yield
+            finally:
+                f.flush()
+        return
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        f.flush()
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _running_hash(upload_id, f, offset):
+    """Take the running SHA-256 of an upload, brought up to ``offset`` bytes.
+
+    Only the bytes this worker has not hashed yet (chunks appended by other
+    workers, or everything after a restart) are read back from ``f``; call it
+    with the upload locked.
+    """
+    with _upload_hashes_lock:
+        hashed, sha256 = _upload_hashes.pop(upload_id, (0, None))
+    if sha256 is None or hashed > offset:
+        hashed, sha256 = 0, hashlib.sha256()
+    f.seek(hashed)
+    while hashed < offset:
+        chunk = f.read(min(CHUNK_SIZE, offset - hashed))
+        if not chunk:
+            raise UploadError('Upload file is shorter than expected', 409)
+        sha256.update(chunk)
+        hashed += len(chunk)
+    return sha256
+
+
+def _keep_running_hash(upload_id, hashed, sha256):
+    with _upload_hashes_lock:
+        _upload_hashes[upload_id] = (hashed, sha256)
+
+
+def cleanup_stale_uploads(upload_folder, max_age=PARTIAL_UPLOAD_TTL):
+    """Remove chunked uploads that have not been touched for ``max_age`` seconds."""
+    directory = _partial_dir(upload_folder)
+    cutoff = time.time() - max_age
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+    with _upload_hashes_lock:
+        for upload_id in list(_upload_hashes):
+            if not os.path.exists(os.path.join(directory, f'{upload_id}.part')):
+                del _upload_hashes[upload_id]
+
+
+def _open_uploads(upload_folder, user_id):
+    """Number of chunked uploads ``user_id`` has started and not yet claimed."""
+    directory = _partial_dir(upload_folder)
+    count = 0
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+                count += json.load(f).get('user_id') == user_id
+        except (OSError, ValueError):
+            pass
+    return count
+
+
+def create_chunked_upload(upload_folder, user_id, filename, size, max_size,
+                          max_open=MAX_OPEN_UPLOADS):
+    """Start a resumable upload and return its status.
+
+    A user can have at most ``max_open`` uploads in progress; each reserves up
+    to ``max_size`` bytes of disk until it is finished or expires.
+    """
+    if not filename or not secure_filename(filename):
+        raise UploadError('A filename is required')
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError('A valid file size is required')
+    if size <= 0:
+        raise UploadError('A valid file size is required')
+    if size > max_size:
+        raise UploadError(f'File is too large (maximum {max_size // (1024 * 1024)} MB)', 413)
+
+    cleanup_stale_uploads(upload_folder)
+
+    upload_id = uuid.uuid4().hex
+    meta_path, part_path = _partial_paths(upload_folder, upload_id)
+    open(part_path, 'wb').close()
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({'filename': filename, 'size': size, 'user_id': user_id,
+                   'created_at': time.time()}, f)
+
+    # Counted after this upload exists, so concurrent requests can't all slip
+    # in under the limit
+    if _open_uploads(upload_folder, user_id) > max_open:
+        os.remove(meta_path)
+        os.remove(part_path)
+        raise UploadError(f'Too many unfinished uploads (maximum {max_open}); '
+                          'finish one or wait for it to expire', 429)
+    return {'upload_id': upload_id, 'offset': 0, 'size': size}
+
+
+def get_chunked_upload(upload_folder, upload_id, user_id):
+    """Return the current offset of a resumable upload."""
+    meta, part_path = _load_upload(upload_folder, upload_id, user_id)
+    offset = os.path.getsize(part_path)
+    return {'upload_id': upload_id, 'offset': offset, 'size': meta['size'],
+            'complete': offset == meta['size']}
+
+
+def parse_content_range(header):
+    """Parse ``bytes start-end/total`` into a ``(start, end, total)`` tuple."""
+    match = re.match(r'^bytes (\d+)-(\d+)/(\d+)$', (header or '').strip())
+    if not match:
+        raise UploadError('A valid Content-Range header is required')
+    start, end, total = (int(part) for part in match.groups())
+    if end < start:
+        raise UploadError('Invalid Content-Range header')
+    return start, end, total
+
+
+def append_chunk(upload_folder, upload_id, user_id, stream, content_range):
+    """Append one chunk of a resumable upload, reading ``stream`` block by block."""
+    meta, part_path = _load_upload(upload_folder, upload_id, user_id)
+    start, end, total = parse_content_range(content_range)
+
+    if total != meta['size'] or end >= total:
+        raise UploadError('Content-Range does not match the upload size')
+
+    remaining = end - start + 1
+    with open(part_path, 'r+b') as f, _locked_upload(f):
+        # The offset is checked under the lock, so of two requests sending the
+        # same chunk one appends it and the other gets the 409
+        offset = os.fstat(f.fileno()).st_size
+        if start != offset:
+            # Client is out of sync; it should resume from the returned offset
+            raise UploadError(f'Expected chunk starting at byte {offset}', 409)
+
+        sha256 = _running_hash(upload_id, f, offset)
+        before = sha256.copy()
+        f.seek(offset)
+        while remaining > 0:
+            chunk = stream.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            f.write(chunk)
+            sha256.update(chunk)
+            remaining -= len(chunk)
+        if remaining:
+            # Drop the incomplete chunk so the client can retry it cleanly
+            f.truncate(offset)
+            _keep_running_hash(upload_id, offset, before)
+            raise UploadError('Chunk body is shorter than its Content-Range')
+        _keep_running_hash(upload_id, end + 1, sha256)
+
+    return get_chunked_upload(upload_folder, upload_id, user_id)
+
+
+def claim_chunked_upload(upload_folder, upload_id, user_id):
+    """Finish a completed chunked upload and hand it over for storage.
+
+    Returns ``(temp_path, sha256, size, original_name)``; pass the first four
+    values to ``add_blob``.
+    """
+    meta, part_path = _load_upload(upload_folder, upload_id, user_id)
+    with open(part_path, 'rb') as f, _locked_upload(f):
+        size = os.fstat(f.fileno()).st_size
+        if size != meta['size']:
+            raise UploadError('Upload is not complete yet', 409)
+        sha256 = _running_hash(upload_id, f, size).hexdigest()
+
+    meta_path, _ = _partial_paths(upload_folder, upload_id)
+    os.remove(meta_path)
+    return part_path, sha256, size, meta['filename']
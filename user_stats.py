@@ -0,0 +1,153 @@
+"""
+Per-user contribution statistics.
+
+``UserStats`` holds one row per user with their documents, questions and
+answers, plus the stars and views their content has received. The counts are
+kept up to date by SQLite triggers on the underlying tables, so every write
+path (including batched view flushes) maintains them in the same transaction
+and profile pages and leaderboards read a single row per user.
+"""
+
+STAT_COLUMNS = ('documents', 'questions', 'answers', 'stars_received', 'views_received')
+
+# Owner of the item a Stars row points at
+_STAR_OWNER = '''
+    SELECT user_id FROM Documents WHERE {row}.item_type = 'document' AND id = {row}.item_id
+    UNION ALL
+    SELECT user_id FROM Answers WHERE {row}.item_type = 'answer' AND id = {row}.item_id
+    UNION ALL
+    SELECT user_id FROM Questions WHERE {row}.item_type = 'question' AND id = {row}.item_id
+'''
+
+_TRIGGERS = {
+    'trg_user_stats_document_insert': '''
+        AFTER INSERT ON Documents BEGIN
+            INSERT INTO UserStats (user_id, documents) VALUES (NEW.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET documents = documents + 1;
+        END''',
+    'trg_user_stats_document_delete': '''
+        AFTER DELETE ON Documents BEGIN
+            UPDATE UserStats SET
+                documents = max(documents - 1, 0),
+                views_received = max(views_received - COALESCE(OLD.views, 0), 0),
+                stars_received = max(stars_received - (
+                    SELECT COUNT(*) FROM Stars WHERE item_type = 'document' AND item_id = OLD.id), 0)
+            WHERE user_id = OLD.user_id;
+        END''',
+    'trg_user_stats_document_views': '''
+        AFTER UPDATE OF views ON Documents WHEN NEW.views IS NOT OLD.views BEGIN
+            UPDATE UserStats SET views_received = views_received + COALESCE(NEW.views, 0) - COALESCE(OLD.views, 0)
+            WHERE user_id = NEW.user_id;
+        END''',
+    'trg_user_stats_question_insert': '''
+        AFTER INSERT ON Questions BEGIN
+            INSERT INTO UserStats (user_id, questions) VALUES (NEW.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET questions = questions + 1;
+        END''',
+    'trg_user_stats_question_delete': '''
+        AFTER DELETE ON Questions BEGIN
+            UPDATE UserStats SET
+                questions = max(questions - 1, 0),
+                views_received = max(views_received - COALESCE(OLD.views, 0), 0),
+                stars_received = max(stars_received - (
+                    SELECT COUNT(*) FROM Stars WHERE item_type = 'question' AND item_id = OLD.id), 0)
+            WHERE user_id = OLD.user_id;
+        END''',
+    'trg_user_stats_question_views': '''
+        AFTER UPDATE OF views ON Questions WHEN NEW.views IS NOT OLD.views BEGIN
+            UPDATE UserStats SET views_received = views_received + COALESCE(NEW.views, 0) - COALESCE(OLD.views, 0)
+            WHERE user_id = NEW.user_id;
+        END''',
+    'trg_user_stats_answer_insert': '''
+        AFTER INSERT ON Answers BEGIN
+            INSERT INTO UserStats (user_id, answers) VALUES (NEW.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET answers = answers + 1;
+        END''',
+    'trg_user_stats_answer_delete': '''
+        AFTER DELETE ON Answers BEGIN
+            UPDATE UserStats SET
+                answers = max(answers - 1, 0),
+                stars_received = max(stars_received - (
+                    SELECT COUNT(*) FROM Stars WHERE item_type = 'answer' AND item_id = OLD.id), 0)
+            WHERE user_id = OLD.user_id;
+        END''',
+    'trg_user_stats_star_insert': f'''
+        AFTER INSERT ON Stars BEGIN
+            INSERT INTO UserStats (user_id, stars_received)
+            SELECT user_id, 1 FROM ({_STAR_OWNER.format(row='NEW')}) WHERE user_id IS NOT NULL
+            ON CONFLICT (user_id) DO UPDATE SET stars_received = stars_received + 1;
+        END''',
+    'trg_user_stats_star_delete': f'''
+        AFTER DELETE ON Stars BEGIN
+            UPDATE UserStats SET stars_received = max(stars_received - 1, 0)
+            WHERE user_id IN ({_STAR_OWNER.format(row='OLD')});
+        END''',
+}
+
+
+def rebuild_user_stats(conn):
+    """Recompute every user's statistics from scratch. The caller commits."""
+    conn.execute('DELETE FROM UserStats')
+    conn.execute(f'''
+        INSERT INTO UserStats (user_id, {', '.join(STAT_COLUMNS)})
+        SELECT u.id,
+               (SELECT COUNT(*) FROM Documents WHERE user_id = u.id),
+               (SELECT COUNT(*) FROM Questions WHERE user_id = u.id),
+               (SELECT COUNT(*) FROM Answers WHERE user_id = u.id),
+               (SELECT COUNT(*) FROM Stars s JOIN Documents d ON s.item_type = 'document' AND s.item_id = d.id
+                 WHERE d.user_id = u.id)
+             + (SELECT COUNT(*) FROM Stars s JOIN Answers a ON s.item_type = 'answer' AND s.item_id = a.id
+                 WHERE a.user_id = u.id)
+             + (SELECT COUNT(*) FROM Stars s JOIN Questions q ON s.item_type = 'question' AND s.item_id = q.id
+                 WHERE q.user_id = u.id),
+               (SELECT COALESCE(SUM(views), 0) FROM Documents WHERE user_id = u.id)
+             + (SELECT COALESCE(SUM(views), 0) FROM Questions WHERE user_id = u.id)
+        FROM Users u
+    ''')
+
+
+def init_user_stats(conn):
+    """Create the UserStats table and its triggers, filling it in on first creation."""
+    created = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'UserStats'").fetchone() is None
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS UserStats (
+            user_id INTEGER PRIMARY KEY,
+            documents INTEGER NOT NULL DEFAULT 0,
+            questions INTEGER NOT NULL DEFAULT 0,
+            answers INTEGER NOT NULL DEFAULT 0,
+            stars_received INTEGER NOT NULL DEFAULT 0,
+            views_received INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES Users(id)
+        )
+    ''')
+    for name, body in _TRIGGERS.items():
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+    # One index per statistic so every leaderboard is read in order
+    for column in STAT_COLUMNS:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_user_stats_{column} ON UserStats({column})')
+    conn.execute('DROP INDEX IF EXISTS idx_user_stats_stars')
+    if created:
+        rebuild_user_stats(conn)
+
+
+def get_user_stats(conn, user_id):
+    """Return a user's statistics as a dict (all zero for users without activity)."""
+    row = conn.execute(
+        f'SELECT {", ".join(STAT_COLUMNS)} FROM UserStats WHERE user_id = ?', (user_id,)).fetchone()
+    if row is None:
+        return dict.fromkeys(STAT_COLUMNS, 0)
+    return dict(row)
+
+
+def top_contributors(conn, metric='stars_received', limit=10):
+    """Users ranked by one statistic, for leaderboards."""
+    if metric not in STAT_COLUMNS:
+        raise ValueError(f'Unknown statistic: {metric}')
+    rows = conn.execute(
+        f'''SELECT u.id, u.name, u.avatar_url, s.{metric} AS value
+            FROM UserStats s JOIN Users u ON u.id = s.user_id
+            WHERE s.{metric} > 0
+            ORDER BY s.{metric} DESC, u.id
+            LIMIT ?''', (limit,)).fetchall()
+    return [dict(row) for row in rows]
@@ -0,0 +1,201 @@
+"""
+Write-behind view counting.
+
+Page views are accumulated in memory and written to the database in one
+batched transaction every few seconds, so viewing a document or question no
+longer takes the SQLite write lock. Losses on a crash are bounded: a flush is
+forced once ``max_pending`` views are waiting, and pending views are flushed
+at interpreter exit.
+
+Each worker process keeps its own accumulator; the flusher thread is started
+lazily (and restarted after a fork) on the first recorded view.
+"""
+
+import os
+import time
+import atexit
+import threading
+from db_utils import get_db_connection
+from cache import invalidate
+
+# Table holding the ``views`` column for each item type
+VIEW_TABLES = {
+    'document': 'Documents',
+    'question': 'Questions',
+}
+
+
+class ViewCounter:
+    def __init__(self, flush_interval=5.0, max_pending=1000, dedup_window=0):
+        self.flush_interval = flush_interval
+        # Views waiting before a flush is forced
+        self.max_pending = max_pending
+        # Seconds during which repeat views by the same user are ignored (0 = count all)
+        self.dedup_window = dedup_window
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = {}
+        self._pending_total = 0
+        self._oldest_pending = None
+        self._recent = {}
+        self._thread = None
+        self._pid = None
+        self._metrics = {
+            'recorded': 0,
+            'deduplicated': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'flushed_views': 0,
+            'last_flush_rows': 0,
+            'last_flush_views': 0,
+            'last_flush_seconds': 0.0,
+            'last_flush_lag_seconds': 0.0,
+            'max_flush_lag_seconds': 0.0,
+            'last_flush_at': None,
+        }
+
+    def configure(self, flush_interval=None, max_pending=None, dedup_window=None):
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        if max_pending is not None:
+            self.max_pending = max_pending
+        if dedup_window is not None:
+            self.dedup_window = dedup_window
+
+    def record(self, item_type, item_id, user_id=None):
+        """Count a view of an item. Returns False if it was dropped as a repeat view."""
+        if item_type not in VIEW_TABLES:
+            raise ValueError(f'Unknown item type: {item_type}')
+        now = time.monotonic()
+        with self._lock:
+            if self.dedup_window and user_id is not None:
+                key = (user_id, item_type, item_id)
+                last_seen = self._recent.get(key)
+                if last_seen is not None and now - last_seen < self.dedup_window:
+                    self._metrics['deduplicated'] += 1
+                    return False
+                self._recent[key] = now
+
+            self._pending[(item_type, item_id)] = self._pending.get((item_type, item_id), 0) + 1
+            self._pending_total += 1
+            self._metrics['recorded'] += 1
+            if self._oldest_pending is None:
+                self._oldest_pending = now
+            force_flush = self._pending_total >= self.max_pending
+
+        self._ensure_thread()
+        if force_flush:
+            self._wake.set()
+        return True
+
+    def pending(self, item_type, item_id):
+        """Views of an item that haven't been written yet, for display."""
+        with self._lock:
+            return self._pending.get((item_type, item_id), 0)
+
+    def flush(self):
+        """Write pending views in one transaction. Returns the number of views written."""
+        with self._flush_lock:
+            with self._lock:
+                batch = self._pending
+                total = self._pending_total
+                oldest = self._oldest_pending
+                self._pending = {}
+                self._pending_total = 0
+                self._oldest_pending = None
+                self._prune_recent()
+            if not batch:
+                return 0
+
+            started = time.monotonic()
+            try:
+                conn = get_db_connection()
+                try:
+                    with conn:
+                        for item_type, table in VIEW_TABLES.items():
+                            rows = [(count, item_id) for (kind, item_id), count in batch.items()
+                                    if kind == item_type]
+                            if rows:
+                                conn.executemany(
+                                    f'UPDATE {table} SET views = COALESCE(views, 0) + ? WHERE id = ?', rows)
+                finally:
+                    conn.close()
+            except Exception as e:
+                print(f"Error flushing view counts: {str(e)}")
+                self._requeue(batch, total, oldest)
+                with self._lock:
+                    self._metrics['flush_errors'] += 1
+                return 0
+
+            # Cached rows (tagged '<type>:<id>') still hold the old count, and the
+            # views just written are no longer pending to be added on top of it
+            invalidate(*(f'{kind}:{item_id}' for kind, item_id in batch))
+
+            finished = time.monotonic()
+            with self._lock:
+                lag = finished - oldest
+                self._metrics['flushes'] += 1
+                self._metrics['flushed_views'] += total
+                self._metrics['last_flush_rows'] = len(batch)
+                self._metrics['last_flush_views'] = total
+                self._metrics['last_flush_seconds'] = finished - started
+                self._metrics['last_flush_lag_seconds'] = lag
+                self._metrics['max_flush_lag_seconds'] = max(self._metrics['max_flush_lag_seconds'], lag)
+                self._metrics['last_flush_at'] = time.time()
+            return total
+
+    def stats(self):
+        """Counters for monitoring: flush sizes, lag and what is still pending."""
+        with self._lock:
+            stats = dict(self._metrics)
+            stats['pending_views'] = self._pending_total
+            stats['pending_rows'] = len(self._pending)
+            stats['pending_age_seconds'] = (
+                time.monotonic() - self._oldest_pending if self._oldest_pending is not None else 0.0)
+        return stats
+
+    def _requeue(self, batch, total, oldest):
+        # Merge a failed batch back so it is retried with the next flush
+        with self._lock:
+            for key, count in batch.items():
+                self._pending[key] = self._pending.get(key, 0) + count
+            self._pending_total += total
+            if self._oldest_pending is None or oldest < self._oldest_pending:
+                self._oldest_pending = oldest
+
+    def _prune_recent(self):
+        if not self._recent:
+            return
+        cutoff = time.monotonic() - self.dedup_window
+        self._recent = {key: seen for key, seen in self._recent.items() if seen > cutoff}
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='view-counter', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+view_counter = ViewCounter()
+atexit.register(view_counter.flush)
+
+
+def init_view_counter(app):
+    """Apply the app's VIEW_* settings to the shared counter."""
+    view_counter.configure(
+        flush_interval=app.config.get('VIEW_FLUSH_INTERVAL'),
+        max_pending=app.config.get('VIEW_MAX_PENDING'),
+        dedup_window=app.config.get('VIEW_DEDUP_WINDOW'),
+    )